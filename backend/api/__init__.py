@@ -10,5 +10,7 @@ media_rationale_bp = Blueprint('media_rationale', __name__, url_prefix='/api/v1/
 saved_rationale_bp = Blueprint('saved_rationale', __name__, url_prefix='/api/v1/saved-rationale')
 activity_logs_bp = Blueprint('activity_logs', __name__, url_prefix='/api/v1/activity-logs')
 dashboard_bp = Blueprint('dashboard', __name__, url_prefix='/api/v1/dashboard')
+llm_usage_bp = Blueprint('llm_usage', __name__, url_prefix='/api/v1/llm-usage')
+symbols_bp = Blueprint('symbols', __name__, url_prefix='/api/v1/symbols')
 
-from backend.api import auth, users, api_keys, pdf_template, uploaded_files, channels, media_rationale, saved_rationale, activity_logs, dashboard
+from backend.api import auth, users, api_keys, pdf_template, uploaded_files, channels, media_rationale, saved_rationale, activity_logs, dashboard, llm_usage, symbols
@@ -0,0 +1,165 @@
+from flask import request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from backend.utils.database import get_db_cursor
+from backend.api import llm_usage_bp
+from backend.models.user import User
+
+# USD per 1M tokens (prompt, completion) for cost estimates; unknown models cost 0
+MODEL_PRICES = {
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4o-mini': (0.15, 0.60),
+    # Batch API calls (logged by batch_mode) are billed at half price
+    'gpt-4o (batch)': (1.25, 5.00),
+    'gpt-4o-mini (batch)': (0.075, 0.30),
+}
+
+# Aggregation dimensions: group_by value -> SQL expression
+GROUP_COLUMNS = {
+    'day': "DATE(lc.created_at)",
+    'channel': "COALESCE(c.channel_name, 'Unknown')",
+    'step': "lc.step_number",
+}
+
+def is_admin(user_id):
+    user = User.find_by_id(user_id)
+    return user and user.get('role') == 'admin'
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0, 0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+def summarize(rows, key):
+    """
+    Fold per-model rows into one entry per group with a cost estimate.
+
+    Tokens and cost count billed (non-cache-hit) calls only; what cache hits
+    saved is reported separately as saved_tokens / saved_usd.
+    """
+    groups = {}
+    for row in rows:
+        group = groups.setdefault(row['group_key'], {
+            key: row['group_key'].isoformat() if hasattr(row['group_key'], 'isoformat') else row['group_key'],
+            'calls': 0, 'cache_hits': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+            'saved_tokens': 0, 'latency_ms': 0, 'cost_usd': 0.0, 'saved_usd': 0.0
+        })
+        group['calls'] += row['calls']
+        group['cache_hits'] += row['cache_hits']
+        group['prompt_tokens'] += row['prompt_tokens']
+        group['completion_tokens'] += row['completion_tokens']
+        group['saved_tokens'] += row['saved_prompt_tokens'] + row['saved_completion_tokens']
+        group['latency_ms'] += row['latency_ms']
+        group['cost_usd'] += estimate_cost(row['model'], row['prompt_tokens'], row['completion_tokens'])
+        group['saved_usd'] += estimate_cost(row['model'], row['saved_prompt_tokens'], row['saved_completion_tokens'])
+
+    result = list(groups.values())
+    for group in result:
+        api_calls = group['calls'] - group['cache_hits']
+        group['avg_latency_ms'] = int(group['latency_ms'] / api_calls) if api_calls else 0
+        group['cost_usd'] = round(group['cost_usd'], 4)
+        group['saved_usd'] = round(group['saved_usd'], 4)
+    return result
+
+@llm_usage_bp.route('', methods=['GET'])
+@jwt_required()
+def get_llm_usage():
+    """LLM calls, tokens, latency and estimated cost grouped by day, channel or step"""
+    try:
+        current_user_id = get_jwt_identity()
+
+        if not is_admin(current_user_id):
+            return jsonify({'error': 'Admin access required'}), 403
+
+        group_by = request.args.get('group_by', 'day')
+        if group_by not in GROUP_COLUMNS:
+            return jsonify({'error': f"group_by must be one of: {', '.join(GROUP_COLUMNS)}"}), 400
+
+        date_from = request.args.get('date_from')
+        date_to = request.args.get('date_to')
+
+        where_conditions = ['1=1']
+        query_params = []
+
+        if date_from:
+            where_conditions.append('lc.created_at >= %s')
+            query_params.append(date_from)
+
+        if date_to:
+            where_conditions.append('lc.created_at <= %s')
+            query_params.append(f'{date_to} 23:59:59')
+
+        where_clause = ' AND '.join(where_conditions)
+        group_column = GROUP_COLUMNS[group_by]
+
+        with get_db_cursor() as cursor:
+            cursor.execute(f"""
+                SELECT
+                    {group_column} as group_key,
+                    lc.model,
+                    COUNT(*) as calls,
+                    SUM(CASE WHEN lc.cache_hit THEN 1 ELSE 0 END) as cache_hits,
+                    COALESCE(SUM(CASE WHEN NOT lc.cache_hit THEN lc.prompt_tokens ELSE 0 END), 0) as prompt_tokens,
+                    COALESCE(SUM(CASE WHEN NOT lc.cache_hit THEN lc.completion_tokens ELSE 0 END), 0) as completion_tokens,
+                    COALESCE(SUM(CASE WHEN lc.cache_hit THEN lc.prompt_tokens ELSE 0 END), 0) as saved_prompt_tokens,
+                    COALESCE(SUM(CASE WHEN lc.cache_hit THEN lc.completion_tokens ELSE 0 END), 0) as saved_completion_tokens,
+                    COALESCE(SUM(lc.latency_ms), 0) as latency_ms
+                FROM llm_calls lc
+                LEFT JOIN jobs j ON lc.job_id = j.id
+                LEFT JOIN channels c ON j.channel_id = c.id
+                WHERE {where_clause}
+                GROUP BY group_key, lc.model
+                ORDER BY group_key
+            """, query_params)
+
+            rows = cursor.fetchall()
+
+        return jsonify({
+            'success': True,
+            'group_by': group_by,
+            'usage': summarize(rows, group_by)
+        }), 200
+
+    except Exception as e:
+        print(f"Error fetching LLM usage: {str(e)}")
+        return jsonify({'error': 'Failed to fetch LLM usage'}), 500
+
+@llm_usage_bp.route('/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def get_job_llm_usage(job_id):
+    """Per-step LLM usage of one job"""
+    try:
+        current_user_id = get_jwt_identity()
+
+        if not is_admin(current_user_id):
+            return jsonify({'error': 'Admin access required'}), 403
+
+        with get_db_cursor() as cursor:
+            cursor.execute("""
+                SELECT
+                    lc.step_number as group_key,
+                    lc.model,
+                    COUNT(*) as calls,
+                    SUM(CASE WHEN lc.cache_hit THEN 1 ELSE 0 END) as cache_hits,
+                    COALESCE(SUM(CASE WHEN NOT lc.cache_hit THEN lc.prompt_tokens ELSE 0 END), 0) as prompt_tokens,
+                    COALESCE(SUM(CASE WHEN NOT lc.cache_hit THEN lc.completion_tokens ELSE 0 END), 0) as completion_tokens,
+                    COALESCE(SUM(CASE WHEN lc.cache_hit THEN lc.prompt_tokens ELSE 0 END), 0) as saved_prompt_tokens,
+                    COALESCE(SUM(CASE WHEN lc.cache_hit THEN lc.completion_tokens ELSE 0 END), 0) as saved_completion_tokens,
+                    COALESCE(SUM(lc.latency_ms), 0) as latency_ms
+                FROM llm_calls lc
+                WHERE lc.job_id = %s
+                GROUP BY lc.step_number, lc.model
+                ORDER BY lc.step_number
+            """, (job_id,))
+
+            rows = cursor.fetchall()
+
+        steps = summarize(rows, 'step')
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'steps': steps,
+            'total_cost_usd': round(sum(step['cost_usd'] for step in steps), 4)
+        }), 200
+
+    except Exception as e:
+        print(f"Error fetching job LLM usage: {str(e)}")
+        return jsonify({'error': 'Failed to fetch job LLM usage'}), 500
@@ -4,7 +4,9 @@ from backend.utils.database import get_db_cursor
 from backend.api import media_rationale_bp
 from backend.models.user import User
 from backend.pipeline.fetch_video_data import fetch_video_metadata
-from backend.pipeline.pipeline_manager import create_job_directory, PIPELINE_STEPS, run_pipeline_step
+from backend.pipeline.pipeline_manager import create_job_directory, PIPELINE_STEPS, run_pipeline_step, run_pipeline_steps
+from backend.pipeline.step03_assemblyai_transcribe import WEBHOOK_SECRET, WEBHOOK_AUTH_HEADER
+from backend.pipeline.step05_translate import FILTER_FIRST
 from datetime import datetime
 import os
 import secrets
@@ -156,23 +158,11 @@ def start_analysis():
                         WHERE id = %s
                     """, (datetime.now(), job_id))
                 
-                # Run all pipeline steps (1-14)
+                # Run all pipeline steps (1-14), status set to 'pdf_ready' after Step 14
                 # Step 15 is handled via API endpoints (Save/Sign/Delete), not automatic pipeline
-                all_success = True
-                for step_num in range(1, 15):
-                    success = run_pipeline_step(job_id, step_num)
-                    if not success:
-                        all_success = False
-                        break
-                
-                # After Step 14 completes successfully, set status to 'pdf_ready'
-                if all_success:
-                    with get_db_cursor(commit=True) as cursor:
-                        cursor.execute("""
-                            UPDATE jobs 
-                            SET status = 'pdf_ready', progress = 93, updated_at = %s
-                            WHERE id = %s
-                        """, (datetime.now(), job_id))
+                # If Step 3 is submitted to AssemblyAI the thread exits here and the
+                # transcript poller/webhook resumes the job from Step 4
+                run_pipeline_steps(job_id, 1)
                 
             except Exception as e:
                 print(f"Pipeline error for job {job_id}: {str(e)}")
@@ -341,6 +331,11 @@ def restart_step(job_id, step_number):
         if step_number < 1 or step_number > 14:
             return jsonify({'error': 'Invalid step number. Must be between 1 and 14'}), 400
         
+        # In filter-first mode Step 5 detected the speakers and translated only
+        # their lines, so redoing speaker detection means redoing Step 5
+        if step_number == 6 and FILTER_FIRST:
+            step_number = 5
+        
         # Check if job exists
         with get_db_cursor() as cursor:
             cursor.execute("SELECT id, status FROM jobs WHERE id = %s", (job_id,))
@@ -354,7 +349,7 @@ def restart_step(job_id, step_number):
             cursor.execute("""
                 UPDATE job_steps
                 SET status = 'pending', message = NULL, output_files = ARRAY[]::text[], 
-                    started_at = NULL, ended_at = NULL
+                    started_at = NULL, ended_at = NULL, external_id = NULL, external_status = NULL
                 WHERE job_id = %s AND step_number >= %s
             """, (job_id, step_number))
             
@@ -370,23 +365,9 @@ def restart_step(job_id, step_number):
         # Restart pipeline execution from the specified step in background thread
         def run_pipeline_from_step():
             try:
-                # Run pipeline steps from step_number to 14 (Step 15 is API-only)
-                all_success = True
-                for step_num in range(step_number, 15):
-                    success = run_pipeline_step(job_id, step_num)
-                    if not success:
-                        all_success = False
-                        break
-                
-                # After Step 14 completes successfully, set status to 'pdf_ready'
-                if all_success:
-                    with get_db_cursor(commit=True) as cursor:
-                        cursor.execute("""
-                            UPDATE jobs 
-                            SET status = 'pdf_ready', progress = 93, updated_at = %s
-                            WHERE id = %s
-                        """, (datetime.now(), job_id))
-                    print(f"✅ Pipeline completed! Job {job_id} status set to 'pdf_ready' (awaiting user action)")
+                # Run pipeline steps from step_number to 14 (Step 15 is API-only),
+                # status set to 'pdf_ready' after Step 14
+                run_pipeline_steps(job_id, step_number, restart=True)
                         
             except Exception as e:
                 print(f"Pipeline restart error for job {job_id}: {str(e)}")
@@ -411,6 +392,51 @@ def restart_step(job_id, step_number):
         print(f"Error restarting step: {str(e)}")
         return jsonify({'error': f'Failed to restart step: {str(e)}'}), 500
 
+@media_rationale_bp.route('/transcription-webhook', methods=['POST'])
+def transcription_webhook():
+    """
+    AssemblyAI completion webhook (set ASSEMBLYAI_WEBHOOK_URL to this route).
+    
+    Resumes the job waiting on the transcript. The transcript poller does the
+    same thing, so this only shortens the wait; duplicates are ignored.
+    """
+    try:
+        if WEBHOOK_SECRET and request.headers.get(WEBHOOK_AUTH_HEADER) != WEBHOOK_SECRET:
+            return jsonify({'error': 'Invalid webhook token'}), 401
+        
+        data = request.get_json(silent=True) or {}
+        transcript_id = data.get('transcript_id')
+        status = data.get('status')
+        
+        if not transcript_id:
+            return jsonify({'error': 'transcript_id is required'}), 400
+        
+        if status not in ('completed', 'error'):
+            return jsonify({'success': True, 'message': f'Ignored status {status}'}), 200
+        
+        with get_db_cursor() as cursor:
+            cursor.execute("""
+                SELECT job_id FROM job_steps
+                WHERE step_number = 3 AND external_id = %s
+                  AND status = 'running' AND external_status = 'submitted'
+            """, (transcript_id,))
+            step = cursor.fetchone()
+        
+        if not step:
+            return jsonify({'success': True, 'message': 'No job waiting for this transcript'}), 200
+        
+        from backend.pipeline.transcription_poller import resume_in_background
+        resume_in_background(step['job_id'], transcript_id)
+        
+        return jsonify({
+            'success': True,
+            'message': f"Resuming job {step['job_id']}"
+        }), 200
+        
+    except Exception as e:
+        print(f"Error handling transcription webhook: {str(e)}")
+        return jsonify({'error': f'Failed to handle webhook: {str(e)}'}), 500
+
 @media_rationale_bp.route('/job/<job_id>/csv', methods=['GET'])
 @jwt_required()
 def get_csv(job_id):
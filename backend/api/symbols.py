@@ -0,0 +1,59 @@
+from flask import request, jsonify
+from flask_jwt_extended import jwt_required
+from backend.utils.database import get_db_cursor
+from backend.utils import master_index
+from backend.api import symbols_bp
+import os
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 50
+
+def get_master_file_path():
+    with get_db_cursor() as cursor:
+        cursor.execute("SELECT file_path FROM uploaded_files WHERE file_type = 'masterFile' LIMIT 1")
+        row = cursor.fetchone()
+        return row['file_path'] if row else None
+
+def format_security(arrays, pos, score):
+    """Master row in the terms of the mapped-stocks CSV (LISTED NAME, SHORT NAME, ...)"""
+    return {
+        'security_id': str(arrays['SEM_SMST_SECURITY_ID'][pos]),
+        'trading_symbol': str(arrays['SEM_TRADING_SYMBOL'][pos]),
+        'listed_name': str(arrays['SM_SYMBOL_NAME'][pos]),
+        'short_name': str(arrays['SEM_CUSTOM_SYMBOL'][pos]),
+        'exchange': str(arrays['SEM_EXM_EXCH_ID'][pos]),
+        'instrument': str(arrays['SEM_INSTRUMENT_NAME'][pos]),
+        'segment': str(arrays['SEM_SEGMENT'][pos]),
+        'score': score,
+    }
+
+@symbols_bp.route('/search', methods=['GET'])
+@jwt_required()
+def search_symbols():
+    """Ranked EQUITY securities for a symbol / company-name query (CSV editor autocomplete)"""
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'error': 'Query parameter q is required'}), 400
+
+        try:
+            limit = min(max(int(request.args.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+
+        master_file_path = get_master_file_path()
+        if not master_file_path or not os.path.exists(master_file_path):
+            return jsonify({'error': 'Master file not uploaded'}), 404
+
+        matches = master_index.search(master_file_path, query, limit)
+        arrays = master_index.load_index(master_file_path)
+
+        return jsonify({
+            'success': True,
+            'query': query,
+            'results': [format_security(arrays, pos, score) for pos, score in matches]
+        }), 200
+
+    except Exception as e:
+        print(f"Error searching symbols: {str(e)}")
+        return jsonify({'error': 'Failed to search symbols'}), 500
@@ -3,6 +3,7 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from werkzeug.utils import secure_filename
 from backend.utils.database import get_db_cursor
 from backend.api import uploaded_files_bp
+from backend.utils import master_index
 from datetime import datetime
 import os
 import uuid
@@ -107,6 +108,8 @@ def upload_file():
                     old_path = existing['file_path']
                     if os.path.exists(old_path):
                         os.remove(old_path)
+                    if file_type == 'masterFile':
+                        master_index.remove_index(old_path)
                     
                     # Delete from database
                     cursor.execute("DELETE FROM uploaded_files WHERE file_type = %s", (file_type,))
@@ -126,6 +129,13 @@ def upload_file():
         file_size_bytes = os.path.getsize(file_path)
         file_size = get_file_size_string(file_size_bytes)
         
+        # Build the compact EQUITY index Step 9 memory-maps; Step 9 rebuilds it if this fails
+        if file_type == 'masterFile':
+            try:
+                master_index.build_index(file_path)
+            except Exception as e:
+                print(f"⚠️ Master index build failed: {e}")
+        
         # Save to database
         with get_db_cursor(commit=True) as cursor:
             cursor.execute("""
@@ -161,6 +171,8 @@ def delete_file(file_id):
             # Delete file from filesystem
             if os.path.exists(file_record['file_path']):
                 os.remove(file_record['file_path'])
+            if file_record['file_type'] == 'masterFile':
+                master_index.remove_index(file_record['file_path'])
             
             # Delete from database
             cursor.execute("DELETE FROM uploaded_files WHERE id = %s", (file_id,))
@@ -3,8 +3,9 @@ from flask import Flask, jsonify, send_from_directory
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 from backend.config import Config
-from backend.api import auth_bp, users_bp, api_keys_bp, pdf_template_bp, uploaded_files_bp, channels_bp, media_rationale_bp, saved_rationale_bp, activity_logs_bp, dashboard_bp
+from backend.api import auth_bp, users_bp, api_keys_bp, pdf_template_bp, uploaded_files_bp, channels_bp, media_rationale_bp, saved_rationale_bp, activity_logs_bp, dashboard_bp, llm_usage_bp, symbols_bp
 from backend.utils.database import init_database
+from backend.pipeline.transcription_poller import start_transcription_poller
 
 def create_app():
     # Serve static files from build directory in production
@@ -16,6 +17,9 @@ def create_app():
     with app.app_context():
         init_database()
     
+    # Resume jobs whose Step 3 transcript was submitted to AssemblyAI
+    start_transcription_poller()
+    
     CORS(app, resources={
         r"/api/*": {
             "origins": "*",
@@ -48,6 +52,8 @@ def create_app():
     app.register_blueprint(saved_rationale_bp)
     app.register_blueprint(activity_logs_bp)
     app.register_blueprint(dashboard_bp)
+    app.register_blueprint(llm_usage_bp)
+    app.register_blueprint(symbols_bp)
     
     @app.route('/api/health', methods=['GET'])
     def health():
@@ -0,0 +1,264 @@
+"""
+Offline batch-API mode for bulk reprocessing of the LLM steps.
+
+Reprocessing an archive (e.g. after changing the Step 12 prompt) through
+synchronous chat completions is slow and costs full price. Batch mode
+instead:
+
+1. collects the requests Step 8 or 12 would make for every job
+   (planned_requests) into one JSONL batch file, deduplicated by the LLM
+   response cache key, which is also each request's custom_id,
+2. uploads it (files.create) and submits it (batches.create),
+3. polls until the batch is done,
+4. stores every answer in the LLM response cache under its key,
+5. reruns each job from that step, so the step's calls are cache hits and
+   its outputs are written to the job folder as usual.
+
+The client honours OPENAI_BASE_URL, so the whole flow can be run against a
+local OpenAI-compatible stand-in. The response cache must be enabled.
+
+    python -m backend.pipeline.batch_mode <step> <job_id> [<job_id> ...]
+    python -m backend.pipeline.batch_mode resume <run_folder>
+"""
+
+import os
+import sys
+import json
+import time
+from datetime import datetime
+from backend.utils import llm_cache
+from backend.utils.llm_gateway import get_client, job_context, _log_call
+from backend.pipeline import step08_extract_stocks
+from backend.pipeline import step12_extract_analysis
+
+BATCH_ROOT = os.path.join('backend', 'batch_runs')
+BATCH_POLL_SEC = int(os.environ.get('LLM_BATCH_POLL_SEC', 60))
+BATCH_COMPLETION_WINDOW = "24h"
+
+# Batch calls are billed at a discount, so llm_calls records them under
+# their own model label (priced separately in MODEL_PRICES)
+BATCH_MODEL_SUFFIX = " (batch)"
+
+BATCH_STEPS = {
+    8: step08_extract_stocks,
+    12: step12_extract_analysis,
+}
+
+FINAL_STATES = ('completed', 'failed', 'expired', 'cancelled')
+
+
+def job_folder_for(job_id):
+    return os.path.join('backend', 'job_files', job_id)
+
+
+def prepare_batch(step, job_ids):
+    """
+    Write the batch input file and manifest for step over job_ids.
+
+    Returns:
+        str: run folder containing requests.jsonl and manifest.json
+    """
+    if step not in BATCH_STEPS:
+        raise ValueError(f"Batch mode supports steps {sorted(BATCH_STEPS)}, not {step}")
+    if not llm_cache.LLM_CACHE_ENABLED:
+        raise RuntimeError("Batch mode delivers answers through the LLM cache; enable LLM_CACHE")
+
+    run_folder = os.path.join(BATCH_ROOT, f"step{step:02d}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    os.makedirs(run_folder, exist_ok=True)
+
+    lines = {}
+    jobs = {}
+    for job_id in job_ids:
+        try:
+            requests_for_job = BATCH_STEPS[step].planned_requests(job_folder_for(job_id))
+        except Exception as e:
+            print(f"⚠️ {job_id}: cannot plan step {step} requests ({str(e)}), skipped")
+            continue
+
+        keys = []
+        for request in requests_for_job:
+            key = llm_cache.cache_key(request['model'], request['messages'], request['params'])
+            keys.append(key)
+            if key in lines or llm_cache.get(key) is not None:
+                continue
+            lines[key] = {
+                "custom_id": key,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {"model": request['model'], "messages": request['messages'], **request['params']}
+            }
+        jobs[job_id] = keys
+        print(f"📝 {job_id}: {len(keys)} requests")
+
+    with open(os.path.join(run_folder, "requests.jsonl"), "w", encoding="utf-8") as f:
+        for line in lines.values():
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+    manifest = {'step': step, 'jobs': jobs, 'request_count': len(lines), 'batch_id': None}
+    save_manifest(run_folder, manifest)
+    print(f"✅ {len(lines)} unique uncached requests for {len(jobs)} jobs: {run_folder}")
+    return run_folder
+
+
+def load_manifest(run_folder):
+    with open(os.path.join(run_folder, "manifest.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(run_folder, manifest):
+    with open(os.path.join(run_folder, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def submit_batch(run_folder):
+    """Upload requests.jsonl and create the batch; returns the batch id (None if nothing to send)"""
+    manifest = load_manifest(run_folder)
+    if manifest['request_count'] == 0:
+        print("♻️ All requests already cached, nothing to submit")
+        return None
+
+    client = get_client()
+    with open(os.path.join(run_folder, "requests.jsonl"), "rb") as f:
+        input_file = client.files.create(file=f, purpose="batch")
+
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window=BATCH_COMPLETION_WINDOW,
+        metadata={"step": str(manifest['step']), "jobs": str(len(manifest['jobs']))}
+    )
+    manifest['batch_id'] = batch.id
+    save_manifest(run_folder, manifest)
+    print(f"🚀 Submitted batch {batch.id} ({manifest['request_count']} requests)")
+    return batch.id
+
+
+def wait_for_batch(batch_id, poll_sec=BATCH_POLL_SEC):
+    """Poll until the batch reaches a final state; returns the batch"""
+    client = get_client()
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        if counts is not None:
+            print(f"⏳ Batch {batch_id}: {batch.status} ({counts.completed}/{counts.total} done, {counts.failed} failed)")
+        else:
+            print(f"⏳ Batch {batch_id}: {batch.status}")
+        if batch.status in FINAL_STATES:
+            return batch
+        time.sleep(poll_sec)
+
+
+def collect_results(run_folder, batch):
+    """
+    Store each successful answer in the LLM cache under its custom_id.
+
+    Each stored answer's usage is also logged to llm_calls (the later
+    fan-out only produces cache hits, which are not billed). A request
+    shared by several jobs was sent once, so it is attributed to the first
+    job in the manifest that planned it.
+
+    Returns:
+        (stored, failed) counts
+    """
+    client = get_client()
+    stored, failed = 0, 0
+
+    manifest = load_manifest(run_folder)
+    owners = {}
+    for job_id, keys in manifest['jobs'].items():
+        for key in keys:
+            owners.setdefault(key, job_id)
+
+    models = {}
+    with open(os.path.join(run_folder, "requests.jsonl"), "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                request = json.loads(line)
+                models[request["custom_id"]] = request["body"]["model"]
+
+    if batch.output_file_id:
+        output = client.files.content(batch.output_file_id).text
+        with open(os.path.join(run_folder, "results.jsonl"), "w", encoding="utf-8") as f:
+            f.write(output)
+
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            response = result.get("response") or {}
+            if response.get("status_code") != 200:
+                failed += 1
+                continue
+            body = response["body"]
+            usage = body.get("usage") or {}
+            content = (body["choices"][0]["message"].get("content") or "").strip()
+            llm_cache.put(result["custom_id"], content,
+                          usage.get("prompt_tokens"), usage.get("completion_tokens"))
+            model = models.get(result["custom_id"]) or body.get("model")
+            with job_context(owners.get(result["custom_id"])):
+                _log_call(manifest['step'], f"{model}{BATCH_MODEL_SUFFIX}", 0,
+                          usage.get("prompt_tokens"), usage.get("completion_tokens"))
+            stored += 1
+
+    if batch.error_file_id:
+        errors = client.files.content(batch.error_file_id).text
+        with open(os.path.join(run_folder, "errors.jsonl"), "w", encoding="utf-8") as f:
+            f.write(errors)
+        failed += sum(1 for line in errors.splitlines() if line.strip())
+
+    print(f"✅ Cached {stored} answers ({failed} failed requests will run synchronously)")
+    return stored, failed
+
+
+def fan_out(run_folder, end_step=14):
+    """
+    Rerun every job from the batched step; its LLM calls are answered from
+    the cache and outputs land in the job folders.
+
+    Returns:
+        dict of job_id -> run_pipeline_steps result
+    """
+    # Imported here: pipeline_manager imports every step module
+    from backend.pipeline.pipeline_manager import run_pipeline_steps
+
+    manifest = load_manifest(run_folder)
+    results = {}
+    for job_id in manifest['jobs']:
+        print(f"\n🔁 Rerunning {job_id} from step {manifest['step']}")
+        results[job_id] = run_pipeline_steps(job_id, manifest['step'], end_step)
+    return results
+
+
+def resume(run_folder, end_step=14):
+    """Wait for a submitted batch, cache its answers and fan them out"""
+    manifest = load_manifest(run_folder)
+    if manifest['batch_id']:
+        batch = wait_for_batch(manifest['batch_id'])
+        if batch.status != 'completed':
+            print(f"⚠️ Batch ended as {batch.status}; remaining calls will run synchronously")
+        collect_results(run_folder, batch)
+    return fan_out(run_folder, end_step)
+
+
+def run_batch(step, job_ids, end_step=14):
+    """Prepare, submit, wait, collect and fan out in one go"""
+    run_folder = prepare_batch(step, job_ids)
+    submit_batch(run_folder)
+    return resume(run_folder, end_step)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python -m backend.pipeline.batch_mode <step> <job_id> [<job_id> ...]")
+        print("       python -m backend.pipeline.batch_mode resume <run_folder>")
+        sys.exit(1)
+
+    if sys.argv[1] == "resume":
+        outcome = resume(sys.argv[2])
+    else:
+        outcome = run_batch(int(sys.argv[1]), sys.argv[2:])
+
+    print(f"\n{'='*60}")
+    for job_id, result in outcome.items():
+        print(f"{job_id}: {result}")
+    print(f"{'='*60}")
@@ -0,0 +1,367 @@
+"""
+Chunked Transcription for Long Videos (used by Step 3)
+
+Splits a long 16kHz mono WAV at silence boundaries into overlapping chunks,
+transcribes the chunks concurrently and stitches the utterances back into a
+single timeline.
+
+Speaker labels are local to each chunk (chunk 2's "Speaker A" is not
+necessarily chunk 1's "Speaker A"), so they are reconciled across every
+boundary using the utterances both chunks heard inside the overlap.
+
+The transcriber is injected: any object with a ``transcribe(path)`` method
+returning something with ``.utterances`` (each having ``speaker``, ``start``,
+``end`` and ``text``, times in ms) works, so the whole flow can be exercised
+offline with a stub transcriber.
+"""
+
+import os
+import wave
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+# Silence detection
+SILENCE_FRAME_MS = 30          # analysis window
+SILENCE_THRESHOLD_DB = -40.0   # RMS below this (dBFS) counts as silence
+SILENCE_MIN_MS = 400           # shortest pause we are willing to cut at
+
+# Chunk planning
+CHUNK_TARGET_MS = 15 * 60 * 1000    # aim for ~15 minute chunks
+CHUNK_SEARCH_MS = 90 * 1000         # look this far either side of the target for a pause
+CHUNK_OVERLAP_MS = 30 * 1000        # total overlap shared by neighbouring chunks
+CHUNK_MAX_WORKERS = 4
+
+
+def get_wav_duration_ms(audio_path):
+    """Return duration of a PCM WAV file in milliseconds"""
+    with wave.open(audio_path, "rb") as wf:
+        return int(wf.getnframes() * 1000 / wf.getframerate())
+
+
+def find_silences(audio_path, frame_ms=SILENCE_FRAME_MS,
+                  threshold_db=SILENCE_THRESHOLD_DB, min_silence_ms=SILENCE_MIN_MS):
+    """
+    Find pauses in a 16-bit PCM WAV file.
+
+    The file is streamed in blocks so multi-hour audio never has to be held
+    in memory.
+
+    Returns:
+        list of (start_ms, end_ms) tuples, one per pause
+    """
+    silences = []
+
+    with wave.open(audio_path, "rb") as wf:
+        if wf.getsampwidth() != 2:
+            raise ValueError("Silence detection expects 16-bit PCM audio")
+
+        rate = wf.getframerate()
+        channels = wf.getnchannels()
+        frame_len = max(1, int(rate * frame_ms / 1000))
+        frames_per_block = frame_len * 2000
+
+        silence_start = None
+        frame_index = 0
+
+        while True:
+            raw = wf.readframes(frames_per_block)
+            if not raw:
+                break
+
+            samples = np.frombuffer(raw, dtype=np.int16)
+            if channels > 1:
+                samples = samples.reshape(-1, channels).mean(axis=1)
+
+            n_frames = len(samples) // frame_len
+            if n_frames == 0:
+                break
+
+            frames = samples[:n_frames * frame_len].astype(np.float32).reshape(n_frames, frame_len)
+            rms = np.sqrt(np.mean(frames ** 2, axis=1)) / 32768.0
+            db = 20 * np.log10(np.maximum(rms, 1e-10))
+            is_silent = db < threshold_db
+
+            for silent in is_silent:
+                t_ms = frame_index * frame_ms
+                if silent and silence_start is None:
+                    silence_start = t_ms
+                elif not silent and silence_start is not None:
+                    if t_ms - silence_start >= min_silence_ms:
+                        silences.append((silence_start, t_ms))
+                    silence_start = None
+                frame_index += 1
+
+        if silence_start is not None:
+            end_ms = frame_index * frame_ms
+            if end_ms - silence_start >= min_silence_ms:
+                silences.append((silence_start, end_ms))
+
+    return silences
+
+
+def plan_chunks(duration_ms, silences, target_ms=CHUNK_TARGET_MS,
+                search_ms=CHUNK_SEARCH_MS, overlap_ms=CHUNK_OVERLAP_MS):
+    """
+    Choose cut points and chunk windows.
+
+    Each cut is placed in the middle of the longest pause found within
+    ``search_ms`` of the ideal position (falling back to the ideal position
+    when there is no pause nearby). Chunks then extend ``overlap_ms / 2``
+    past each cut on both sides.
+
+    Returns:
+        list of dicts with start_ms/end_ms (audio window sent to the
+        transcriber) and own_start_ms/own_end_ms (the part of the timeline
+        this chunk is responsible for in the stitched output)
+    """
+    cuts = []
+    position = 0
+    while duration_ms - position > target_ms + search_ms:
+        ideal = position + target_ms
+        nearby = [s for s in silences
+                  if s[0] >= ideal - search_ms and s[1] <= ideal + search_ms]
+        if nearby:
+            best = max(nearby, key=lambda s: (s[1] - s[0], -abs((s[0] + s[1]) / 2 - ideal)))
+            cut = int((best[0] + best[1]) / 2)
+        else:
+            cut = ideal
+        cuts.append(cut)
+        position = cut
+
+    bounds = [0] + cuts + [duration_ms]
+    half = overlap_ms // 2
+
+    chunks = []
+    for i in range(len(bounds) - 1):
+        own_start, own_end = bounds[i], bounds[i + 1]
+        chunks.append({
+            'index': i,
+            'start_ms': max(0, own_start - half) if i > 0 else 0,
+            'end_ms': min(duration_ms, own_end + half) if i < len(bounds) - 2 else duration_ms,
+            'own_start_ms': own_start,
+            'own_end_ms': own_end,
+        })
+
+    return chunks
+
+
+def write_wav_segment(src_path, dst_path, start_ms, end_ms):
+    """Copy the [start_ms, end_ms) window of a WAV file into a new WAV file"""
+    with wave.open(src_path, "rb") as src:
+        rate = src.getframerate()
+        start_frame = int(start_ms * rate / 1000)
+        end_frame = min(src.getnframes(), int(end_ms * rate / 1000))
+
+        src.setpos(start_frame)
+        frames = src.readframes(max(0, end_frame - start_frame))
+
+        with wave.open(dst_path, "wb") as dst:
+            dst.setnchannels(src.getnchannels())
+            dst.setsampwidth(src.getsampwidth())
+            dst.setframerate(rate)
+            dst.writeframes(frames)
+
+
+def _transcribe_chunk(transcriber, chunk):
+    """Transcribe one chunk and shift its utterances onto the global timeline"""
+    transcript = transcriber.transcribe(chunk['path'])
+
+    error = getattr(transcript, 'error', None)
+    if error:
+        raise Exception(f"Chunk {chunk['index'] + 1} failed: {error}")
+
+    offset = chunk['start_ms']
+    utterances = []
+    for utt in (transcript.utterances or []):
+        utterances.append(SimpleNamespace(
+            speaker=str(utt.speaker),
+            start=int(utt.start) + offset,
+            end=int(utt.end) + offset,
+            text=utt.text,
+            words=[
+                SimpleNamespace(
+                    text=w.text,
+                    start=int(w.start) + offset,
+                    end=int(w.end) + offset,
+                    speaker=str(getattr(w, 'speaker', None) or utt.speaker),
+                )
+                for w in (getattr(utt, 'words', None) or [])
+            ],
+        ))
+    return utterances
+
+
+def _overlap(a_start, a_end, b_start, b_end):
+    return max(0, min(a_end, b_end) - max(a_start, b_start))
+
+
+def reconcile_speakers(prev_utterances, next_utterances, window_start, window_end, used_labels):
+    """
+    Map the next chunk's local speaker labels onto global labels.
+
+    Inside the overlap window both chunks transcribed the same audio, so a
+    local label is mapped to the global label it shares the most talk time
+    with. Labels that never appear in the overlap (or only collide with an
+    already-claimed global label) get a fresh global label.
+
+    Args:
+        prev_utterances: previous chunk's utterances, already in global labels
+        next_utterances: next chunk's utterances, in local labels
+        window_start, window_end: overlap window in ms
+        used_labels: set of global labels already in use (updated in place)
+
+    Returns:
+        dict of local label -> global label
+    """
+    prev_in_window = [u for u in prev_utterances
+                      if _overlap(u.start, u.end, window_start, window_end) > 0]
+    next_in_window = [u for u in next_utterances
+                      if _overlap(u.start, u.end, window_start, window_end) > 0]
+
+    shared = {}
+    for n in next_in_window:
+        for p in prev_in_window:
+            ms = _overlap(n.start, n.end, p.start, p.end)
+            if ms > 0:
+                key = (n.speaker, p.speaker)
+                shared[key] = shared.get(key, 0) + ms
+
+    mapping = {}
+    claimed = set()
+    for (local, global_label), _ in sorted(shared.items(), key=lambda kv: -kv[1]):
+        if local in mapping or global_label in claimed:
+            continue
+        mapping[local] = global_label
+        claimed.add(global_label)
+
+    for utt in next_utterances:
+        if utt.speaker not in mapping:
+            mapping[utt.speaker] = _next_free_label(used_labels)
+        used_labels.add(mapping[utt.speaker])
+
+    return mapping
+
+
+def _next_free_label(used_labels):
+    """Return the next unused speaker letter (A..Z, then AA, AB, ...)"""
+    i = 0
+    while True:
+        label = ""
+        n = i
+        while True:
+            label = chr(ord('A') + n % 26) + label
+            n = n // 26 - 1
+            if n < 0:
+                break
+        if label not in used_labels:
+            return label
+        i += 1
+
+
+def stitch_chunks(chunks, chunk_utterances):
+    """
+    Merge per-chunk utterances into one timeline with consistent labels.
+
+    Each utterance is kept only by the chunk that owns its midpoint, so
+    speech inside an overlap appears exactly once.
+
+    Returns:
+        list of utterances sorted by start time
+    """
+    stitched = []
+    used_labels = set()
+    prev_mapped = None
+
+    for i, chunk in enumerate(chunks):
+        utterances = chunk_utterances[i]
+
+        if prev_mapped is None:
+            mapping = {}
+            for utt in utterances:
+                if utt.speaker not in mapping:
+                    mapping[utt.speaker] = utt.speaker
+                    used_labels.add(utt.speaker)
+        else:
+            mapping = reconcile_speakers(
+                prev_mapped, utterances,
+                chunk['start_ms'], chunks[i - 1]['end_ms'],
+                used_labels
+            )
+
+        mapped = []
+        for utt in utterances:
+            label = mapping[utt.speaker]
+            for w in utt.words:
+                w.speaker = mapping.get(w.speaker, label)
+            mapped.append(SimpleNamespace(
+                speaker=label, start=utt.start, end=utt.end, text=utt.text, words=utt.words
+            ))
+
+        for utt in mapped:
+            mid = (utt.start + utt.end) / 2
+            if chunk['own_start_ms'] <= mid < chunk['own_end_ms'] or (
+                    i == len(chunks) - 1 and mid >= chunk['own_end_ms']):
+                stitched.append(utt)
+
+        prev_mapped = mapped
+
+    stitched.sort(key=lambda u: u.start)
+    return stitched
+
+
+def transcribe_chunked(audio_path, transcriber, work_dir, max_workers=CHUNK_MAX_WORKERS,
+                       target_ms=CHUNK_TARGET_MS, overlap_ms=CHUNK_OVERLAP_MS):
+    """
+    Transcribe a long audio file as concurrent overlapping chunks.
+
+    Args:
+        audio_path: 16-bit PCM WAV file
+        transcriber: object exposing transcribe(path) (AssemblyAI Transcriber or a stub)
+        work_dir: directory for the temporary chunk WAV files
+        max_workers: chunks transcribed at the same time
+
+    Returns:
+        SimpleNamespace with utterances, audio_duration (seconds), text and
+        chunk_count, shaped like an AssemblyAI transcript
+    """
+    duration_ms = get_wav_duration_ms(audio_path)
+
+    print(f"🔇 Detecting silence boundaries in {audio_path}...")
+    silences = find_silences(audio_path)
+    chunks = plan_chunks(duration_ms, silences, target_ms=target_ms, overlap_ms=overlap_ms)
+    print(f"✂️  Split {duration_ms / 60000:.1f} min of audio into {len(chunks)} chunks "
+          f"({len(silences)} pauses found)")
+
+    os.makedirs(work_dir, exist_ok=True)
+    for chunk in chunks:
+        chunk['path'] = os.path.join(work_dir, f"chunk_{chunk['index']:03d}.wav")
+        write_wav_segment(audio_path, chunk['path'], chunk['start_ms'], chunk['end_ms'])
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as executor:
+            chunk_utterances = list(executor.map(
+                lambda c: _transcribe_chunk(transcriber, c), chunks
+            ))
+    finally:
+        for chunk in chunks:
+            try:
+                os.remove(chunk['path'])
+            except OSError:
+                pass
+
+    for chunk, utts in zip(chunks, chunk_utterances):
+        print(f"  ✅ Chunk {chunk['index'] + 1}/{len(chunks)}: {len(utts)} utterances")
+
+    utterances = stitch_chunks(chunks, chunk_utterances)
+    speakers = sorted({u.speaker for u in utterances})
+    print(f"🧵 Stitched {len(utterances)} utterances, {len(speakers)} speakers after reconciliation")
+
+    return SimpleNamespace(
+        utterances=utterances,
+        audio_duration=duration_ms / 1000.0,
+        text=" ".join(u.text for u in utterances),
+        chunk_count=len(chunks),
+    )
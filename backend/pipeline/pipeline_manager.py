@@ -4,9 +4,14 @@ Orchestrates all 15 steps of the video analysis pipeline
 """
 import os
 from backend.utils.database import get_db_cursor
+from backend.utils.llm_gateway import job_context, cache_bypass
 from backend.pipeline.step01_download_audio import download_audio
 from backend.pipeline.step02_download_captions import download_captions
-from backend.pipeline.step03_assemblyai_transcribe import transcribe_audio
+from backend.pipeline.step03_assemblyai_transcribe import (
+    transcribe_audio, submit_transcription, fetch_transcription, save_transcript,
+    use_chunked_mode, TranscriptionFailed, TRANSCRIBE_ASYNC
+)
+from backend.pipeline.transcription_backends import get_transcription_backend, TRANSCRIPTION_ENGINE
 from backend.pipeline import step04_merge_transcripts
 from backend.pipeline import step05_translate
 from backend.pipeline import step06_detect_speakers
@@ -40,6 +45,11 @@ PIPELINE_STEPS = [
     {'number': 14, 'name': 'Generate PDF', 'description': 'Create branded PDF report'},
 ]
 
+# Returned by run_pipeline_step when the step handed its work to an external
+# service (e.g. AssemblyAI) and released the worker. The pipeline is resumed
+# later by the transcript poller or webhook.
+STEP_DEFERRED = 'deferred'
+
 def create_job_directory(job_id):
     """Create directory structure for job files"""
     base_path = os.path.join('backend', 'job_files', job_id)
@@ -83,8 +93,52 @@ def update_step_status(job_id, step_number, status, message=None, output_files=N
         print(f"Error updating step status: {str(e)}")
         return False
 
-def run_pipeline_step(job_id, step_number):
-    """Execute a single pipeline step"""
+def update_step_progress(job_id, step_number, message):
+    """Update a running step's message (progress) without touching its status or timing"""
+    try:
+        with get_db_cursor(commit=True) as cursor:
+            cursor.execute("""
+                UPDATE job_steps 
+                SET message = %s
+                WHERE job_id = %s AND step_number = %s AND status = 'running'
+            """, (message, job_id, step_number))
+    except Exception as e:
+        print(f"Error updating step progress: {str(e)}")
+
+def get_assemblyai_api_key():
+    """Fetch AssemblyAI API key from database"""
+    with get_db_cursor() as cursor:
+        cursor.execute("""
+            SELECT key_value FROM api_keys 
+            WHERE LOWER(provider) = 'assemblyai'
+        """)
+        api_key_row = cursor.fetchone()
+        
+        if not api_key_row:
+            raise Exception("AssemblyAI API key not found in database. Please add it in Settings > API Keys.")
+    
+    return api_key_row['key_value']
+
+def defer_step(job_id, step_number, external_id, message):
+    """Record the external job id for a step that is waiting on a remote service"""
+    with get_db_cursor(commit=True) as cursor:
+        cursor.execute("""
+            UPDATE job_steps 
+            SET message = %s, external_id = %s, external_status = 'submitted'
+            WHERE job_id = %s AND step_number = %s
+        """, (message, external_id, job_id, step_number))
+
+def run_pipeline_step(job_id, step_number, start_step=None):
+    """
+    Execute a single pipeline step
+    
+    Args:
+        start_step: first step of the pipeline run this step belongs to
+            (None when the step runs on its own)
+    
+    Returns True on success, False on failure, or STEP_DEFERRED when the
+    step submitted external work and will be resumed later.
+    """
     try:
         step_info = PIPELINE_STEPS[step_number - 1]
         
@@ -138,25 +192,37 @@ def run_pipeline_step(job_id, step_number):
             
             output_files = [result['captions_path']]
             message = f"Captions downloaded ({result['format']} format, {result['language']} language, {result['file_size_kb']} KB)"
+            if result.get('deduped_tokens'):
+                message += f", removed {result['deduped_tokens']} repeated rolling-caption tokens"
         
         elif step_number == 3:
-            # Step 3: Transcribe audio with AssemblyAI
-            # Get AssemblyAI API key from database
-            with get_db_cursor() as cursor:
-                cursor.execute("""
-                    SELECT key_value FROM api_keys 
-                    WHERE LOWER(provider) = 'assemblyai'
-                """)
-                api_key_row = cursor.fetchone()
-                
-                if not api_key_row:
-                    raise Exception("AssemblyAI API key not found in database. Please add it in Settings > API Keys.")
-            
-            assemblyai_api_key = api_key_row['key_value']
+            # Step 3: Transcribe audio with AssemblyAI (or the local engine)
             audio_path = os.path.join(job_folder, 'audio', 'audio_16k_mono.wav')
             
-            output_files = transcribe_audio(job_id, audio_path, assemblyai_api_key)
-            message = f"Transcription completed with speaker detection"
+            if TRANSCRIPTION_ENGINE == 'local':
+                output_files = transcribe_audio(
+                    job_id, audio_path, None,
+                    transcriber=get_transcription_backend('local')
+                )
+                message = "Transcription completed with local engine (faster-whisper + local diarizer)"
+            
+            else:
+                assemblyai_api_key = get_assemblyai_api_key()
+                
+                if TRANSCRIBE_ASYNC and not use_chunked_mode(audio_path):
+                    # Submit and release the worker; the poller/webhook resumes from step 4
+                    transcript_id = submit_transcription(job_id, audio_path, assemblyai_api_key)
+                    defer_step(
+                        job_id, step_number, transcript_id,
+                        f"Submitted to AssemblyAI (transcript {transcript_id}), waiting for completion..."
+                    )
+                    return STEP_DEFERRED
+                
+                output_files = transcribe_audio(
+                    job_id, audio_path, assemblyai_api_key,
+                    transcriber=get_transcription_backend('assemblyai', assemblyai_api_key)
+                )
+                message = "Transcription completed with speaker detection"
         
         elif step_number == 4:
             # Step 4: Merge AssemblyAI transcript with YouTube captions
@@ -197,7 +263,12 @@ def run_pipeline_step(job_id, step_number):
         
         elif step_number == 6:
             # Step 6: Detect Speakers (Anchor & Pradip) using OpenAI
-            result = step06_detect_speakers.run(job_folder)
+            # In filter-first mode Step 5 already detected them on a translated
+            # sample; reuse that only if Step 5 ran earlier in this same run
+            # (a restart from step 6 must detect again)
+            reuse_detected = (step05_translate.FILTER_FIRST
+                              and start_step is not None and start_step <= 5)
+            result = step06_detect_speakers.run(job_folder, reuse_detected=reuse_detected)
             
             if result['status'] == 'failed':
                 raise Exception(result['message'])
@@ -257,7 +328,10 @@ def run_pipeline_step(job_id, step_number):
         
         elif step_number == 12:
             # Step 12: Extract Analysis (GPT-4o extracts Pradip's analysis)
-            result = step12_extract_analysis.run(job_folder)
+            result = step12_extract_analysis.run(
+                job_folder,
+                progress=lambda msg: update_step_progress(job_id, 12, msg)
+            )
             
             if result['status'] == 'failed':
                 raise Exception(result['message'])
@@ -313,32 +387,138 @@ def run_pipeline_step(job_id, step_number):
         update_step_status(job_id, step_number, 'failed', error_msg)
         return False
 
-async def run_pipeline(job_id, start_step=1, end_step=15):
-    """Run pipeline steps from start_step to end_step"""
-    try:
-        # Step 15 is NOT part of automatic pipeline - it's for user actions only
-        # Pipeline runs from Step 1 to Step 14 automatically
-        actual_end_step = min(end_step, 14)
-        
-        for step_num in range(start_step, actual_end_step + 1):
-            success = run_pipeline_step(job_id, step_num)
-            if not success:
-                # Update job status to failed
-                with get_db_cursor(commit=True) as cursor:
-                    cursor.execute("""
-                        UPDATE jobs 
-                        SET status = 'failed', updated_at = %s
-                        WHERE id = %s
-                    """, (datetime.now(), job_id))
-                return False
-        
-        # After Step 14, set status to 'pdf_ready' (awaiting user action)
+def run_pipeline_steps(job_id, start_step=1, end_step=14, restart=False):
+    """
+    Run steps start_step..end_step in order, stopping at the first failure.
+    
+    restart=True (a step restarted from the UI) makes start_step's LLM calls
+    skip the response cache, so the restart gets a fresh answer.
+    
+    When the last step succeeds the job is set to 'pdf_ready' (awaiting user
+    action). Returns True, False, or STEP_DEFERRED if a step released the
+    worker to wait on an external service.
+    """
+    # Step 15 is NOT part of automatic pipeline - it's for user actions only
+    actual_end_step = min(end_step, 14)
+    
+    # A restart that reruns Step 13 refetches candles instead of reusing the cache
+    if restart and start_step <= 13 <= actual_end_step:
+        step13_generate_charts.clear_candle_cache(os.path.join('backend', 'job_files', job_id))
+    
+    for step_num in range(start_step, actual_end_step + 1):
+        with job_context(job_id), cache_bypass(restart and step_num == start_step):
+            result = run_pipeline_step(job_id, step_num, start_step)
+        if result == STEP_DEFERRED:
+            print(f"⏸️ Job {job_id} waiting on external service at step {step_num}")
+            return STEP_DEFERRED
+        if not result:
+            return False
+    
+    # After Step 14, set status to 'pdf_ready' (awaiting user action)
+    if actual_end_step == 14:
         with get_db_cursor(commit=True) as cursor:
             cursor.execute("""
                 UPDATE jobs 
                 SET status = 'pdf_ready', progress = 93, updated_at = %s
                 WHERE id = %s
             """, (datetime.now(), job_id))
+        print(f"✅ Pipeline completed! Job {job_id} status set to 'pdf_ready' (awaiting user action)")
+    
+    return True
+
+def claim_deferred_step(job_id, step_number, external_id):
+    """
+    Atomically take ownership of a deferred step so the poller and the
+    webhook (or several workers) never resume the same job twice.
+    """
+    with get_db_cursor(commit=True) as cursor:
+        cursor.execute("""
+            UPDATE job_steps 
+            SET external_status = 'resuming'
+            WHERE job_id = %s AND step_number = %s AND external_id = %s
+              AND status = 'running' AND external_status = 'submitted'
+            RETURNING id
+        """, (job_id, step_number, external_id))
+        return cursor.fetchone() is not None
+
+def mark_transcription_failed(job_id, error_msg):
+    """Fail a claimed step 3 and record the external failure"""
+    print(f"Pipeline step 3 error: {error_msg}")
+    update_step_status(job_id, 3, 'failed', error_msg)
+    with get_db_cursor(commit=True) as cursor:
+        cursor.execute("""
+            UPDATE job_steps SET external_status = 'failed'
+            WHERE job_id = %s AND step_number = 3
+        """, (job_id,))
+
+def fail_transcription(job_id, transcript_id, error_msg):
+    """
+    Mark step 3 failed after AssemblyAI reported an error for the transcript.
+    
+    Goes through the same claim as a resume, so only one of the poller and
+    the webhook records the failure.
+    """
+    if not claim_deferred_step(job_id, 3, transcript_id):
+        return False
+    mark_transcription_failed(job_id, error_msg)
+    return True
+
+def resume_after_transcription(job_id, transcript_id, transcript=None):
+    """
+    Finish step 3 for a submitted AssemblyAI transcript and continue the
+    pipeline from step 4.
+    
+    If the transcript cannot be fetched (network error, 5xx, timeout) the
+    step stays 'submitted' and the next poll retries it. Only an error
+    status from AssemblyAI fails the step.
+    
+    Args:
+        transcript: the completed transcript if the caller already fetched it
+    """
+    if transcript is None:
+        try:
+            transcript = fetch_transcription(transcript_id, get_assemblyai_api_key())
+        except TranscriptionFailed as e:
+            fail_transcription(job_id, transcript_id, str(e))
+            return False
+        except Exception as e:
+            print(f"⚠️ Transcript {transcript_id} for job {job_id} not fetched, will retry: {str(e)}")
+            return False
+        if transcript is None:
+            return False
+    
+    if not claim_deferred_step(job_id, 3, transcript_id):
+        return False
+    
+    try:
+        output_files = save_transcript(job_id, transcript)
+        update_step_status(job_id, 3, 'success', "Transcription completed with speaker detection", output_files)
+        with get_db_cursor(commit=True) as cursor:
+            cursor.execute("""
+                UPDATE job_steps SET external_status = 'completed'
+                WHERE job_id = %s AND step_number = 3
+            """, (job_id,))
+    
+    except Exception as e:
+        mark_transcription_failed(job_id, str(e))
+        return False
+    
+    return run_pipeline_steps(job_id, 4)
+
+async def run_pipeline(job_id, start_step=1, end_step=15):
+    """Run pipeline steps from start_step to end_step"""
+    try:
+        result = run_pipeline_steps(job_id, start_step, end_step)
+        
+        if not result:
+            # Update job status to failed
+            with get_db_cursor(commit=True) as cursor:
+                cursor.execute("""
+                    UPDATE jobs 
+                    SET status = 'failed', updated_at = %s
+                    WHERE id = %s
+                """, (datetime.now(), job_id))
+            return False
         
         return True
         
@@ -1,17 +1,37 @@
 """
 Step 2: Download Auto-Generated Captions from YouTube Video
-Uses yt-dlp to download Hindi/English captions in JSON format
+Uses yt-dlp to download Hindi/English captions (json3, VTT or SRT) and
+stream-parses them into a compact token artifact that Step 4 memory-maps
 """
 import os
 import subprocess
 import json
 import glob
 import re
+import numpy as np
+
+
+# Compact columnar caption artifact written by this step and memory-mapped by
+# Step 4: one row per caption token, sorted by time. Tokens live in a separate
+# UTF-8 blob joined by single spaces, so any run of consecutive tokens can be
+# decoded with one slice (blob[tok_off[i]:tok_off[j] - 1]).
+CAPTIONS_INDEX_FILE = 'captions.npy'
+CAPTIONS_TOKENS_FILE = 'captions_tokens.bin'
+CAPTIONS_META_FILE = 'captions_meta.json'
+CAPTION_INDEX_DTYPE = np.dtype([
+    ('start_ms', '<i8'),
+    ('dur_ms', '<i4'),
+    ('tok_off', '<i8'),
+])
+
+TIMING_LINE = re.compile(r"^\s*(\S+)\s*-->\s*(\S+)")
+INLINE_TIMESTAMP = re.compile(r"<(\d{1,2}:\d{2}:\d{2}[.,]\d{3}|\d{2}:\d{2}[.,]\d{3})>")
+INLINE_TAG = re.compile(r"</?[^>]+>")
 
 
 def time_to_ms(timestr):
-    """Convert VTT timestamp to milliseconds"""
-    parts = timestr.split(":")
+    """Convert VTT/SRT timestamp (HH:MM:SS.mmm or HH:MM:SS,mmm) to milliseconds"""
+    parts = timestr.strip().replace(",", ".").split(":")
     try:
         parts = [float(p) for p in parts]
     except:
@@ -23,35 +43,291 @@ def time_to_ms(timestr):
         m, s = parts
     else:
         return int(parts[0] * 1000)
-    return int((h * 3600 + m * 60 + s) * 1000)
+    return int(round((h * 3600 + m * 60 + s) * 1000))
 
 
-def parse_vtt(vtt_text):
-    """Parse VTT subtitle format to JSON structure"""
-    events = []
-    lines = vtt_text.splitlines()
+def _cue_to_event(start_ms, end_ms, text_lines):
+    """Build a json3-style event from one VTT/SRT cue"""
+    text = " ".join(text_lines).strip()
+    
+    # YouTube auto-captions carry per-word times as inline <HH:MM:SS.mmm> tags
+    pieces = INLINE_TIMESTAMP.split(text)
+    segs = []
+    offset = 0
+    for i, piece in enumerate(pieces):
+        if i % 2 == 1:
+            offset = max(0, time_to_ms(piece) - start_ms)
+            continue
+        clean = INLINE_TAG.sub("", piece).strip()
+        if clean:
+            segs.append({'utf8': clean, 'tOffsetMs': offset})
+    
+    return {
+        'tStartMs': start_ms,
+        'dDurationMs': max(0, end_ms - start_ms),
+        'segs': segs
+    }
+
+
+def iter_cue_events(lines):
+    """
+    Stream json3-style events out of VTT or SRT lines.
+    
+    Anything outside a cue (WEBVTT header, Kind/Language lines, NOTE blocks,
+    VTT cue identifiers, SRT numeric indices) is skipped, so it never leaks
+    into the caption text. Cue settings after the end time are ignored.
+    """
     cur_start, cur_end, cur_text_lines = None, None, []
     
-    for line in lines:
-        line = line.strip()
-        if not line:
-            if cur_start and cur_text_lines:
-                text = " ".join(cur_text_lines).strip()
-                events.append({
-                    'tStartMs': time_to_ms(cur_start),
-                    'dDurationMs': time_to_ms(cur_end) - time_to_ms(cur_start),
-                    'segs': [{'utf8': text}]
-                })
+    for raw in lines:
+        # Only a truly empty line ends a cue; YouTube auto-captions put a
+        # single-space line inside cues
+        if not raw.rstrip("\r\n"):
+            if cur_start is not None and cur_text_lines:
+                yield _cue_to_event(cur_start, cur_end, cur_text_lines)
             cur_start, cur_end, cur_text_lines = None, None, []
             continue
-        if "-->" in line:
-            parts = line.split("-->")
-            cur_start = parts[0].strip()
-            cur_end = parts[1].strip()
-        else:
+        
+        line = raw.strip()
+        if not line:
+            continue
+        
+        match = TIMING_LINE.match(line) if "-->" in line else None
+        if match:
+            if cur_start is not None and cur_text_lines:
+                yield _cue_to_event(cur_start, cur_end, cur_text_lines)
+            cur_start = time_to_ms(match.group(1))
+            cur_end = time_to_ms(match.group(2))
+            cur_text_lines = []
+        elif cur_start is not None:
             cur_text_lines.append(line)
     
-    return {'events': events}
+    if cur_start is not None and cur_text_lines:
+        yield _cue_to_event(cur_start, cur_end, cur_text_lines)
+
+
+# Rolling auto-captions: a repeated run shorter than this is treated as real
+# speech ("buy buy") unless it makes up the whole cue
+ROLLING_MIN_OVERLAP = 2
+ROLLING_MAX_OVERLAP = 64
+
+
+def _rolling_overlap(prev_tokens, cur_tokens):
+    """Length of the longest suffix of prev_tokens that is a prefix of cur_tokens"""
+    limit = min(len(prev_tokens), len(cur_tokens), ROLLING_MAX_OVERLAP)
+    prev_norm = [t.casefold() for t in prev_tokens[-limit:]] if limit else []
+    cur_norm = [t.casefold() for t in cur_tokens[:limit]]
+    for k in range(limit, 0, -1):
+        if prev_norm[len(prev_norm) - k:] == cur_norm[:k]:
+            return k
+    return 0
+
+
+def _drop_leading_tokens(segs, count):
+    """Remove the first `count` tokens from an event's segs, keeping offsets"""
+    kept = []
+    for seg in segs:
+        tokens = (seg.get('utf8') or '').split()
+        if count >= len(tokens):
+            count -= len(tokens)
+            continue
+        if count:
+            seg = dict(seg, utf8=" ".join(tokens[count:]))
+            count = 0
+        kept.append(seg)
+    return kept
+
+
+def dedupe_rolling_events(events, stats):
+    """
+    Remove the text that YouTube's rolling auto-captions repeat between
+    consecutive cues.
+    
+    Each auto-generated VTT cue starts with the line the previous cue ended
+    on, so every line would otherwise be attached to speakers, translated and
+    sent to the LLM twice. The longest run of tokens that ends the previous
+    cue and starts the current one is dropped (at least ROLLING_MIN_OVERLAP
+    tokens, or the whole cue when it is a pure repeat).
+    
+    Args:
+        events: iterable of json3-style events
+        stats: dict updated in place with 'removed_tokens' and 'dropped_cues'
+    """
+    stats.setdefault('removed_tokens', 0)
+    stats.setdefault('dropped_cues', 0)
+    prev_tokens = []
+    
+    for ev in events:
+        segs = ev.get('segs', []) or []
+        tokens = " ".join(seg.get('utf8') or '' for seg in segs).split()
+        
+        overlap = _rolling_overlap(prev_tokens, tokens)
+        if overlap and (overlap >= ROLLING_MIN_OVERLAP or overlap == len(tokens)):
+            stats['removed_tokens'] += overlap
+            segs = _drop_leading_tokens(segs, overlap)
+        
+        if tokens:
+            prev_tokens = tokens
+        
+        if not segs:
+            stats['dropped_cues'] += 1
+            continue
+        
+        yield dict(ev, segs=segs)
+
+
+def parse_vtt(vtt_text):
+    """Parse VTT (or SRT) subtitle text to JSON structure"""
+    return {'events': list(iter_cue_events(vtt_text.splitlines()))}
+
+
+def iter_json3_events(path, chunk_size=1 << 16):
+    """
+    Stream the events of a json3 caption file one at a time.
+    
+    Only the current window of the file is held in memory; each event object
+    is decoded as soon as it is complete.
+    """
+    decoder = json.JSONDecoder()
+    skip = re.compile(r"[\s,]*")
+    
+    with open(path, "r", encoding="utf-8") as f:
+        buf = ""
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            buf += chunk
+            match = re.search(r'"events"\s*:\s*\[', buf)
+            if match:
+                buf = buf[match.end():]
+                break
+            buf = buf[-64:]
+        
+        pos = 0
+        eof = False
+        while True:
+            pos = skip.match(buf, pos).end()
+            if pos < len(buf) and buf[pos] == "]":
+                return
+            if pos < len(buf):
+                try:
+                    event, pos = decoder.raw_decode(buf, pos)
+                    yield event
+                    continue
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+            elif eof:
+                return
+            
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+            buf = buf[pos:] + chunk
+            pos = 0
+
+
+def iter_caption_words(events):
+    """
+    Split caption events into timed tokens.
+    
+    Yields:
+        (start_ms, dur_ms, token) with the same timing rules Step 4 has
+        always used: a single-token segment keeps its exact offset, a
+        multi-token segment is spread evenly across the event duration, and
+        without a duration tokens are spaced 1 ms apart.
+    """
+    for ev in events:
+        base = ev.get("tStartMs", 0)
+        dur_ms = ev.get("dDurationMs", None)
+        segs = ev.get("segs", []) or []
+        
+        for k, seg in enumerate(segs):
+            text = seg.get("utf8")
+            if not text or text.strip() == "":
+                continue
+            
+            offset_ms = seg.get("tOffsetMs", 0)
+            tokens = text.strip().split()
+            
+            if len(tokens) == 1:
+                # Single word - exact timestamp, lasts until the next word
+                if k + 1 < len(segs):
+                    nxt = segs[k + 1].get("tOffsetMs", offset_ms)
+                else:
+                    nxt = dur_ms if dur_ms else offset_ms
+                yield base + offset_ms, max(0, nxt - offset_ms), tokens[0]
+            elif dur_ms:
+                step = dur_ms / len(tokens)
+                for i, tk in enumerate(tokens):
+                    yield int(round(base + i * step)), int(step), tk
+            else:
+                for i, tk in enumerate(tokens):
+                    yield base + offset_ms + i, 1, tk
+
+
+def build_caption_arrays(events):
+    """
+    Build the columnar caption artifact in memory.
+    
+    Returns:
+        (index, blob): structured array of CAPTION_INDEX_DTYPE sorted by
+        start_ms, and the space-joined UTF-8 token blob
+    """
+    starts, durs, tokens = [], [], []
+    for start_ms, dur_ms, token in iter_caption_words(events):
+        starts.append(start_ms)
+        durs.append(dur_ms)
+        tokens.append(token)
+    
+    order = np.argsort(np.array(starts, dtype=np.int64), kind="stable")
+    
+    encoded = [tokens[i].encode("utf-8") for i in order]
+    lengths = np.fromiter((len(t) + 1 for t in encoded), dtype=np.int64, count=len(encoded))
+    
+    index = np.empty(len(encoded), dtype=CAPTION_INDEX_DTYPE)
+    index['start_ms'] = np.array(starts, dtype=np.int64)[order] if len(order) else []
+    index['dur_ms'] = np.array(durs, dtype=np.int32)[order] if len(order) else []
+    index['tok_off'] = np.concatenate(([0], np.cumsum(lengths)[:-1])) if len(encoded) else []
+    
+    return index, b" ".join(encoded)
+
+
+def write_caption_artifact(events, captions_folder):
+    """
+    Write captions.npy + captions_tokens.bin from a stream of events.
+    
+    Returns:
+        (index_path, token_count)
+    """
+    index, blob = build_caption_arrays(events)
+    
+    index_path = os.path.join(captions_folder, CAPTIONS_INDEX_FILE)
+    np.save(index_path, index)
+    with open(os.path.join(captions_folder, CAPTIONS_TOKENS_FILE), "wb") as f:
+        f.write(blob)
+    
+    return index_path, len(index)
+
+
+def load_caption_artifact(captions_folder):
+    """
+    Memory-map the caption artifact written by write_caption_artifact.
+    
+    Returns:
+        (index, blob) or None when the artifact is missing
+    """
+    index_path = os.path.join(captions_folder, CAPTIONS_INDEX_FILE)
+    tokens_path = os.path.join(captions_folder, CAPTIONS_TOKENS_FILE)
+    if not (os.path.exists(index_path) and os.path.exists(tokens_path)):
+        return None
+    
+    index = np.load(index_path, mmap_mode="r")
+    if os.path.getsize(tokens_path) == 0:
+        return index, b""
+    blob = np.memmap(tokens_path, dtype=np.uint8, mode="r")
+    return index, blob
 
 
 def download_captions(job_id, youtube_url, cookies_file=None):
@@ -66,7 +342,7 @@ def download_captions(job_id, youtube_url, cookies_file=None):
     Returns:
         dict: {
             'success': bool,
-            'captions_path': str,  # Path to captions.json file
+            'captions_path': str,  # Path to captions.npy (tokens in captions_tokens.bin)
             'format': str,  # Source format (json3, vtt, or srt)
             'language': str,  # Language code (hi or en)
             'error': str or None
@@ -77,8 +353,6 @@ def download_captions(job_id, youtube_url, cookies_file=None):
         captions_folder = os.path.join('backend', 'job_files', job_id, 'captions')
         os.makedirs(captions_folder, exist_ok=True)
         
-        captions_json_path = os.path.join(captions_folder, 'captions.json')
-        
         print(f"⏳ Downloading auto-generated captions (Hindi/English)...")
         
         # Build yt-dlp command
@@ -118,95 +392,74 @@ def download_captions(job_id, youtube_url, cookies_file=None):
                 'error': 'No auto-generated captions found. Captions may be disabled for this video.'
             }
         
-        # Process subtitles based on format
-        source_format = None
-        language = None
-        
-        # Prefer JSON3 format
+        # Process subtitles based on format (prefer JSON3, then VTT, then SRT)
         json3_files = [f for f in subs_found if f.endswith(".json3")]
+        vtt_files = [f for f in subs_found if f.endswith(".vtt")]
+        srt_files = [f for f in subs_found if f.endswith(".srt")]
+        
         if json3_files:
-            src = json3_files[0]
-            source_format = 'json3'
-            
-            # Extract language from filename (e.g., youtube.hi.json3)
-            if '.hi.' in src:
-                language = 'hi'
-            elif '.en.' in src:
-                language = 'en'
-            
-            with open(src, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            
-            with open(captions_json_path, "w", encoding="utf-8") as outj:
-                json.dump(data, outj, ensure_ascii=False, indent=2)
-            
-            print(f"✅ Captions saved from JSON3 format ({language})")
+            src, source_format = json3_files[0], 'json3'
+        elif vtt_files:
+            src, source_format = vtt_files[0], 'vtt'
+        else:
+            src, source_format = srt_files[0], 'srt'
         
-        # Fall back to VTT format
-        elif any(f.endswith(".vtt") for f in subs_found):
-            src = [f for f in subs_found if f.endswith(".vtt")][0]
-            source_format = 'vtt'
-            
-            # Extract language from filename
-            if '.hi.' in src:
-                language = 'hi'
-            elif '.en.' in src:
-                language = 'en'
-            
-            with open(src, "r", encoding="utf-8", errors="ignore") as f:
-                vtt_text = f.read()
-            
-            data = parse_vtt(vtt_text)
-            
-            with open(captions_json_path, "w", encoding="utf-8") as outj:
-                json.dump(data, outj, ensure_ascii=False, indent=2)
-            
-            print(f"✅ Captions saved from VTT format ({language})")
+        # Extract language from filename (e.g., youtube.hi.json3)
+        language = None
+        if '.hi.' in src:
+            language = 'hi'
+        elif '.en.' in src:
+            language = 'en'
         
+        # Stream-parse the subtitle file straight into the columnar artifact
+        dedupe_stats = {'removed_tokens': 0, 'dropped_cues': 0}
+        if source_format == 'json3':
+            events = iter_json3_events(src)
+            index_path, token_count = write_caption_artifact(events, captions_folder)
         else:
-            # Only SRT found - parse it similarly to VTT
-            src = [f for f in subs_found if f.endswith(".srt")][0]
-            source_format = 'srt'
-            
-            if '.hi.' in src:
-                language = 'hi'
-            elif '.en.' in src:
-                language = 'en'
-            
-            # SRT parsing (simplified - similar to VTT)
+            # VTT/SRT auto-captions scroll: drop the text repeated between cues
             with open(src, "r", encoding="utf-8", errors="ignore") as f:
-                srt_text = f.read()
-            
-            # Parse SRT (basic implementation)
-            data = parse_vtt(srt_text)  # VTT parser works for SRT too
-            
-            with open(captions_json_path, "w", encoding="utf-8") as outj:
-                json.dump(data, outj, ensure_ascii=False, indent=2)
-            
-            print(f"✅ Captions saved from SRT format ({language})")
+                events = dedupe_rolling_events(iter_cue_events(f), dedupe_stats)
+                index_path, token_count = write_caption_artifact(events, captions_folder)
+            print(f"🧹 Removed {dedupe_stats['removed_tokens']} repeated tokens "
+                  f"({dedupe_stats['dropped_cues']} duplicate cues) from rolling captions")
+        
+        print(f"✅ Captions saved from {source_format.upper()} format ({language}, {token_count} tokens)")
+        
+        # Small sidecar for later steps (caption language is needed by translation)
+        with open(os.path.join(captions_folder, CAPTIONS_META_FILE), "w", encoding="utf-8") as f:
+            json.dump({
+                'format': source_format,
+                'language': language or 'unknown',
+                'token_count': token_count,
+                'deduped_tokens': dedupe_stats['removed_tokens']
+            }, f)
         
-        # Clean up intermediate files (keep only captions.json)
+        # Clean up intermediate files (keep only the caption artifact)
         for sub_file in subs_found:
             try:
                 os.remove(sub_file)
             except:
                 pass
         
-        # Verify captions file exists
-        if not os.path.exists(captions_json_path):
+        # Verify captions artifact exists
+        if not os.path.exists(index_path):
             return {
                 'success': False,
-                'error': 'Failed to create captions.json file'
+                'error': f'Failed to create {CAPTIONS_INDEX_FILE} file'
             }
         
         # Get file size
-        file_size = os.path.getsize(captions_json_path) / 1024  # KB
+        file_size = (os.path.getsize(index_path) +
+                     os.path.getsize(os.path.join(captions_folder, CAPTIONS_TOKENS_FILE))) / 1024  # KB
         
         return {
             'success': True,
-            'captions_path': captions_json_path,
+            'captions_path': index_path,
             'format': source_format,
             'language': language or 'unknown',
+            'token_count': token_count,
+            'deduped_tokens': dedupe_stats['removed_tokens'],
             'file_size_kb': round(file_size, 2),
             'error': None
         }
@@ -1,27 +1,53 @@
 """
 Step 3: Transcribe Audio using AssemblyAI
 Transcribes audio with speaker recognition/diarization
+
+Long videos can be transcribed in chunked mode (see chunked_transcription.py):
+the audio is split at pauses into overlapping chunks that are transcribed
+concurrently and stitched back together.
+
+Other engines (e.g. the local CPU engine in transcription_backends.py) plug in
+through the transcriber argument and share the same transcript.csv/.txt output.
 """
 
 import assemblyai as aai
 from datetime import timedelta
+import numpy as np
 import pandas as pd
 import os
+from backend.pipeline.chunked_transcription import transcribe_chunked, get_wav_duration_ms
+from backend.utils.provider_clients import get_assemblyai_client, get_assemblyai_transcriber
 
-def transcribe_audio(job_id, audio_path, assemblyai_api_key):
-    """
-    Transcribe audio using AssemblyAI with speaker labels
-    
-    Input: audio_16k_mono.wav
-    Output: transcript.csv, transcript.txt
-    """
-    
-    print(f"🎙️ Starting AssemblyAI transcription for job {job_id}...")
-    
-    # Set API key
-    aai.settings.api_key = assemblyai_api_key
-    
-    # Configure transcription with speaker labels and word boost
+# 'single' = one request for the whole file, 'chunked' = always split,
+# 'auto' = split only when the audio is longer than CHUNKED_MIN_DURATION_SEC
+TRANSCRIBE_MODE = os.environ.get('TRANSCRIBE_MODE', 'auto').lower()
+CHUNKED_MIN_DURATION_SEC = int(os.environ.get('TRANSCRIBE_CHUNKED_MIN_SEC', 45 * 60))
+
+# Submit/poll mode: step 3 only submits the audio and releases the worker.
+# The transcript poller (or the AssemblyAI webhook, when WEBHOOK_URL is set)
+# resumes the pipeline once the transcript is ready.
+TRANSCRIBE_ASYNC = os.environ.get('TRANSCRIBE_ASYNC', 'true').lower() in ('1', 'true', 'yes')
+WEBHOOK_URL = os.environ.get('ASSEMBLYAI_WEBHOOK_URL', '')
+WEBHOOK_SECRET = os.environ.get('ASSEMBLYAI_WEBHOOK_SECRET', '')
+WEBHOOK_AUTH_HEADER = 'X-Webhook-Token'
+
+
+class TranscriptionFailed(Exception):
+    """AssemblyAI finished the transcript with an error status (not retryable)"""
+
+
+def use_chunked_mode(audio_path, mode=None):
+    """Decide whether the audio should be transcribed in chunks"""
+    mode = (mode or TRANSCRIBE_MODE).lower()
+    if mode == 'chunked':
+        return True
+    if mode == 'single':
+        return False
+    return get_wav_duration_ms(audio_path) >= CHUNKED_MIN_DURATION_SEC * 1000
+
+
+def build_transcription_config(webhook_url=None, webhook_secret=None):
+    """Configure transcription with speaker labels and word boost"""
     config = aai.TranscriptionConfig(
         speaker_labels=True,
         speech_model=aai.SpeechModel.best,
@@ -41,7 +67,85 @@ def transcribe_audio(job_id, audio_path, assemblyai_api_key):
         boost_param=aai.WordBoost.high
     )
     
-    transcriber = aai.Transcriber(config=config)
+    if webhook_url:
+        config.set_webhook(webhook_url, WEBHOOK_AUTH_HEADER if webhook_secret else None, webhook_secret)
+    
+    return config
+
+
+def submit_transcription(job_id, audio_path, assemblyai_api_key):
+    """
+    Submit audio to AssemblyAI without waiting for the result.
+    
+    The transcript id is returned so the caller can store it and release
+    the worker; fetch_transcription() picks the result up later (from the
+    poller or the webhook).
+    
+    Returns:
+        str: AssemblyAI transcript id
+    """
+    print(f"🎙️ Submitting AssemblyAI transcription for job {job_id}...")
+    
+    if not os.path.exists(audio_path):
+        raise FileNotFoundError(f"Audio file not found: {audio_path}")
+    
+    config = build_transcription_config(WEBHOOK_URL or None, WEBHOOK_SECRET or None)
+    transcriber = get_assemblyai_transcriber(assemblyai_api_key, config)
+    
+    try:
+        transcript = transcriber.submit(audio_path)
+    except Exception as e:
+        raise Exception(f"AssemblyAI submission failed: {str(e)}")
+    
+    if not transcript.id:
+        raise Exception(f"AssemblyAI submission failed: {transcript.error or 'no transcript id returned'}")
+    
+    print(f"📨 Submitted, transcript id: {transcript.id}")
+    return transcript.id
+
+
+def fetch_transcription(transcript_id, assemblyai_api_key):
+    """
+    Check a submitted transcript once, without blocking.
+    
+    Returns:
+        The completed transcript, or None while AssemblyAI is still
+        queued/processing. Raises TranscriptionFailed if AssemblyAI reports
+        an error; network/API errors propagate as-is and can be retried.
+    """
+    client = get_assemblyai_client(assemblyai_api_key)
+    
+    response = aai.api.get_transcript(client.http_client, transcript_id)
+    
+    if response.status == aai.TranscriptStatus.error:
+        raise TranscriptionFailed(f"AssemblyAI transcription failed: {response.error}")
+    
+    if response.status != aai.TranscriptStatus.completed:
+        return None
+    
+    return aai.Transcript.from_response(client=client, response=response)
+
+
+def transcribe_audio(job_id, audio_path, assemblyai_api_key, mode=None, transcriber=None):
+    """
+    Transcribe audio using AssemblyAI with speaker labels
+    
+    Input: audio_16k_mono.wav
+    Output: transcript.csv, transcript.txt
+    
+    Args:
+        mode: 'single', 'chunked' or 'auto' (defaults to TRANSCRIBE_MODE)
+        transcriber: optional object with transcribe(path), used instead of
+            AssemblyAI (a transcription backend, or a stub for offline testing)
+    """
+    
+    if transcriber is None:
+        print(f"🎙️ Starting AssemblyAI transcription for job {job_id}...")
+        transcriber = get_assemblyai_transcriber(assemblyai_api_key, build_transcription_config())
+    else:
+        engine = getattr(transcriber, 'name', type(transcriber).__name__)
+        print(f"🎙️ Starting {engine} transcription for job {job_id}...")
+        mode = mode or getattr(transcriber, 'default_mode', None)
     
     # Verify audio file exists
     if not os.path.exists(audio_path):
@@ -51,10 +155,32 @@ def transcribe_audio(job_id, audio_path, assemblyai_api_key):
     
     # Transcribe
     try:
-        transcript = transcriber.transcribe(audio_path)
+        if use_chunked_mode(audio_path, mode):
+            print("🧩 Using chunked parallel transcription")
+            chunks_dir = os.path.join(os.path.dirname(audio_path), 'chunks')
+            transcript = transcribe_chunked(audio_path, transcriber, chunks_dir)
+        else:
+            transcript = transcriber.transcribe(audio_path)
         print("✅ Transcription complete!")
     except Exception as e:
-        raise Exception(f"AssemblyAI transcription failed: {str(e)}")
+        raise Exception(f"Transcription failed: {str(e)}")
+    
+    return save_transcript(job_id, transcript)
+
+
+def save_transcript(job_id, transcript, basename="transcript"):
+    """
+    Write a completed transcript as transcript.csv and transcript.txt,
+    plus transcript_words.npz with millisecond utterance and word timings
+    (see save_word_timings)
+    
+    Args:
+        basename: output file name without extension (the benchmark writes
+            its local-engine output next to the AssemblyAI one)
+    
+    Returns:
+        list: [csv_path, txt_path]
+    """
     
     # Helper to format time as HH:MM:SS
     def format_time(ms):
@@ -65,9 +191,11 @@ def transcribe_audio(job_id, audio_path, assemblyai_api_key):
         return f"{hours:02}:{minutes:02}:{seconds:02}"
     
     # Collect transcript utterances with speaker labels
+    # (sorted on exact ms start so CSV rows line up with the word timings file)
+    utterances = sorted(transcript.utterances or [], key=lambda u: u.start)
     data = []
-    if transcript.utterances:
-        for utt in transcript.utterances:
+    if utterances:
+        for utt in utterances:
             start = format_time(utt.start)
             end = format_time(utt.end)
             data.append([f"Speaker {utt.speaker}", start, end, utt.text])
@@ -80,24 +208,30 @@ def transcribe_audio(job_id, audio_path, assemblyai_api_key):
     
     # Ensure chronological order
     df_out["SortKey"] = pd.to_timedelta(df_out["Start Time"])
-    df_out = df_out.sort_values("SortKey").drop(columns=["SortKey"]).reset_index(drop=True)
+    df_out = df_out.sort_values("SortKey", kind="stable").drop(columns=["SortKey"]).reset_index(drop=True)
     
     # Create transcripts directory
     transcripts_dir = f"backend/job_files/{job_id}/transcripts"
     os.makedirs(transcripts_dir, exist_ok=True)
     
     # Save to CSV
-    csv_path = os.path.join(transcripts_dir, "transcript.csv")
+    csv_path = os.path.join(transcripts_dir, f"{basename}.csv")
     df_out.to_csv(csv_path, index=False, encoding="utf-8-sig")
     print(f"💾 Transcript saved as {csv_path}")
     
     # Save to TXT (speaker-friendly format)
-    txt_path = os.path.join(transcripts_dir, "transcript.txt")
+    txt_path = os.path.join(transcripts_dir, f"{basename}.txt")
     with open(txt_path, "w", encoding="utf-8") as f:
         for i, row in df_out.iterrows():
             f.write(f"[{row['Speaker']}] {row['Start Time']} - {row['End Time']} | {row['Transcription']}\n")
     print(f"💾 Transcript also saved as {txt_path}")
     
+    # Save ms-precision timings (used by Step 4 for exact speaker intervals)
+    if utterances:
+        words_path = os.path.join(transcripts_dir, f"{basename}_words.npz")
+        word_count = save_word_timings(words_path, utterances)
+        print(f"💾 Word timings saved as {words_path} ({word_count} words)")
+    
     # Print preview
     print("\n📑 Transcript Preview (first 5 utterances):\n")
     for i, row in df_out.head(5).iterrows():
@@ -107,3 +241,46 @@ def transcribe_audio(job_id, audio_path, assemblyai_api_key):
         print(f"\n... and {len(df_out) - 5} more utterances")
     
     return [csv_path, txt_path]
+
+
+def save_word_timings(path, utterances):
+    """
+    Save utterance and word timings in milliseconds as a compact npz.
+    
+    Arrays (utterances in transcript.csv row order):
+        speakers          unique speaker labels
+        utt_start_ms      int64 per utterance
+        utt_end_ms        int64 per utterance
+        utt_speaker       int16 index into speakers
+        word_start_ms     int64 per word
+        word_end_ms       int64 per word
+        word_utt          int32 utterance index of each word
+        word_text         word strings
+    
+    Returns:
+        int: number of words saved
+    """
+    speakers = sorted({str(u.speaker) for u in utterances})
+    speaker_index = {sp: i for i, sp in enumerate(speakers)}
+    
+    word_start, word_end, word_utt, word_text = [], [], [], []
+    for i, utt in enumerate(utterances):
+        for w in (getattr(utt, 'words', None) or []):
+            word_start.append(int(w.start))
+            word_end.append(int(w.end))
+            word_utt.append(i)
+            word_text.append(str(w.text))
+    
+    np.savez_compressed(
+        path,
+        speakers=np.array(speakers),
+        utt_start_ms=np.array([int(u.start) for u in utterances], dtype=np.int64),
+        utt_end_ms=np.array([int(u.end) for u in utterances], dtype=np.int64),
+        utt_speaker=np.array([speaker_index[str(u.speaker)] for u in utterances], dtype=np.int16),
+        word_start_ms=np.array(word_start, dtype=np.int64),
+        word_end_ms=np.array(word_end, dtype=np.int64),
+        word_utt=np.array(word_utt, dtype=np.int32),
+        word_text=np.array(word_text, dtype=str),
+    )
+    
+    return len(word_text)
@@ -3,16 +3,28 @@ Step 4: Merge AssemblyAI Transcription with YouTube Captions
 
 This step combines:
 - Speaker labels and timestamps from AssemblyAI (transcript.csv)
-- Actual text content from YouTube auto-generated captions (captions.json)
+- Millisecond word timings from Step 3 (transcript_words.npz), when present,
+  for exact speaker intervals instead of whole-second boundaries
+- Actual text content from YouTube auto-generated captions (captions.npy +
+  captions_tokens.bin from Step 2, or captions.json for older jobs)
 
 Output: final_transcript.txt with format:
 [Speaker X] HH:MM:SS - HH:MM:SS | merged text from YouTube
+
+The merge runs on NumPy arrays (see merge_caption_words); run this module
+directly to benchmark it on a synthetic 4-hour stream:
+    python -m backend.pipeline.step04_merge_transcripts [words] [segments]
 """
 
+import sys
 import json
+import time
+import numpy as np
 import pandas as pd
-from bisect import bisect_right
 import os
+from backend.pipeline.step02_download_captions import (
+    load_caption_artifact, build_caption_arrays, CAPTIONS_INDEX_FILE
+)
 
 
 def time_to_seconds(t):
@@ -29,6 +41,132 @@ def time_to_seconds(t):
     return h * 3600 + m * 60 + s
 
 
+def times_to_seconds(times):
+    """Vectorized time_to_seconds for a Series of HH:MM:SS or MM:SS strings"""
+    parts = times.astype(str).str.split(":", expand=True)
+    if parts.shape[1] not in (2, 3):
+        raise ValueError("Time must be MM:SS or HH:MM:SS")
+    parts = parts.apply(pd.to_numeric).to_numpy(dtype=np.float64)
+    if np.isnan(parts[:, :2]).any():
+        raise ValueError("Time must be MM:SS or HH:MM:SS")
+
+    if parts.shape[1] == 2:
+        return parts[:, 0] * 60 + parts[:, 1]
+
+    # Mixed column: rows without a third part are MM:SS
+    has_hours = ~np.isnan(parts[:, 2])
+    return np.where(has_hours,
+                    parts[:, 0] * 3600 + parts[:, 1] * 60 + np.nan_to_num(parts[:, 2]),
+                    parts[:, 0] * 60 + parts[:, 1])
+
+
+def merge_caption_words(seg_start, seg_end, word_times, tok_off, blob):
+    """
+    Assign caption words to speaker segments and join them per segment.
+
+    The timeline is split at the midpoint between each segment's end and the
+    next segment's start; every word goes to the segment its start time falls
+    in (one searchsorted for all words). Each segment's words form one
+    contiguous run, joined by slicing the space-joined token blob between
+    byte offsets, so no per-word Python objects are created.
+
+    Args:
+        seg_start, seg_end: segment times in seconds, sorted by start
+        word_times: word start times in seconds, sorted
+        tok_off: byte offset of each word in blob
+        blob: caption tokens joined with b" "
+
+    Returns:
+        list of merged text per segment (None where no words were assigned)
+    """
+    n_segments = len(seg_start)
+    if n_segments == 0:
+        return []
+    if len(word_times) == 0:
+        return [None] * n_segments
+
+    midpoints = (np.asarray(seg_end[:-1], dtype=np.float64) +
+                 np.asarray(seg_start[1:], dtype=np.float64)) / 2.0
+    # A segment nested inside a longer one can put its midpoint before the
+    # previous one; keep the boundaries monotonic so every segment owns one
+    # contiguous run of words (a nested segment may get none)
+    midpoints = np.maximum.accumulate(midpoints)
+    seg_idx = np.searchsorted(midpoints, word_times, side="right")
+
+    texts = [None] * n_segments
+    tok_off = np.asarray(tok_off, dtype=np.int64)
+    tok_end = np.append(tok_off[1:] - 1, len(blob))
+    bounds = np.searchsorted(seg_idx, np.arange(n_segments + 1), side="left")
+    data = bytes(blob)
+    for i in np.flatnonzero(bounds[1:] > bounds[:-1]):
+        texts[i] = data[tok_off[bounds[i]]:tok_end[bounds[i + 1] - 1]].decode("utf-8").strip()
+    return texts
+
+
+def load_speaker_intervals(words_file, n_rows):
+    """
+    Exact speaker intervals (seconds) from Step 3's word timings.
+    
+    Each utterance spans its first word start to its last word end; an
+    utterance without words keeps its own ms start/end.
+    
+    Returns:
+        (start_s, end_s) arrays aligned with transcript.csv rows, or None if
+        the file is missing or does not match the CSV
+    """
+    if not os.path.exists(words_file):
+        return None
+    
+    with np.load(words_file) as data:
+        utt_start = data["utt_start_ms"].astype(np.float64)
+        utt_end = data["utt_end_ms"].astype(np.float64)
+        word_start = data["word_start_ms"]
+        word_end = data["word_end_ms"]
+        word_utt = data["word_utt"]
+    
+    if len(utt_start) != n_rows:
+        print(f"⚠️ Word timings cover {len(utt_start)} utterances but transcript has {n_rows}, ignoring them")
+        return None
+    
+    start_ms = utt_start.copy()
+    end_ms = utt_end.copy()
+    if len(word_utt):
+        first = np.full(n_rows, np.inf)
+        last = np.full(n_rows, -np.inf)
+        np.minimum.at(first, word_utt, word_start)
+        np.maximum.at(last, word_utt, word_end)
+        has_words = np.isfinite(first)
+        start_ms[has_words] = first[has_words]
+        end_ms[has_words] = last[has_words]
+    
+    return start_ms / 1000.0, end_ms / 1000.0
+
+
+def load_captions(captions_folder):
+    """
+    Memory-map Step 2's caption artifact.
+    
+    Jobs created before the artifact existed only have captions.json; those
+    are converted in memory with the same token rules.
+    
+    Returns:
+        (index, blob) or (None, None) if no captions are available
+    """
+    artifact = load_caption_artifact(captions_folder)
+    if artifact is not None:
+        print(f"📄 Memory-mapping YouTube captions: {os.path.join(captions_folder, CAPTIONS_INDEX_FILE)}")
+        return artifact
+    
+    captions_file = os.path.join(captions_folder, "captions.json")
+    if not os.path.exists(captions_file):
+        return None, None
+    
+    print(f"📄 Loading YouTube captions: {captions_file}")
+    with open(captions_file, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return build_caption_arrays(data.get("events", []))
+
+
 def run(job_folder):
     """
     Merge AssemblyAI transcript with YouTube captions.
@@ -56,81 +194,35 @@ def run(job_folder):
         print(f"📄 Loading AssemblyAI transcript: {assembly_file}")
         assembly_df = pd.read_csv(assembly_file)
 
-        # Convert times to seconds
-        assembly_df["start_s"] = assembly_df["Start Time"].apply(
-            time_to_seconds)
-        assembly_df["end_s"] = assembly_df["End Time"].apply(time_to_seconds)
-        assembly_df = assembly_df.sort_values("start_s").reset_index(drop=True)
-
-        # Extract speaker segments
-        speakers = []
-        for _, r in assembly_df.iterrows():
-            speakers.append({
-                "speaker": r["Speaker"],
-                "start": r["start_s"],
-                "end": r["end_s"],
-                "start_str": r["Start Time"],
-                "end_str": r["End Time"],
-                "assembly_text": r.get("Transcription", "")
-            })
-
-        print(f"✓ Found {len(speakers)} speaker segments")
-
-        # --- Parse YouTube captions into word-level timestamps ---
-        youtube_words = []
-        captions_file = os.path.join(job_folder, "captions/captions.json")
-
-        if not os.path.exists(captions_file):
+        # Convert times to seconds (ms precision when word timings exist)
+        intervals = load_speaker_intervals(
+            os.path.join(job_folder, "transcripts/transcript_words.npz"), len(assembly_df))
+        if intervals is not None:
+            assembly_df["start_s"], assembly_df["end_s"] = intervals
+            print("✓ Using millisecond speaker intervals from word timings")
+        else:
+            assembly_df["start_s"] = times_to_seconds(assembly_df["Start Time"])
+            assembly_df["end_s"] = times_to_seconds(assembly_df["End Time"])
+        assembly_df = assembly_df.sort_values("start_s", kind="stable").reset_index(drop=True)
+
+        print(f"✓ Found {len(assembly_df)} speaker segments")
+
+        # --- Load YouTube caption tokens (memory-mapped artifact from Step 2) ---
+        captions_folder = os.path.join(job_folder, "captions")
+        caption_index, caption_blob = load_captions(captions_folder)
+
+        if caption_index is None:
             return {
                 'status': 'failed',
-                'message': 'captions.json not found',
+                'message': 'Captions not found (captions.npy or captions.json)',
                 'output_files': []
             }
 
-        print(f"📄 Loading YouTube captions: {captions_file}")
-
-        with open(captions_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        # Parse JSON3 format with word-level timestamps
-        for ev in data.get("events", []):
-            base = ev.get("tStartMs", 0) / 1000.0
-            dur_ms = ev.get("dDurationMs", None)
-            segs = ev.get("segs", [])
-
-            for seg in segs:
-                text = seg.get("utf8")
-                if not text or text.strip() == "":
-                    continue
-
-                offset_ms = seg.get("tOffsetMs", 0)
-                tokens = text.strip().split()
-
-                if not tokens:
-                    continue
-
-                if len(tokens) == 1:
-                    # Single word - use exact timestamp
-                    t = base + offset_ms / 1000.0
-                    youtube_words.append((t, tokens[0]))
-                else:
-                    # Multiple words - distribute evenly across duration
-                    if dur_ms:
-                        dur = dur_ms / 1000.0
-                        for i, tk in enumerate(tokens):
-                            t = base + (i * dur / max(1, len(tokens)))
-                            youtube_words.append((t, tk))
-                    else:
-                        # No duration - space words 1ms apart
-                        t_base = base + offset_ms / 1000.0
-                        for i, tk in enumerate(tokens):
-                            t = t_base + i * 0.001
-                            youtube_words.append((t, tk))
-
-        youtube_words.sort(key=lambda x: x[0])
-        print(f"✓ Extracted {len(youtube_words)} words from YouTube captions")
-
-        if not speakers:
+        # Artifact is already sorted by time; tokens are space-joined in the blob
+        word_times = caption_index["start_ms"] / 1000.0
+        print(f"✓ Extracted {len(caption_index)} words from YouTube captions")
+
+        if assembly_df.empty:
             return {
                 'status': 'failed',
                 'message': 'No speaker segments found',
@@ -138,32 +230,24 @@ def run(job_folder):
             }
 
         # --- Partition timeline between speakers using midpoints ---
-        midpoints = []
-        for i in range(len(speakers) - 1):
-            mid = (speakers[i]["end"] + speakers[i + 1]["start"]) / 2.0
-            midpoints.append(mid)
-
-        # Assign YouTube words to speaker segments
-        assigned = [[] for _ in speakers]
-        for t, token in youtube_words:
-            idx = bisect_right(midpoints, t)
-            assigned[idx].append((t, token))
+        merged = merge_caption_words(
+            assembly_df["start_s"].to_numpy(), assembly_df["end_s"].to_numpy(),
+            word_times, caption_index["tok_off"], caption_blob)
 
-        print(f"✓ Assigned YouTube words to {len(speakers)} speaker segments")
+        print(f"✓ Assigned YouTube words to {len(assembly_df)} speaker segments")
 
         # --- Build final merged transcript ---
-        final_lines = []
-        for i, sp in enumerate(speakers):
-            words = [tok for _, tok in assigned[i]]
-            if words:
-                merged_text = " ".join(words).strip()
-            else:
-                # Fallback to AssemblyAI text if no YouTube words found
-                merged_text = sp["assembly_text"].strip()
-
-            final_lines.append(
-                f"[{sp['speaker']}] {sp['start_str']} - {sp['end_str']} | {merged_text}"
-            )
+        # Fallback to AssemblyAI text where no YouTube words were found
+        if "Transcription" in assembly_df:
+            assembly_text = assembly_df["Transcription"].fillna("").astype(str).str.strip()
+        else:
+            assembly_text = pd.Series([""] * len(assembly_df))
+        final_lines = [
+            f"[{speaker}] {start_str} - {end_str} | {text if text is not None else fallback}"
+            for speaker, start_str, end_str, text, fallback in zip(
+                assembly_df["Speaker"], assembly_df["Start Time"], assembly_df["End Time"],
+                merged, assembly_text)
+        ]
 
         # --- Save final transcript ---
         output_file = os.path.join(job_folder, "transcripts", "final_transcript.txt")
@@ -183,7 +267,7 @@ def run(job_folder):
         return {
             'status': 'success',
             'message':
-            f'Merged {len(speakers)} speaker segments with YouTube captions',
+            f'Merged {len(assembly_df)} speaker segments with YouTube captions',
             'output_files': ['final_transcript.txt']
         }
 
@@ -196,3 +280,47 @@ def run(job_folder):
             'message': f'Error merging transcripts: {str(e)}',
             'output_files': []
         }
+
+
+def benchmark_merge(n_words=50000, n_segments=3000, duration_sec=4 * 3600, seed=0):
+    """
+    Time merge_caption_words on a synthetic caption stream.
+    
+    Builds n_words random tokens spread over duration_sec and n_segments
+    back-to-back speaker segments, then times the merge (best of 5).
+    
+    Returns:
+        dict with sizes and timings in milliseconds
+    """
+    rng = np.random.default_rng(seed)
+    word_times = np.sort(rng.uniform(0, duration_sec, n_words))
+    tokens = [f"w{i}" for i in rng.integers(0, 5000, n_words)]
+    index, blob = build_caption_arrays([{
+        'tStartMs': int(t * 1000), 'dDurationMs': 0, 'segs': [{'utf8': tok}]
+    } for t, tok in zip(word_times, tokens)])
+    
+    bounds = np.sort(rng.uniform(0, duration_sec, n_segments - 1))
+    seg_start = np.concatenate(([0.0], bounds))
+    seg_end = np.concatenate((bounds - rng.uniform(0, 0.5, n_segments - 1), [duration_sec]))
+    
+    timings = []
+    for _ in range(5):
+        t0 = time.perf_counter()
+        merge_caption_words(seg_start, seg_end, index["start_ms"] / 1000.0, index["tok_off"], blob)
+        timings.append((time.perf_counter() - t0) * 1000)
+    
+    result = {
+        'words': n_words,
+        'segments': n_segments,
+        'duration_sec': duration_sec,
+        'best_ms': round(min(timings), 2),
+        'median_ms': round(float(np.median(timings)), 2),
+    }
+    print(f"📊 Merge benchmark: {result}")
+    return result
+
+
+if __name__ == "__main__":
+    words = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    segments = int(sys.argv[2]) if len(sys.argv) > 2 else 3000
+    benchmark_merge(words, segments)
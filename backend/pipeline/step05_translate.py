@@ -3,11 +3,396 @@ Step 5: Translate to English using Google Cloud Translate API
 
 Translates final_transcript.txt from Hindi/mixed language to English
 while preserving speaker labels and timestamps.
+
+Lines are packed into batches under the API's per-request limits and the
+batches are translated concurrently, throttled by the shared rate limiter.
+Segments already in English pass through (see detect_languages), and a job
+whose captions are English (captions_meta.json) skips translation entirely.
+
+Filter-first mode (TRANSLATE_FILTER_FIRST): speakers are detected on a
+translated sample first and only the Anchor/Pradip lines are translated, so
+transcript_english.txt already holds just the lines Step 7 keeps. Step 6
+then reuses analysis/detected_speakers.txt, and a restart of Step 6 starts
+from this step.
 """
 
 import os
+import re
+import json
 import html
-from google.cloud import translate_v2 as translate
+import time
+from concurrent.futures import ThreadPoolExecutor
+from backend.utils.rate_limiter import get_rate_limiter
+from backend.utils.provider_clients import get_translate_client
+from backend.utils import translation_memory
+from backend.pipeline import step06_detect_speakers
+from backend.pipeline.step07_filter_transcription import parse_detected_speakers, filter_speaker_lines
+from backend.pipeline.step02_download_captions import CAPTIONS_META_FILE
+
+# Translation API v2 limits: 128 text segments per request; Google
+# recommends keeping a request under 5,000 characters
+TRANSLATE_MAX_SEGMENTS = 128
+TRANSLATE_MAX_CHARS = 5000
+
+# Batches in flight per job, and requests/second shared by all jobs
+TRANSLATE_CONCURRENCY = int(os.environ.get('TRANSLATE_CONCURRENCY', 4))
+TRANSLATE_RATE_PER_SEC = float(os.environ.get('TRANSLATE_RATE_PER_SEC', 5))
+TRANSLATE_MAX_RETRIES = 3
+
+# Translation memory key parts: bump the engine version to invalidate entries
+SOURCE_LANGUAGE = "hi"
+TARGET_LANGUAGE = "en"
+TRANSLATE_ENGINE = "google-translate-v2"
+
+# Local language guess (see guess_language): common words per language
+WORD_PATTERN = re.compile(r"[a-z']+")
+ENGLISH_WORDS = set("""
+a an the and or but if of to in on at by for with from as is are was were be been
+this that these those it its i you he she we they my your our their me him her us them
+what which who when where why how not no yes so very too can could will would should
+do does did have has had there here all any some more most other just also than then
+now up down out about into over after before good buy sell stock stocks share shares
+market price target stop loss level levels support resistance long term short sir
+thank thanks okay ok right let lets let's please tell know think see look
+""".split())
+HINGLISH_WORDS = set("""
+hai hain ka ki ke ko se mein nahi nahin aur bhi toh kya yeh ye woh wo
+hum aap ap tum kar karo karna kare karenge hoga hogi raha rahe rahi tha thi
+bahut accha acha achha lekin jo jab tab kuch sab abhi ji haan
+""".split())
+
+# Detect speakers on a translated sample, then translate only Anchor/Pradip lines
+FILTER_FIRST = os.environ.get('TRANSLATE_FILTER_FIRST', 'false').lower() in ('1', 'true', 'yes')
+
+
+def plan_batches(texts, max_segments=TRANSLATE_MAX_SEGMENTS, max_chars=TRANSLATE_MAX_CHARS):
+    """
+    Pack texts, in order, into batches of at most max_segments texts and
+    max_chars characters. A single longer text gets a batch of its own.
+    
+    Returns:
+        list of (start, end) index ranges into texts
+    """
+    batches = []
+    start, chars = 0, 0
+    for i, text in enumerate(texts):
+        if i > start and (i - start >= max_segments or chars + len(text) > max_chars):
+            batches.append((start, i))
+            start, chars = i, 0
+        chars += len(text)
+    if start < len(texts):
+        batches.append((start, len(texts)))
+    return batches
+
+
+def call_with_retries(request, limiter=None, what="Translation"):
+    """Run one API request under the rate limiter, retrying with backoff"""
+    for attempt in range(TRANSLATE_MAX_RETRIES):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            return request()
+        except Exception as e:
+            if attempt == TRANSLATE_MAX_RETRIES - 1:
+                raise
+            print(f"⚠️ {what} batch failed ({str(e)}), retrying...")
+            time.sleep(2 ** attempt)
+
+
+def translate_batch(translate_client, texts, source_language=SOURCE_LANGUAGE, limiter=None):
+    """Translate one batch to English"""
+    def request():
+        results = translate_client.translate(
+            texts,
+            source_language=source_language,
+            target_language=TARGET_LANGUAGE,
+            format_="text"
+        )
+        return [html.unescape(r["translatedText"]) for r in results]
+    
+    return call_with_retries(request, limiter, "Translation")
+
+
+def detect_batch(translate_client, texts, limiter=None):
+    """Detect the language code of each text in one batch"""
+    def request():
+        return [r.get("language", "und") for r in translate_client.detect_language(texts)]
+    
+    return call_with_retries(request, limiter, "Language detection")
+
+
+def run_batches(request_batch, texts, max_workers=TRANSLATE_CONCURRENCY, label="Translating"):
+    """
+    Send texts in batches, several batches at a time.
+    
+    Args:
+        request_batch: function(batch_texts, limiter) -> list of results
+        
+    Returns:
+        (results in input order, number of batches)
+    """
+    batches = plan_batches(texts)
+    if not batches:
+        return [], 0
+    
+    limiter = get_rate_limiter('google_translate', TRANSLATE_RATE_PER_SEC,
+                               max(TRANSLATE_RATE_PER_SEC, TRANSLATE_CONCURRENCY))
+    print(f"📦 {label} {len(texts)} lines in {len(batches)} batches "
+          f"({max_workers} concurrent)")
+    
+    results = [None] * len(texts)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as executor:
+        futures = [
+            (start, end, executor.submit(request_batch, texts[start:end], limiter))
+            for start, end in batches
+        ]
+        for n, (start, end, future) in enumerate(futures, 1):
+            results[start:end] = future.result()
+            print(f"Batch {n}/{len(batches)}: ✅ lines {start + 1}-{end}")
+    
+    return results, len(batches)
+
+
+def translate_texts(translate_client, texts, source_language=SOURCE_LANGUAGE,
+                    max_workers=TRANSLATE_CONCURRENCY):
+    """
+    Translate texts in batches, several batches at a time.
+    
+    Returns:
+        (translations in input order, number of batches)
+    """
+    return run_batches(
+        lambda batch, limiter: translate_batch(translate_client, batch, source_language, limiter),
+        texts, max_workers, "Translating")
+
+
+def guess_language(text):
+    """
+    Cheap local language guess for one transcript segment.
+    
+    Devanagari text is Hindi. Latin-script text is English when most words
+    are common English words and none are common romanized Hindi words;
+    text with no letters at all (numbers, prices) needs no translation.
+    
+    Returns:
+        'hi', 'en', or None when unsure
+    """
+    devanagari = sum(1 for ch in text if '\u0900' <= ch <= '\u097f')
+    latin = sum(1 for ch in text if ch.isascii() and ch.isalpha())
+    
+    if devanagari:
+        return 'hi' if devanagari >= 0.2 * (devanagari + latin) else None
+    if not latin:
+        return 'en' if not any(ch.isalpha() for ch in text) else None
+    
+    words = WORD_PATTERN.findall(text.lower())
+    if not words:
+        return None
+    hindi = sum(1 for w in words if w in HINGLISH_WORDS)
+    english = sum(1 for w in words if w in ENGLISH_WORDS)
+    
+    if hindi >= max(1, 0.15 * len(words)):
+        return 'hi'
+    if hindi == 0 and english >= 0.4 * len(words) and len(words) >= 3:
+        return 'en'
+    return None
+
+
+def detect_languages(translate_client, texts, caption_language=None):
+    """
+    Language code per text: local heuristic first, then one batched API
+    detection for the segments the heuristic is unsure about.
+    
+    English captions (caption_language 'en') skip detection entirely.
+    
+    Returns:
+        (language codes aligned with texts, number of texts sent to the API)
+    """
+    if caption_language == 'en':
+        return ['en'] * len(texts), 0
+    
+    languages = [guess_language(t) for t in texts]
+    unsure = [i for i, lang in enumerate(languages) if lang is None]
+    
+    if unsure:
+        detected, _ = run_batches(
+            lambda batch, limiter: detect_batch(translate_client, batch, limiter),
+            [texts[i] for i in unsure], label="Detecting language of")
+        for i, lang in zip(unsure, detected):
+            languages[i] = lang
+    
+    # Undetermined segments are treated as the channel's usual Hindi
+    languages = [SOURCE_LANGUAGE if lang in (None, 'und') else lang for lang in languages]
+    return languages, len(unsure)
+
+
+def translate_with_memory(translate_client, texts, source_language=SOURCE_LANGUAGE):
+    """
+    Translate texts, reusing the shared translation memory.
+    
+    Texts already in the memory (or repeated within this transcript) are not
+    sent to Google; new translations are written back for later jobs.
+    
+    Returns:
+        (translations in input order, stats dict with hits, misses, batches)
+    """
+    keys = [translation_memory.memory_key(t, source_language, TARGET_LANGUAGE, TRANSLATE_ENGINE)
+            for t in texts]
+    known = translation_memory.lookup(keys)
+    
+    # One request entry per distinct missing text
+    miss_keys, miss_texts = [], []
+    seen = set(known)
+    for key, text in zip(keys, texts):
+        if key not in seen:
+            seen.add(key)
+            miss_keys.append(key)
+            miss_texts.append(text)
+    
+    hits = sum(1 for key in keys if key in known)
+    print(f"🧠 Translation memory: {hits}/{len(texts)} lines found, "
+          f"{len(miss_texts)} distinct lines to translate")
+    
+    new_translations, batch_count = translate_texts(translate_client, miss_texts, source_language)
+    fresh = dict(zip(miss_keys, new_translations))
+    translation_memory.store(zip(miss_keys, miss_texts, new_translations),
+                             source_language, TARGET_LANGUAGE, TRANSLATE_ENGINE)
+    
+    translations = [known.get(key, fresh.get(key)) for key in keys]
+    stats = {'hits': hits, 'misses': len(texts) - hits, 'batches': batch_count}
+    return translations, stats
+
+
+def translate_segments(translate_client, texts, caption_language=None):
+    """
+    Translate the non-English segments, grouped by detected source language;
+    English segments pass through unchanged.
+    
+    Returns:
+        (translations in input order, stats dict with hits, misses, batches,
+        english, detected)
+    """
+    languages, detected = detect_languages(translate_client, texts, caption_language)
+    
+    translations = list(texts)
+    stats = {'hits': 0, 'misses': 0, 'batches': 0, 'english': 0, 'detected': detected}
+    for language in sorted(set(languages)):
+        indexes = [i for i, lang in enumerate(languages) if lang == language]
+        if language == TARGET_LANGUAGE:
+            stats['english'] += len(indexes)
+            print(f"⏭ {len(indexes)} lines already in English, kept as they are")
+            continue
+        
+        group, group_stats = translate_with_memory(
+            translate_client, [texts[i] for i in indexes], language)
+        for i, eng in zip(indexes, group):
+            translations[i] = eng
+        for key in ('hits', 'misses', 'batches'):
+            stats[key] += group_stats[key]
+    
+    return translations, stats
+
+
+def translate_lines(translate_client, lines, caption_language=None):
+    """
+    Translate transcript lines, keeping [Speaker] time prefixes.
+    
+    Blank lines stay blank and prefix-only lines are kept as they are.
+    
+    Returns:
+        (translated lines aligned with lines, stats dict from translate_segments)
+    """
+    # Split each line into its [Speaker] time prefix and the text to translate
+    translated_lines = []
+    pending = []  # (output index, prefix or None, text)
+    for raw_line in lines:
+        orig = raw_line.rstrip("\n")
+        
+        # Keep blank lines
+        if not orig.strip():
+            translated_lines.append("")
+            continue
+        
+        # Unescape any HTML entities already present
+        line = html.unescape(orig).strip()
+        
+        # Detect speaker/timestamp prefix if present
+        if "|" in line:
+            prefix, text = line.split("|", 1)
+            text = text.strip()
+            if text:
+                # Translate only the text part, preserve prefix
+                pending.append((len(translated_lines), prefix, text))
+        else:
+            # No prefix, translate entire line
+            pending.append((len(translated_lines), None, line))
+        
+        translated_lines.append(line)
+    
+    translations, stats = translate_segments(
+        translate_client, [text for _, _, text in pending], caption_language)
+    
+    for (index, prefix, _), eng in zip(pending, translations):
+        translated_lines[index] = f"{prefix} | {eng}" if prefix is not None else eng
+    
+    return translated_lines, stats
+
+
+def translate_detected_speakers(job_folder, translate_client, lines, caption_language=None):
+    """
+    Filter-first translation.
+    
+    Translates the first SAMPLE_SIZE lines, detects the Anchor and Pradip on
+    them (saved to analysis/detected_speakers.txt as Step 6 would) and then
+    translates only the remaining lines of those two speakers.
+    
+    Returns:
+        (translated Anchor/Pradip lines, stats dict, speakers_detected text, total line count)
+    """
+    lines = [line.strip() for line in lines if line.strip()]
+    sample = lines[:step06_detect_speakers.SAMPLE_SIZE]
+    
+    print(f"🔍 Filter-first: translating a {len(sample)}-line sample for speaker detection...")
+    sample_english, stats = translate_lines(translate_client, sample, caption_language)
+    
+    speakers_detected, _ = step06_detect_speakers.detect_speakers(sample_english)
+    anchor_speaker, pradip_speaker = parse_detected_speakers(speakers_detected)
+    if not anchor_speaker or not pradip_speaker:
+        raise Exception(f"Could not parse Anchor and Pradip from speaker detection: {speakers_detected}")
+    
+    print(f"✅ Anchor detected as: {anchor_speaker}")
+    print(f"✅ Pradip detected as: {pradip_speaker}")
+    
+    detected_file = os.path.join(job_folder, "analysis", "detected_speakers.txt")
+    os.makedirs(os.path.dirname(detected_file), exist_ok=True)
+    with open(detected_file, "w", encoding="utf-8") as f:
+        f.write(speakers_detected)
+    
+    # Translate only the kept lines the sample has not covered
+    kept = filter_speaker_lines(lines, anchor_speaker, pradip_speaker)
+    sample_map = dict(zip(sample, sample_english))
+    remaining = [line for line in kept if line not in sample_map]
+    print(f"✓ Kept {len(kept)} of {len(lines)} lines, {len(remaining)} left to translate")
+    
+    remaining_english, rest_stats = translate_lines(translate_client, remaining, caption_language)
+    remaining_map = dict(zip(remaining, remaining_english))
+    for key in stats:
+        stats[key] += rest_stats[key]
+    
+    english = [sample_map[line] if line in sample_map else remaining_map[line] for line in kept]
+    return english, stats, speakers_detected, len(lines)
+
+
+def get_caption_language(job_folder):
+    """Caption language recorded by Step 2 (captions_meta.json), or None"""
+    meta_file = os.path.join(job_folder, "captions", CAPTIONS_META_FILE)
+    if not os.path.exists(meta_file):
+        return None
+    try:
+        with open(meta_file, "r", encoding="utf-8") as f:
+            return json.load(f).get('language')
+    except (OSError, ValueError):
+        return None
 
 
 def run(job_folder, google_credentials_path):
@@ -26,12 +411,14 @@ def run(job_folder, google_credentials_path):
     print(f"{'='*60}\n")
     
     try:
-        # Set Google Cloud credentials
-        os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = google_credentials_path
-        
-        # Initialize Translation Client
-        print("🔑 Initializing Google Cloud Translate client...")
-        translate_client = translate.Client()
+        # English captions need no translation at all
+        caption_language = get_caption_language(job_folder)
+        if caption_language == 'en':
+            print("⏭ Captions are already in English, skipping translation")
+            translate_client = None
+        else:
+            # Shared, credentialed client (no process-wide credentials env var)
+            translate_client = get_translate_client(google_credentials_path)
         
         # Input/Output paths
         input_file = os.path.join(job_folder, "transcripts", "final_transcript.txt")
@@ -52,50 +439,22 @@ def run(job_folder, google_credentials_path):
         
         print(f"✓ Total lines to translate: {len(lines)}")
         
-        # Translate each line
-        translated_lines = []
-        for i, raw_line in enumerate(lines):
-            orig = raw_line.rstrip("\n")
-            
-            # Keep blank lines
-            if not orig.strip():
-                translated_lines.append("")
-                print(f"Line {i+1}: ⏭ blank")
-                continue
-            
-            # Unescape any HTML entities already present
-            line = html.unescape(orig).strip()
-            
-            # Detect speaker/timestamp prefix if present
-            if "|" in line:
-                prefix, text = line.split("|", 1)
-                text = text.strip()
-                
-                if text:
-                    # Translate only the text part, preserve prefix
-                    result = translate_client.translate(
-                        text,
-                        source_language="hi",
-                        target_language="en",
-                        format_="text"
-                    )
-                    eng = html.unescape(result["translatedText"])
-                    translated_line = f"{prefix} | {eng}"
-                else:
-                    translated_line = line
-            else:
-                # No prefix, translate entire line
-                result = translate_client.translate(
-                    line,
-                    source_language="hi",
-                    target_language="en",
-                    format_="text"
-                )
-                eng = html.unescape(result["translatedText"])
-                translated_line = eng
-            
-            translated_lines.append(translated_line)
-            print(f"Line {i+1}: ✅")
+        output_files = ['transcript_english.txt']
+        if FILTER_FIRST:
+            translated_lines, tm_stats, speakers_detected, total = translate_detected_speakers(
+                job_folder, translate_client, lines, caption_language)
+            output_files.append('analysis/detected_speakers.txt')
+            summary = (f"Filter-first: translated {len(translated_lines)} Anchor/Pradip lines "
+                       f"of {total} ({speakers_detected.replace(chr(10), ', ')})")
+        elif caption_language == 'en':
+            translated_lines, tm_stats = translate_lines(translate_client, lines, caption_language)
+            summary = f"Captions already in English: kept {len(translated_lines)} lines untranslated"
+        else:
+            translated_lines, tm_stats = translate_lines(translate_client, lines)
+            summary = f"Translated {len(translated_lines)} lines to English"
+        
+        translated_count = tm_stats['hits'] + tm_stats['misses']
+        hit_rate = tm_stats['hits'] / translated_count * 100 if translated_count else 0.0
         
         # Save translated transcript
         with open(output_file, "w", encoding="utf-8") as f:
@@ -112,8 +471,10 @@ def run(job_folder, google_credentials_path):
         
         return {
             'status': 'success',
-            'message': f'Translated {len(translated_lines)} lines to English',
-            'output_files': ['transcript_english.txt']
+            'message': (f"{summary} ({tm_stats['english']} English lines passed through, "
+                        f"{tm_stats['batches']} batched requests, translation memory hits "
+                        f"{tm_stats['hits']}/{translated_count} = {hit_rate:.0f}%)"),
+            'output_files': output_files
         }
         
     except Exception as e:
@@ -7,45 +7,218 @@ This step analyzes the English transcript to identify:
 
 Input: transcript_english.txt
 Output: detected_speakers.txt
+
+Speakers are first scored locally (see score_speakers): talk time, question
+ratio, who is addressed as "Pradip ji"/"Halder" and stock-term density. The
+OpenAI call is only made when the local margin is too low to be confident.
+
+In filter-first mode (step05_translate.FILTER_FIRST) Step 5 has already run
+detection on a translated sample and written detected_speakers.txt; when
+Step 5 ran earlier in the same pipeline run, this step reuses that result
+instead of calling OpenAI again. transcript_english.txt then holds only the
+two detected speakers, so restarting this step from the UI restarts Step 5
+(detect and translate again) instead.
 """
 
 import os
-import psycopg2
-from openai import OpenAI
+import re
+from backend.utils.llm_gateway import chat
+from backend.pipeline.step04_merge_transcripts import time_to_seconds
 
 
-def get_openai_api_key():
-    """Fetch OpenAI API key from database"""
-    try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        cursor = conn.cursor()
+# Number of transcript lines sent to OpenAI for detection
+SAMPLE_SIZE = 200
+
+# Local scorer: minimum score lead over the runner-up to skip the LLM
+LOCAL_MIN_MARGIN = float(os.environ.get('SPEAKER_LOCAL_MIN_MARGIN', 0.15))
+# Speakers with less than this share of words (ads, jingles) are not candidates
+LOCAL_MIN_WORD_SHARE = 0.05
+
+LINE_PATTERN = re.compile(r"^\[(?P<speaker>[^\]]+)\]\s*(?P<start>[\d:]+)\s*-\s*(?P<end>[\d:]+)\s*\|\s*(?P<text>.*)$")
+WORD_PATTERN = re.compile(r"[\w₹']+")
+PRADIP_CUES = re.compile(r"\b(pradip|pradeep|halder|haldar)\b|प्रदीप|हालदार|हल्दर", re.IGNORECASE)
+QUESTION_START = re.compile(
+    r"^(what|how|which|why|where|when|should|would|could|can|will|is|are|do|does|tell|any)\b",
+    re.IGNORECASE)
+STOCK_TERMS = {
+    "stock", "stocks", "share", "shares", "target", "targets", "stop", "loss", "stoploss",
+    "support", "resistance", "breakout", "level", "levels", "buy", "sell", "hold", "chart",
+    "charts", "daily", "weekly", "monthly", "rupees", "rs", "₹", "nifty", "sensex", "trend",
+    "momentum", "accumulate", "exit", "entry", "upside", "downside", "bullish", "bearish",
+}
+
+
+def score_speakers(transcript_lines):
+    """
+    Score every diarized speaker as Anchor and as Pradip, locally.
+    
+    Pradip talks most, uses the most stock vocabulary and is the one
+    addressed by name; the Anchor asks the questions and addresses him.
+    Each signal is scaled to 0-1 against the strongest speaker.
+    
+    Returns:
+        dict of speaker -> {'anchor': score, 'pradip': score, ...signals}
+    """
+    stats = {}
+    previous = None
+    for line in transcript_lines:
+        match = LINE_PATTERN.match(line)
+        if not match:
+            continue
+        speaker = match.group("speaker").strip()
+        text = match.group("text")
+        words = WORD_PATTERN.findall(text.lower())
         
-        cursor.execute("""
-            SELECT key_value 
-            FROM api_keys 
-            WHERE LOWER(provider) = 'openai'
-            LIMIT 1
-        """)
+        st = stats.setdefault(speaker, {'lines': 0, 'words': 0, 'seconds': 0.0, 'questions': 0,
+                                        'stock_terms': 0, 'addressing': 0, 'addressed': 0})
+        st['lines'] += 1
+        st['words'] += len(words)
+        st['stock_terms'] += sum(1 for w in words if w in STOCK_TERMS)
+        try:
+            st['seconds'] += max(0, time_to_seconds(match.group("end")) - time_to_seconds(match.group("start")))
+        except ValueError:
+            pass
+        if text.rstrip().endswith("?") or QUESTION_START.match(text.strip()):
+            st['questions'] += 1
         
-        result = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        # Naming Pradip is addressing him; whoever talks next is being addressed
+        if previous is not None and previous[0] != speaker and previous[1]:
+            st['addressed'] += 1
+        named = bool(PRADIP_CUES.search(text))
+        if named:
+            st['addressing'] += 1
+        previous = (speaker, named)
+    
+    total_words = sum(st['words'] for st in stats.values()) or 1
+    candidates = {sp: st for sp, st in stats.items()
+                  if st['words'] / total_words >= LOCAL_MIN_WORD_SHARE}
+    
+    def scaled(values):
+        top = max(values.values()) if values else 0
+        return {sp: (v / top if top else 0.0) for sp, v in values.items()}
+    
+    talk = scaled({sp: st['words'] + 2 * st['seconds'] for sp, st in candidates.items()})
+    questions = scaled({sp: st['questions'] / st['lines'] for sp, st in candidates.items()})
+    stock = scaled({sp: st['stock_terms'] / max(1, st['words']) for sp, st in candidates.items()})
+    addressing = scaled({sp: st['addressing'] / st['lines'] for sp, st in candidates.items()})
+    addressed = scaled({sp: st['addressed'] for sp, st in candidates.items()})
+    
+    scores = {}
+    for sp in candidates:
+        scores[sp] = {
+            'pradip': round(0.3 * talk[sp] + 0.3 * stock[sp] + 0.3 * addressed[sp]
+                            + 0.1 * (1 - questions[sp]), 3),
+            'anchor': round(0.45 * questions[sp] + 0.35 * addressing[sp] + 0.2 * talk[sp], 3),
+            'talk': round(talk[sp], 2),
+            'questions': round(questions[sp], 2),
+            'stock': round(stock[sp], 2),
+            'addressing': round(addressing[sp], 2),
+            'addressed': round(addressed[sp], 2),
+        }
+    return scores
+
+
+def pick_speakers_locally(scores, min_margin=LOCAL_MIN_MARGIN):
+    """
+    Choose Pradip (best Pradip score), then the Anchor among the others.
+    
+    Returns:
+        (anchor, pradip, margin); anchor/pradip are None when fewer than two
+        candidates exist. margin is the smaller of the two leads.
+    """
+    if len(scores) < 2:
+        return None, None, 0.0
+    
+    by_pradip = sorted(scores, key=lambda sp: scores[sp]['pradip'], reverse=True)
+    pradip = by_pradip[0]
+    pradip_margin = scores[pradip]['pradip'] - scores[by_pradip[1]]['pradip']
+    
+    others = sorted((sp for sp in scores if sp != pradip),
+                    key=lambda sp: scores[sp]['anchor'], reverse=True)
+    anchor = others[0]
+    anchor_margin = (scores[anchor]['anchor'] - scores[others[1]]['anchor']
+                     if len(others) > 1 else 1.0)
+    
+    return anchor, pradip, min(pradip_margin, anchor_margin)
+
+
+def detect_speakers(transcript_lines):
+    """
+    Detect the Anchor and Pradip: local scorer first, OpenAI only when the
+    local margin is below LOCAL_MIN_MARGIN.
+    
+    Returns:
+        (str "Anchor: Speaker X\nPradip: Speaker Y", method 'local' or 'llm')
+    """
+    scores = score_speakers(transcript_lines)
+    for sp, sc in sorted(scores.items()):
+        print(f"   {sp:12} pradip={sc['pradip']:.2f} anchor={sc['anchor']:.2f} "
+              f"(talk {sc['talk']}, questions {sc['questions']}, stock {sc['stock']}, "
+              f"addressing {sc['addressing']}, addressed {sc['addressed']})")
+    
+    anchor, pradip, margin = pick_speakers_locally(scores)
+    if anchor is not None and margin >= LOCAL_MIN_MARGIN:
+        print(f"⚡ Local speaker scorer is confident (margin {margin:.2f}), no LLM call")
+        return f"Anchor: {anchor}\nPradip: {pradip}", 'local'
+    
+    print(f"🤔 Local speaker scorer is unsure (margin {margin:.2f}), asking OpenAI")
+    return detect_speakers_llm(transcript_lines), 'llm'
+
+
+def detect_speakers_llm(transcript_lines):
+    """
+    Ask OpenAI which speaker is the Anchor and which is Pradip Halder.
+    
+    Args:
+        transcript_lines: English transcript lines (only the first
+            SAMPLE_SIZE are sent)
         
-        if result:
-            return result[0]
-        else:
-            raise ValueError("OpenAI API key not found in database")
+    Returns:
+        str: "Anchor: Speaker X\nPradip: Speaker Y"
+    """
+    # Take first 200 lines as sample for speaker detection
+    sample_size = min(SAMPLE_SIZE, len(transcript_lines))
+    sample_text = "\n".join(transcript_lines[:sample_size])
     
-    except Exception as e:
-        raise Exception(f"Failed to fetch OpenAI API key: {str(e)}")
+    print(f"🔍 Using first {sample_size} lines as sample for detection...")
+    
+    # Create prompt for speaker detection
+    prompt_detect_speakers = f"""
+You are reading a stock market discussion transcript with multiple speakers (A, B, C, etc.).
+Identify:
+1. The speaker who is the TV Anchor / interviewer.
+2. The speaker who is Mr. Pradip Halder (the stock expert).
 
+Return ONLY in this format:
+Anchor: Speaker X
+Pradip: Speaker Y
 
-def run(job_folder):
+Transcript sample:
+{sample_text}
+"""
+    
+    # Call OpenAI API
+    print("🤖 Calling OpenAI API for speaker detection...")
+    return chat(
+        [
+            {"role": "system", "content": "Detect the TV Anchor and Pradip Halder speakers."},
+            {"role": "user", "content": prompt_detect_speakers}
+        ],
+        model="gpt-4o",
+        step=6,
+        temperature=0.3,
+        max_tokens=100
+    )
+
+
+def run(job_folder, reuse_detected=False):
     """
-    Detect speakers using OpenAI API.
+    Detect speakers locally, falling back to the OpenAI API.
     
     Args:
         job_folder: Path to job working directory
+        reuse_detected: keep a detected_speakers.txt written by Step 5 in
+            filter-first mode instead of detecting again
         
     Returns:
         dict with status, message, and output_files
@@ -55,17 +228,21 @@ def run(job_folder):
     print(f"{'='*60}\n")
 
     try:
-        # Get OpenAI API key from database
-        print("🔑 Fetching OpenAI API key from database...")
-        api_key = get_openai_api_key()
+        output_file = os.path.join(job_folder, "analysis", "detected_speakers.txt")
         
-        # Initialize OpenAI client
-        print("🤖 Initializing OpenAI client...")
-        client = OpenAI(api_key=api_key)
+        if reuse_detected and os.path.exists(output_file):
+            with open(output_file, "r", encoding="utf-8") as f:
+                speakers_detected = f.read().strip()
+            print("♻️ Filter-first mode: reusing speakers detected in Step 5")
+            print(speakers_detected)
+            return {
+                'status': 'success',
+                'message': f'Reused speakers detected during translation (filter-first): {speakers_detected}',
+                'output_files': ['analysis/detected_speakers.txt']
+            }
         
-        # Input/Output paths
+        # Input path
         input_file = os.path.join(job_folder, "transcripts", "transcript_english.txt")
-        output_file = os.path.join(job_folder, "analysis", "detected_speakers.txt")
         
         if not os.path.exists(input_file):
             return {
@@ -81,40 +258,7 @@ def run(job_folder):
         
         print(f"✓ Loaded {len(transcript_lines)} lines")
         
-        # Take first 200 lines as sample for speaker detection
-        sample_size = min(200, len(transcript_lines))
-        sample_text = "\n".join(transcript_lines[:sample_size])
-        
-        print(f"🔍 Using first {sample_size} lines as sample for detection...")
-        
-        # Create prompt for speaker detection
-        prompt_detect_speakers = f"""
-You are reading a stock market discussion transcript with multiple speakers (A, B, C, etc.).
-Identify:
-1. The speaker who is the TV Anchor / interviewer.
-2. The speaker who is Mr. Pradip Halder (the stock expert).
-
-Return ONLY in this format:
-Anchor: Speaker X
-Pradip: Speaker Y
-
-Transcript sample:
-{sample_text}
-"""
-        
-        # Call OpenAI API
-        print("🤖 Calling OpenAI API for speaker detection...")
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "Detect the TV Anchor and Pradip Halder speakers."},
-                {"role": "user", "content": prompt_detect_speakers}
-            ],
-            temperature=0.3,
-            max_tokens=100
-        )
-        
-        speakers_detected = response.choices[0].message.content.strip()
+        speakers_detected, method = detect_speakers(transcript_lines)
         
         print(f"\n✅ Detected Speakers:")
         print(speakers_detected)
@@ -127,7 +271,7 @@ Transcript sample:
         
         return {
             'status': 'success',
-            'message': f'Successfully detected speakers: {speakers_detected}',
+            'message': f'Successfully detected speakers ({"local scorer" if method == "local" else "OpenAI"}): {speakers_detected}',
             'output_files': ['analysis/detected_speakers.txt']
         }
     
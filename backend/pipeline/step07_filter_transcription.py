@@ -18,6 +18,33 @@ import os
 import re
 
 
+def parse_detected_speakers(detected_text):
+    """
+    Parse "Anchor: Speaker X" / "Pradip: Speaker Y" lines.
+    
+    Returns:
+        (anchor_speaker, pradip_speaker), either may be None
+    """
+    anchor_speaker = None
+    pradip_speaker = None
+    
+    for line in detected_text.strip().splitlines():
+        if line.startswith("Anchor:"):
+            anchor_speaker = line.split(":", 1)[1].strip()
+        elif line.startswith("Pradip:"):
+            pradip_speaker = line.split(":", 1)[1].strip()
+    
+    return anchor_speaker, pradip_speaker
+
+
+def filter_speaker_lines(transcript_lines, anchor_speaker, pradip_speaker):
+    """Keep only lines whose [Speaker] prefix is the Anchor or Pradip"""
+    return [
+        line for line in transcript_lines
+        if line.startswith(f"[{anchor_speaker}]") or line.startswith(f"[{pradip_speaker}]")
+    ]
+
+
 def run(job_folder):
     """
     Filter transcript to keep only Anchor and Pradip lines.
@@ -56,16 +83,7 @@ def run(job_folder):
         # --- Step 1: Load detected speakers ---
         print(f"📄 Reading detected speakers: {detected_speakers_file}")
         with open(detected_speakers_file, "r", encoding="utf-8") as f:
-            detected = f.read().strip().splitlines()
-        
-        anchor_speaker = None
-        pradip_speaker = None
-        
-        for line in detected:
-            if line.startswith("Anchor:"):
-                anchor_speaker = line.split(":", 1)[1].strip()
-            elif line.startswith("Pradip:"):
-                pradip_speaker = line.split(":", 1)[1].strip()
+            anchor_speaker, pradip_speaker = parse_detected_speakers(f.read())
         
         if not anchor_speaker or not pradip_speaker:
             return {
@@ -86,11 +104,7 @@ def run(job_folder):
         
         # --- Step 3: Keep only Anchor + Pradip lines ---
         print(f"\n🔍 Filtering lines for {anchor_speaker} and {pradip_speaker}...")
-        filtered_lines = []
-        
-        for line in transcript_lines:
-            if line.startswith(f"[{anchor_speaker}]") or line.startswith(f"[{pradip_speaker}]"):
-                filtered_lines.append(line)
+        filtered_lines = filter_speaker_lines(transcript_lines, anchor_speaker, pradip_speaker)
         
         print(f"✓ Kept {len(filtered_lines)} lines out of {len(transcript_lines)}")
         
@@ -9,15 +9,373 @@ Uses OpenAI GPT-4o to extract:
 - Actual NSE/BSE stock symbols
 - Start time when Pradip first commented on each stock
 
+Long transcripts are extracted map-reduce style: token-budgeted windows with
+overlap are sent concurrently and the per-window CSVs are merged, keeping
+the earliest START TIME per symbol (see extract_chunked).
+
+In fused mode (STOCK_EXTRACT_MODE=fused) a single JSON call also returns
+Pradip's analysis and chart type for every stock. It is cached in
+analysis/fused_analysis.json, and Step 12 reads it instead of sending the
+transcript to GPT-4o a second time. Transcripts above
+SINGLE_PASS_MAX_TOKENS still use map-reduce without the cache.
+
 Input: 
   - analysis/detected_speakers.txt (from Step 6)
   - transcripts/filtered_transcription.txt (from Step 7)
 Output: 
   - analysis/extracted_stocks.csv
+  - analysis/fused_analysis.json (fused mode only)
 """
 
+import io
 import os
-from openai import OpenAI
+import csv
+import json
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from backend.utils.llm_gateway import chat, discard_cached
+from backend.pipeline.step04_merge_transcripts import time_to_seconds
+
+# 'single' = one prompt, 'chunked' = always map-reduce,
+# 'auto' = map-reduce once the transcript exceeds SINGLE_PASS_MAX_TOKENS,
+# 'fused' = one call returning stocks and their analysis (Step 12 reuses it)
+EXTRACT_MODE = os.environ.get('STOCK_EXTRACT_MODE', 'auto').lower()
+SINGLE_PASS_MAX_TOKENS = int(os.environ.get('STOCK_EXTRACT_SINGLE_MAX_TOKENS', 12000))
+
+# Chunk budget bounds (transcript tokens per window) and overlap between windows
+CHUNK_MIN_TOKENS = 3000
+CHUNK_MAX_TOKENS = 10000
+CHUNK_OVERLAP_TOKENS = 600
+CHUNK_MAX_WORKERS = int(os.environ.get('STOCK_EXTRACT_WORKERS', 4))
+
+CSV_HEADER = ["STOCK NAME", "STOCK SYMBOL", "START TIME"]
+
+# Fused mode caches each stock's analysis here for Step 12
+FUSED_ANALYSIS_FILE = os.path.join("analysis", "fused_analysis.json")
+
+STOCK_PARAMS = {"temperature": 0.3}
+FUSED_PARAMS = {"temperature": 0.3, "response_format": {"type": "json_object"}}
+
+# Analysis writing rules, shared with Step 12's prompts
+ANALYSIS_RULES = """- Write the detailed, elaborative analysis given by Pradip.
+- Start each stock's section with: "For [STOCK NAME], ..."
+- Use ₹ for all amounts, and convert word numbers to digits.
+- If chart type is mentioned, include it in the analysis as "On [Chart Type] charts, ...".
+- If chart type not mentioned, default to "Daily, ...".
+- Only 3 Chart type strictly [Daily/Weekly/Monthly]
+- If analysis was revised later, keep ONLY the FINAL/latest version.
+- Ignore greetings or casual talk.
+- Do not use I or We. Speaker, Pradip name etc, and for each write to minimum 100 words but use simple english not complex english words.
+- Example Analysis must like: For Jamna Auto, the view remains positive even though the momentum has
+slowed down compared to earlier moves from the ₹70–80 range. The stock looks
+stronger when compared to Rico Auto, as it has taken solid support around the
+₹100 mark. A strict stop-loss should be maintained at ₹94–95, and as long as the
+stock sustains above this level, the overall outlook remains intact. The key
+resistance zone is around ₹110–111, and once this level is crossed, the stock has
+the potential to move further towards ₹125–130 levels. Holding is advisable with
+disciplined stop-loss management."""
+
+
+def estimate_tokens(text):
+    """
+    Rough GPT token count without a tokenizer: ~4 ASCII characters per
+    token, while Devanagari and other non-ASCII text is closer to 1.5.
+    """
+    ascii_chars = sum(1 for ch in text if ch.isascii())
+    return int(ascii_chars / 4 + (len(text) - ascii_chars) / 1.5) + 1
+
+
+def pick_chunk_tokens(total_tokens, workers=CHUNK_MAX_WORKERS):
+    """
+    Window size for a transcript of total_tokens: spread it over the
+    workers, within CHUNK_MIN_TOKENS..CHUNK_MAX_TOKENS.
+    """
+    per_worker = -(-total_tokens // max(1, workers)) + CHUNK_OVERLAP_TOKENS
+    return max(CHUNK_MIN_TOKENS, min(CHUNK_MAX_TOKENS, per_worker))
+
+
+def split_windows(lines, chunk_tokens, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """
+    Split transcript lines into windows of about chunk_tokens, each starting
+    with the last overlap_tokens worth of lines of the previous window so a
+    stock discussed across a boundary is seen whole at least once.
+    
+    Returns:
+        list of line lists
+    """
+    costs = [estimate_tokens(line) for line in lines]
+    windows = []
+    start = 0
+    while start < len(lines):
+        end, used = start, 0
+        while end < len(lines) and (end == start or used + costs[end] <= chunk_tokens):
+            used += costs[end]
+            end += 1
+        windows.append(lines[start:end])
+        if end >= len(lines):
+            break
+        
+        # Step back over the overlap, but always move forward
+        back, carried = end, 0
+        while back > start + 1 and carried + costs[back - 1] <= overlap_tokens:
+            back -= 1
+            carried += costs[back]
+        start = back
+    return windows
+
+
+def build_prompt(anchor_speaker, pradip_speaker, transcript_content, part=None):
+    """Stock extraction prompt; part=(i, n) marks a window of a longer transcript"""
+    part_note = ""
+    if part is not None:
+        part_note = (f"\nThis is part {part[0]} of {part[1]} of a longer transcript; "
+                     f"extract only the stocks discussed in this part.\n")
+    
+    return f"""You are analyzing a transcript between a TV Anchor ({anchor_speaker})
+and stock expert Mr. Pradip Halder ({pradip_speaker}).
+
+Task:
+- Identify all STOCK NAMES or COMPANY NAMES discussed by ({pradip_speaker}) Pradip and put it in STOCK NAME column.
+- For all STOCK NAMES find out NSE/BSE STOCK SYMBOL and put it in STOCK SYMBOL column. For some companies, stock name and symbol name are different, so give me the actual Symbol (Very Very Important).
+- Capture the START TIME from the transcript line where ({pradip_speaker}) Pradip first comments on each stock & put in START TIME column.
+
+Return strictly as CSV with header:
+STOCK NAME,STOCK SYMBOL,START TIME
+
+No duplicates. Only those STOCKS on which ({pradip_speaker}) has given his analysis.
+{part_note}
+Transcript:
+{transcript_content}
+"""
+
+
+def stock_messages(prompt):
+    """Chat messages for one stock extraction prompt"""
+    return [
+        {
+            "role": "system", 
+            "content": "You are a financial transcript analyzer. Extract stock names with actual NSE/BSE symbols and timestamps in CSV format."
+        },
+        {
+            "role": "user", 
+            "content": prompt
+        }
+    ]
+
+
+def extract_csv(prompt):
+    """Call GPT-4o for one prompt and return its CSV without markdown fences"""
+    csv_content = chat(
+        stock_messages(prompt),
+        model="gpt-4o",
+        step=8,
+        **STOCK_PARAMS
+    )
+    
+    # Remove markdown code blocks if present
+    if csv_content.startswith("```"):
+        lines = csv_content.split('\n')
+        csv_content = '\n'.join([line for line in lines if not line.startswith('```')])
+        csv_content = csv_content.strip()
+    
+    return csv_content
+
+
+def parse_stock_rows(csv_content):
+    """Parse a STOCK NAME,STOCK SYMBOL,START TIME CSV into row lists (no header)"""
+    rows = []
+    for row in csv.reader(io.StringIO(csv_content)):
+        row = [cell.strip() for cell in row]
+        if len(row) < 3 or not any(row):
+            continue
+        if row[0].upper() == "STOCK NAME":
+            continue
+        rows.append(row[:3])
+    return rows
+
+
+def _start_seconds(start_time):
+    try:
+        return time_to_seconds(start_time)
+    except (ValueError, AttributeError):
+        return float("inf")
+
+
+def merge_stock_rows(row_lists):
+    """
+    Merge per-window results: one row per symbol (or name when the symbol
+    is missing), keeping the earliest START TIME, ordered by START TIME.
+    """
+    merged = {}
+    for rows in row_lists:
+        for name, symbol, start_time in rows:
+            key = (symbol or name).upper().replace(" ", "")
+            if not key:
+                continue
+            current = merged.get(key)
+            if current is None or _start_seconds(start_time) < _start_seconds(current[2]):
+                merged[key] = [name, symbol, start_time]
+    return sorted(merged.values(), key=lambda row: _start_seconds(row[2]))
+
+
+def rows_to_csv(rows):
+    """Render stock rows as CSV text with CSV_HEADER"""
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    writer.writerow(CSV_HEADER)
+    writer.writerows(rows)
+    return out.getvalue().strip()
+
+
+def chunk_prompts(anchor_speaker, pradip_speaker, transcript_lines, chunk_tokens):
+    """One extraction prompt per overlapping window of the transcript"""
+    windows = split_windows(transcript_lines, chunk_tokens)
+    return [
+        build_prompt(anchor_speaker, pradip_speaker, "\n".join(window), part=(i + 1, len(windows)))
+        for i, window in enumerate(windows)
+    ]
+
+
+def extract_chunked(anchor_speaker, pradip_speaker, transcript_lines, chunk_tokens):
+    """
+    Map-reduce extraction: windows run concurrently, results are merged.
+    
+    Returns:
+        str: merged CSV with header
+    """
+    prompts = chunk_prompts(anchor_speaker, pradip_speaker, transcript_lines, chunk_tokens)
+    print(f"🧩 Chunked extraction: {len(prompts)} windows of ~{chunk_tokens} tokens "
+          f"({CHUNK_OVERLAP_TOKENS} overlap)")
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(CHUNK_MAX_WORKERS, len(prompts)))) as executor:
+        # Each task runs in a copy of this context so calls keep the job id
+        futures = [executor.submit(contextvars.copy_context().run, extract_csv, prompt)
+                   for prompt in prompts]
+        results = [future.result() for future in futures]
+    
+    row_lists = [parse_stock_rows(result) for result in results]
+    for i, rows in enumerate(row_lists, 1):
+        print(f"   Window {i}/{len(prompts)}: {len(rows)} stocks")
+    return rows_to_csv(merge_stock_rows(row_lists))
+
+
+def build_fused_prompt(anchor_speaker, pradip_speaker, transcript_content):
+    """Stock extraction and analysis in one structured-output prompt"""
+    return f"""You are analyzing a transcript between a TV Anchor ({anchor_speaker})
+and stock expert Mr. Pradip Halder ({pradip_speaker}).
+
+Task:
+- Identify all STOCK NAMES or COMPANY NAMES discussed by ({pradip_speaker}) Pradip.
+- For all STOCK NAMES find out NSE/BSE STOCK SYMBOL. For some companies, stock name and symbol name are different, so give me the actual Symbol (Very Very Important).
+- Capture the START TIME from the transcript line where ({pradip_speaker}) Pradip first comments on each stock.
+- For each stock, extract ONLY {pradip_speaker}'s detailed analysis. Do NOT include any other speaker's words.
+
+No duplicates. Only those STOCKS on which ({pradip_speaker}) has given his analysis.
+
+Analysis instructions:
+{ANALYSIS_RULES}
+
+Output ONLY valid JSON:
+{{"stocks": [{{"stock_name": "...", "stock_symbol": "...", "start_time": "HH:MM:SS", "chart_type": "...", "analysis": "..."}}]}}
+
+Transcript:
+{transcript_content}
+"""
+
+
+def fused_messages(anchor_speaker, pradip_speaker, transcript_content):
+    """Chat messages for the fused extraction call"""
+    return [
+        {
+            "role": "system",
+            "content": "You are a financial transcript analyzer. Extract stocks with actual NSE/BSE symbols, timestamps and the expert's analysis as JSON."
+        },
+        {
+            "role": "user",
+            "content": build_fused_prompt(anchor_speaker, pradip_speaker, transcript_content)
+        }
+    ]
+
+
+def extract_fused(anchor_speaker, pradip_speaker, transcript_content):
+    """
+    One GPT-4o call for stocks, symbols, start times and analysis.
+    
+    An answer that is not valid JSON is dropped from the LLM cache and the
+    call retried once uncached; a second bad answer raises.
+    
+    Returns:
+        (list of [name, symbol, start time] rows, dict of stock name -> analysis entry)
+    """
+    messages = fused_messages(anchor_speaker, pradip_speaker, transcript_content)
+    for attempt in (1, 2):
+        content = chat(
+            messages,
+            model="gpt-4o",
+            step=8,
+            cache=attempt == 1,
+            **FUSED_PARAMS
+        )
+        try:
+            return parse_fused(content)
+        except (json.JSONDecodeError, AttributeError) as e:
+            if attempt == 2:
+                raise
+            discard_cached(messages, model="gpt-4o", **FUSED_PARAMS)
+            print(f"⚠️ Fused response was not valid JSON ({str(e)}), retrying uncached")
+
+
+def parse_fused(content):
+    """Rows and analysis entries from a fused JSON answer"""
+    rows, analysis = [], {}
+    for item in json.loads(content).get("stocks", []):
+        name = str(item.get("stock_name") or "").strip()
+        symbol = str(item.get("stock_symbol") or "").strip()
+        if not (name or symbol):
+            continue
+        rows.append([name, symbol, str(item.get("start_time") or "").strip()])
+        analysis[name or symbol] = {
+            "stock_symbol": symbol,
+            "chart_type": item.get("chart_type") or "Daily",
+            "analysis": item.get("analysis") or ""
+        }
+    return merge_stock_rows([rows]), analysis
+
+
+def pick_mode(total_tokens):
+    """(chunked, fused) for a transcript of total_tokens under EXTRACT_MODE"""
+    chunked = EXTRACT_MODE == 'chunked' or (
+        EXTRACT_MODE in ('auto', 'fused') and total_tokens > SINGLE_PASS_MAX_TOKENS)
+    fused = EXTRACT_MODE == 'fused' and not chunked
+    return chunked, fused
+
+
+def planned_requests(job_folder):
+    """
+    The LLM requests run() will make for this job, for batch mode (see
+    batch_mode). Each is a dict with model, messages and params.
+    """
+    with open(os.path.join(job_folder, "analysis", "detected_speakers.txt"), 'r', encoding='utf-8') as f:
+        detected_lines = f.read().strip().splitlines()
+    anchor_speaker = detected_lines[0].split(":")[1].strip()
+    pradip_speaker = detected_lines[1].split(":")[1].strip()
+    
+    with open(os.path.join(job_folder, "transcripts", "filtered_transcription.txt"), 'r', encoding='utf-8') as f:
+        transcript_content = f.read()
+    
+    total_tokens = estimate_tokens(transcript_content)
+    chunked, fused = pick_mode(total_tokens)
+    if fused:
+        return [{'model': "gpt-4o", 'params': FUSED_PARAMS,
+                 'messages': fused_messages(anchor_speaker, pradip_speaker, transcript_content)}]
+    
+    if chunked:
+        prompts = chunk_prompts(anchor_speaker, pradip_speaker, transcript_content.strip().splitlines(),
+                                pick_chunk_tokens(total_tokens))
+    else:
+        prompts = [build_prompt(anchor_speaker, pradip_speaker, transcript_content)]
+    return [{'model': "gpt-4o", 'params': STOCK_PARAMS, 'messages': stock_messages(prompt)}
+            for prompt in prompts]
 
 
 def run(job_folder):
@@ -74,90 +432,39 @@ def run(job_folder):
         transcript_lines = transcript_content.strip().splitlines()
         print(f"✅ Loaded {len(transcript_lines)} lines of filtered transcript\n")
         
-        # Step 3: Get OpenAI API key from database
-        print("🔑 Retrieving OpenAI API key from database...")
+        # Step 3: Pick single-pass or map-reduce extraction from the token estimate
+        total_tokens = estimate_tokens(transcript_content)
+        chunked, fused = pick_mode(total_tokens)
+        print(f"📏 Estimated transcript size: ~{total_tokens} tokens")
         
-        # Use direct psycopg2 connection like in step06
-        import psycopg2
+        # A cache from an earlier fused run must not outlive this extraction
+        fused_json = os.path.join(job_folder, FUSED_ANALYSIS_FILE)
+        if os.path.exists(fused_json):
+            os.remove(fused_json)
         
-        try:
-            conn = psycopg2.connect(os.environ['DATABASE_URL'])
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT key_value FROM api_keys 
-                WHERE LOWER(provider) = 'openai' 
-                LIMIT 1
-            """)
-            
-            result = cursor.fetchone()
-            cursor.close()
-            conn.close()
-            
-            if not result:
-                return {
-                    'status': 'failed',
-                    'message': 'OpenAI API key not found in database. Please add it in API Keys settings.'
-                }
-            
-            openai_api_key = result[0]
-            print("✅ OpenAI API key retrieved\n")
-        
-        except Exception as e:
-            return {
-                'status': 'failed',
-                'message': f'Failed to fetch OpenAI API key: {str(e)}'
-            }
+        # Step 4: Call OpenAI GPT-4o (shared gateway client)
+        if fused:
+            print("🚀 Calling OpenAI GPT-4o for fused stock + analysis extraction...\n")
+            try:
+                rows, analysis = extract_fused(anchor_speaker, pradip_speaker, transcript_content)
+            except (json.JSONDecodeError, AttributeError) as e:
+                print(f"⚠️ Fused response was not valid JSON ({str(e)}), using plain extraction\n")
+                fused = False
         
-        # Step 4: Create OpenAI client
-        client = OpenAI(api_key=openai_api_key)
-        
-        # Step 5: Build GPT prompt
-        print("🤖 Preparing GPT prompt for stock extraction...")
-        
-        prompt = f"""You are analyzing a transcript between a TV Anchor ({anchor_speaker})
-and stock expert Mr. Pradip Halder ({pradip_speaker}).
-
-Task:
-- Identify all STOCK NAMES or COMPANY NAMES discussed by ({pradip_speaker}) Pradip and put it in STOCK NAME column.
-- For all STOCK NAMES find out NSE/BSE STOCK SYMBOL and put it in STOCK SYMBOL column. For some companies, stock name and symbol name are different, so give me the actual Symbol (Very Very Important).
-- Capture the START TIME from the transcript line where ({pradip_speaker}) Pradip first comments on each stock & put in START TIME column.
-
-Return strictly as CSV with header:
-STOCK NAME,STOCK SYMBOL,START TIME
-
-No duplicates. Only those STOCKS on which ({pradip_speaker}) has given his analysis.
-
-Transcript:
-{transcript_content}
-"""
-        
-        # Step 6: Call OpenAI GPT-4o
-        print("🚀 Calling OpenAI GPT-4o for stock extraction...\n")
-        
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system", 
-                    "content": "You are a financial transcript analyzer. Extract stock names with actual NSE/BSE symbols and timestamps in CSV format."
-                },
-                {
-                    "role": "user", 
-                    "content": prompt
-                }
-            ],
-            temperature=0.3
-        )
-        
-        # Step 7: Extract CSV content
-        csv_content = response.choices[0].message.content.strip()
-        
-        # Remove markdown code blocks if present
-        if csv_content.startswith("```"):
-            lines = csv_content.split('\n')
-            csv_content = '\n'.join([line for line in lines if not line.startswith('```')])
-            csv_content = csv_content.strip()
+        if fused:
+            csv_content = rows_to_csv(rows)
+            os.makedirs(os.path.dirname(fused_json), exist_ok=True)
+            with open(fused_json, 'w', encoding='utf-8') as f:
+                json.dump(analysis, f, ensure_ascii=False, indent=2)
+            print(f"💾 Cached analysis for {len(analysis)} stocks: {FUSED_ANALYSIS_FILE}")
+        elif chunked:
+            chunk_tokens = pick_chunk_tokens(total_tokens)
+            csv_content = extract_chunked(anchor_speaker, pradip_speaker, transcript_lines, chunk_tokens)
+        else:
+            print("🤖 Preparing GPT prompt for stock extraction...")
+            prompt = build_prompt(anchor_speaker, pradip_speaker, transcript_content)
+            print("🚀 Calling OpenAI GPT-4o for stock extraction...\n")
+            csv_content = extract_csv(prompt)
         
         print("✅ GPT-4o Response (Stock Extraction):")
         print("-" * 60)
@@ -165,7 +472,7 @@ Transcript:
         print("-" * 60)
         print()
         
-        # Step 8: Save to CSV file
+        # Step 5: Save to CSV file
         print(f"💾 Saving extracted stocks to: {output_csv}")
         
         # Ensure analysis directory exists
@@ -180,10 +487,18 @@ Transcript:
         print(f"✅ Extracted {stock_count} stocks")
         print(f"✅ Saved to: analysis/extracted_stocks.csv\n")
         
+        message = f'Extracted {stock_count} stocks from Pradip\'s analysis'
+        output_files = ['analysis/extracted_stocks.csv']
+        if chunked:
+            message += ' (chunked)'
+        elif fused:
+            message += ' (fused with analysis)'
+            output_files.append('analysis/fused_analysis.json')
+        
         return {
             'status': 'success',
-            'message': f'Extracted {stock_count} stocks from Pradip\'s analysis',
-            'output_files': ['analysis/extracted_stocks.csv']
+            'message': message,
+            'output_files': output_files
         }
     
     except Exception as e:
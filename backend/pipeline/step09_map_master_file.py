@@ -13,39 +13,152 @@ Uses exact and fuzzy matching with multiple fallback strategies.
 
 Input: 
   - analysis/extracted_stocks.csv (from Step 8)
-  - Master CSV file from uploaded_files
+  - Master CSV file from uploaded_files (read through its prebuilt index)
 Output: 
   - analysis/mapped_master_file.csv
 """
 
 import os
-import re
+import time
+import numpy as np
 import pandas as pd
 import psycopg2
 from rapidfuzz import fuzz, process
+from backend.utils import master_index
+from backend.utils.master_index import normalize_text
 
 
-def normalize_text(s):
-    """Clean text for matching (remove special chars, multiple spaces)."""
-    if not isinstance(s, str):
-        s = str(s)
-    s = re.sub(r"[^A-Z0-9]", "", s.upper())  # Keep only alphanumerics
-    return s.strip()
+FUZZY_THRESHOLD = 80
 
+# Queries scored per cdist call (bounds the score matrix to chunk x master rows)
+FUZZY_CHUNK = 256
 
-def fuzzy_match(value, target_series, threshold=80):
-    """Return best fuzzy match index or None."""
-    if not value or not isinstance(value, str):
-        return None
-    value_norm = normalize_text(value)
-    choices = target_series.tolist()
-    result = process.extractOne(value_norm, choices, scorer=fuzz.token_sort_ratio)
-    if result and result[1] >= threshold:
-        matched_value = result[0]
-        idx_list = target_series[target_series == matched_value].index
-        if len(idx_list) > 0:
-            return idx_list[0]
-    return None
+# Exact tiers on the stock symbol, tried in order: (master column, match source)
+EXACT_TIERS = [
+    ("SEM_TRADING_SYMBOL", "SEM_TRADING_SYMBOL (exact)"),
+    ("SEM_CUSTOM_SYMBOL", "SEM_CUSTOM_SYMBOL (exact)"),
+    ("SM_SYMBOL_NAME", "SM_SYMBOL_NAME (exact)"),
+]
+
+# Fuzzy tiers, tried in order: (query field, normalized master column, match source)
+FUZZY_TIERS = [
+    ("symbol", "SEM_CUSTOM_SYMBOL_NORM", "SEM_CUSTOM_SYMBOL (fuzzy symbol)"),
+    ("symbol", "SM_SYMBOL_NAME_NORM", "SM_SYMBOL_NAME (fuzzy symbol)"),
+    ("name", "SEM_CUSTOM_SYMBOL_NORM", "SEM_CUSTOM_SYMBOL (fuzzy name)"),
+    ("name", "SM_SYMBOL_NAME_NORM", "SM_SYMBOL_NAME (fuzzy name)"),
+]
+
+
+def build_lookup(values):
+    """Map each value to its row positions (in master order)."""
+    lookup = {}
+    for pos, value in enumerate(values):
+        lookup.setdefault(value, []).append(pos)
+    return lookup
+
+
+def fuzzy_match_many(values, choices, threshold=FUZZY_THRESHOLD):
+    """
+    Return the best fuzzy match position in choices for each value, or None.
+
+    Scores every value against every choice with one rapidfuzz cdist call
+    (per FUZZY_CHUNK values, on all cores); ties go to the first choice,
+    like process.extractOne.
+    """
+    matches = [None] * len(values)
+    queries = [(i, normalize_text(value)) for i, value in enumerate(values)
+               if value and isinstance(value, str)]
+    if not queries or not choices:
+        return matches
+
+    for start in range(0, len(queries), FUZZY_CHUNK):
+        chunk = queries[start:start + FUZZY_CHUNK]
+        scores = process.cdist([query for _, query in chunk], choices,
+                               scorer=fuzz.token_sort_ratio, dtype=np.float64, workers=-1)
+        best = scores.argmax(axis=1)
+        for (i, _), pos, row in zip(chunk, best, scores):
+            if row[pos] >= threshold:
+                matches[i] = int(pos)
+    return matches
+
+
+def fuzzy_match_pruned(values, choices, arrays, column, threshold=FUZZY_THRESHOLD):
+    """
+    fuzzy_match_many, scoring each value only against the master rows that
+    share the most trigrams with it (master_index.trigram_candidates).
+
+    Values that are too short for a trigram or share none with the column
+    are scored against the full column instead. A match sharing few
+    trigrams with the value (e.g. a short symbol with scattered typos) can
+    be missed; the benchmark reports how often results differ from a full
+    scan.
+    """
+    matches = [None] * len(values)
+    fallback = []
+    for i, value in enumerate(values):
+        if not value or not isinstance(value, str):
+            continue
+        query = normalize_text(value)
+        positions = master_index.trigram_candidates(arrays, column, query)
+        if positions is not None:
+            result = process.extractOne(query, [choices[pos] for pos in positions],
+                                        scorer=fuzz.token_sort_ratio, score_cutoff=threshold)
+            if result:
+                matches[i] = int(positions[result[2]])
+        else:
+            fallback.append(i)
+
+    for i, pos in zip(fallback, fuzzy_match_many([values[i] for i in fallback], choices, threshold)):
+        matches[i] = pos
+    return matches
+
+
+def match_stocks(df_api, symbols, names, trigram_index=None):
+    """
+    Run the matching tiers for all stocks at once.
+
+    Each stock keeps the first tier that matches it: exact symbol matches
+    (dictionary lookups), then fuzzy symbol/name matches (batched over the
+    stocks still unmatched, pruned by trigram_index when given), then the
+    normalized-name fallback.
+
+    Returns:
+        list of (candidate row positions, match_source) per stock; ([], "") if unmatched
+    """
+    found = [([], "")] * len(symbols)
+
+    def pending():
+        return [i for i, (positions, _) in enumerate(found) if not positions]
+
+    for column, source in EXACT_TIERS:
+        lookup = build_lookup(df_api[column].tolist())
+        for i in pending():
+            positions = lookup.get(symbols[i])
+            if positions:
+                found[i] = (positions, source)
+
+    for field, column, source in FUZZY_TIERS:
+        todo = pending()
+        if not todo:
+            break
+        queries = symbols if field == "symbol" else names
+        values = [queries[i] for i in todo]
+        if trigram_index is not None:
+            matches = fuzzy_match_pruned(values, df_api[column].tolist(), trigram_index, column)
+        else:
+            matches = fuzzy_match_many(values, df_api[column].tolist())
+        for i, pos in zip(todo, matches):
+            if pos is not None:
+                found[i] = ([pos], source)
+
+    # FINAL FALLBACK: Normalize STOCK NAME & match SEM_TRADING_SYMBOL
+    lookup = build_lookup(df_api["SEM_TRADING_SYMBOL_NORM"].tolist())
+    for i in pending():
+        positions = lookup.get(normalize_text(names[i]))
+        if positions:
+            found[i] = (positions, "SEM_TRADING_SYMBOL (normalized name fallback)")
+
+    return found
 
 
 def get_master_file_path():
@@ -112,34 +225,10 @@ def run(job_folder):
         
         print(f"✅ Master file found: {master_file_path}\n")
         
-        # Load master file
-        print("📖 Loading master file...")
-        df_api = pd.read_csv(master_file_path, low_memory=False)
-        print(f"✅ Loaded {len(df_api)} records from master file\n")
-        
-        # Filter for EQUITY only
-        print("🔍 Filtering for EQUITY instruments...")
-        df_api = df_api[df_api["SEM_INSTRUMENT_NAME"].astype(str).str.upper() == "EQUITY"].copy()
-        print(f"✅ {len(df_api)} EQUITY records found\n")
-        
-        # Normalize text fields in master file
-        print("🔧 Normalizing master file fields...")
-        for col in ["SEM_TRADING_SYMBOL", "SEM_CUSTOM_SYMBOL", "SM_SYMBOL_NAME", "SEM_EXM_EXCH_ID"]:
-            if col in df_api.columns:
-                df_api[col] = df_api[col].astype(str).str.strip().str.upper()
-            else:
-                df_api[col] = ""
-        
-        # Add normalized matching columns
-        df_api["SEM_CUSTOM_SYMBOL_NORM"] = df_api["SEM_CUSTOM_SYMBOL"].apply(normalize_text)
-        df_api["SM_SYMBOL_NAME_NORM"] = df_api["SM_SYMBOL_NAME"].apply(normalize_text)
-        df_api["SEM_TRADING_SYMBOL_NORM"] = df_api["SEM_TRADING_SYMBOL"].apply(normalize_text)
-        
-        # Add Exchange priority: NSE > BSE > Others
-        df_api["exchange_priority"] = df_api["SEM_EXM_EXCH_ID"].apply(
-            lambda x: 1 if x == "NSE" else (2 if x == "BSE" else 3)
-        )
-        print("✅ Master file normalized\n")
+        # Load the prebuilt EQUITY index (memory-mapped, built at upload time)
+        print("📖 Loading master index...")
+        df_api = master_index.load_master_frame(master_file_path)
+        print(f"✅ {len(df_api)} EQUITY records loaded\n")
         
         # Load input file (extracted stocks)
         print("📖 Loading extracted stocks...")
@@ -179,72 +268,19 @@ def run(job_folder):
         
         results = []
         matched_count = 0
+        found = match_stocks(df_api, df_input[symbol_col].tolist(), df_input[name_col].tolist(),
+                             trigram_index=master_index.load_index(master_file_path))
         
-        for idx, row in df_input.iterrows():
+        for (idx, row), (positions, match_source) in zip(df_input.iterrows(), found):
             stock_symbol = row[symbol_col]
             stock_name = row[name_col]
             start_time = row.get("START TIME", "")
 
             match = None
-            match_source = ""
-            candidates = pd.DataFrame()
-
-            # 1. Exact match on SEM_TRADING_SYMBOL
-            candidates = df_api[df_api["SEM_TRADING_SYMBOL"] == stock_symbol]
-            if not candidates.empty:
-                match_source = "SEM_TRADING_SYMBOL (exact)"
-
-            # 2. Exact match on SEM_CUSTOM_SYMBOL
-            if candidates.empty:
-                candidates = df_api[df_api["SEM_CUSTOM_SYMBOL"] == stock_symbol]
-                if not candidates.empty:
-                    match_source = "SEM_CUSTOM_SYMBOL (exact)"
-
-            # 3. Exact match on SM_SYMBOL_NAME
-            if candidates.empty:
-                candidates = df_api[df_api["SM_SYMBOL_NAME"] == stock_symbol]
-                if not candidates.empty:
-                    match_source = "SM_SYMBOL_NAME (exact)"
-
-            # 4. Fuzzy match on SEM_CUSTOM_SYMBOL using symbol
-            if candidates.empty:
-                idx_match = fuzzy_match(stock_symbol, df_api["SEM_CUSTOM_SYMBOL_NORM"])
-                if idx_match is not None:
-                    candidates = df_api.loc[[idx_match]]
-                    match_source = "SEM_CUSTOM_SYMBOL (fuzzy symbol)"
-
-            # 5. Fuzzy match on SM_SYMBOL_NAME using symbol
-            if candidates.empty:
-                idx_match = fuzzy_match(stock_symbol, df_api["SM_SYMBOL_NAME_NORM"])
-                if idx_match is not None:
-                    candidates = df_api.loc[[idx_match]]
-                    match_source = "SM_SYMBOL_NAME (fuzzy symbol)"
-
-            # 6. Fuzzy match on SEM_CUSTOM_SYMBOL using name
-            if candidates.empty:
-                idx_match = fuzzy_match(stock_name, df_api["SEM_CUSTOM_SYMBOL_NORM"])
-                if idx_match is not None:
-                    candidates = df_api.loc[[idx_match]]
-                    match_source = "SEM_CUSTOM_SYMBOL (fuzzy name)"
-
-            # 7. Fuzzy match on SM_SYMBOL_NAME using name
-            if candidates.empty:
-                idx_match = fuzzy_match(stock_name, df_api["SM_SYMBOL_NAME_NORM"])
-                if idx_match is not None:
-                    candidates = df_api.loc[[idx_match]]
-                    match_source = "SM_SYMBOL_NAME (fuzzy name)"
-
-            # 8. FINAL FALLBACK: Normalize STOCK NAME & match SEM_TRADING_SYMBOL
-            if candidates.empty:
-                stock_name_norm = normalize_text(stock_name)
-                idx_list = df_api[df_api["SEM_TRADING_SYMBOL_NORM"] == stock_name_norm].index
-                if len(idx_list) > 0:
-                    candidates = df_api.loc[idx_list]
-                    match_source = "SEM_TRADING_SYMBOL (normalized name fallback)"
 
             # Pick best match (NSE preferred)
-            if not candidates.empty:
-                candidates = candidates.sort_values(by="exchange_priority")
+            if positions:
+                candidates = df_api.iloc[positions].sort_values(by="exchange_priority")
                 match = candidates.iloc[0]
 
             # Prepare output
@@ -323,9 +359,62 @@ def run(job_folder):
         }
 
 
+def benchmark(master_file_path, n=100, seed=0):
+    """
+    Time index load + matching (full scan and trigram-pruned) for n stocks
+    drawn from the master.
+
+    Queries mix exact symbols, truncated/misspelt symbols and listed names
+    (fuzzy tiers) and invented names (no match), so every tier is exercised.
+    """
+    import random
+    rng = random.Random(seed)
+
+    start = time.perf_counter()
+    df_api = master_index.load_master_frame(master_file_path)
+    load_ms = (time.perf_counter() - start) * 1000
+
+    symbols, names = [], []
+    for pos in rng.sample(range(len(df_api)), min(n, len(df_api))):
+        row = df_api.iloc[pos]
+        kind = rng.random()
+        if kind < 0.4:
+            symbols.append(row["SEM_TRADING_SYMBOL"])
+        elif kind < 0.8:
+            symbols.append(row["SEM_TRADING_SYMBOL"][:-1] + "X")
+        else:
+            symbols.append(f"ZZQ{pos}")
+        names.append(row["SM_SYMBOL_NAME"] if kind < 0.8 else f"UNLISTED COMPANY {pos}")
+
+    start = time.perf_counter()
+    full = match_stocks(df_api, symbols, names)
+    match_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    found = match_stocks(df_api, symbols, names, trigram_index=master_index.load_index(master_file_path))
+    pruned_ms = (time.perf_counter() - start) * 1000
+
+    by_source = {}
+    for _, source in found:
+        by_source[source or "no match"] = by_source.get(source or "no match", 0) + 1
+
+    print(f"Master rows (EQUITY): {len(df_api)}")
+    print(f"Index load: {load_ms:.1f} ms")
+    print(f"Matching {len(symbols)} stocks: {match_ms:.1f} ms full scan, {pruned_ms:.1f} ms trigram-pruned")
+    changed = sum(1 for a, b in zip(full, found) if a != b)
+    print(f"Pruned results differing from full scan: {changed}")
+    for source, count in sorted(by_source.items()):
+        print(f"   {source:48} {count}")
+
+
 if __name__ == "__main__":
     # Test the step
     import sys
+    if len(sys.argv) > 2 and sys.argv[1] == "bench":
+        # python -m backend.pipeline.step09_map_master_file bench <master_csv> [n]
+        benchmark(sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 100)
+        sys.exit(0)
+
     if len(sys.argv) > 1:
         test_folder = sys.argv[1]
     else:
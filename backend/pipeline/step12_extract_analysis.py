@@ -4,62 +4,420 @@ Step 12: Extract Analysis
 Uses OpenAI GPT-4o to extract detailed stock analysis given by Pradip
 from the filtered transcription.
 
-Input: 
+Short transcripts are analyzed in one call. Long ones (or when the single
+call's JSON cannot be parsed) use windowed mode: each stock gets its own
+small call on the part of the transcript around its START TIME, run
+concurrently; a stock whose call fails is retried on its own.
+
+Results are written as they arrive: the single call is streamed and parsed
+incrementally, and each stock is appended to stocks_with_analysis.csv (and
+reported as step progress) as soon as its JSON object closes or its
+windowed call returns. Step 13's candles are prefetched for completed
+stocks in the background. The CSV is rewritten in stock order at the end.
+
+Input:
   - analysis/detected_speakers.txt (from Step 6)
   - transcripts/filtered_transcription.txt (from Step 7)
   - analysis/stocks_with_cmp.csv (from Step 11)
-  - OpenAI API key from database
-Output: 
+  - analysis/mapped_master_file.csv (from Step 9, video-relative START TIME
+    for windowed mode; Step 10 turns START TIME into clock time)
+  - analysis/fused_analysis.json (optional, from Step 8's fused mode; cached
+    stocks skip the GPT-4o call)
+  - OpenAI API key from database (via the shared LLM gateway)
+Output:
   - analysis/stocks_with_analysis.csv
 """
 
 import os
+import re
 import json
+import contextvars
 import pandas as pd
-import psycopg2
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from backend.utils.llm_gateway import chat, chat_stream, discard_cached
+from backend.pipeline import step13_generate_charts
+from backend.pipeline.step04_merge_transcripts import time_to_seconds
+from backend.pipeline.step08_extract_stocks import estimate_tokens, ANALYSIS_RULES, FUSED_ANALYSIS_FILE
 
+# 'single' = one call for all stocks, 'windowed' = one call per stock,
+# 'auto' = windowed once the transcript exceeds SINGLE_PASS_MAX_TOKENS
+ANALYSIS_MODE = os.environ.get('STOCK_ANALYSIS_MODE', 'auto').lower()
+SINGLE_PASS_MAX_TOKENS = int(os.environ.get('STOCK_ANALYSIS_SINGLE_MAX_TOKENS', 12000))
 
-def get_openai_api_key():
-    """Fetch OpenAI API key from database"""
-    try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        cursor = conn.cursor()
+# Window around a stock: from a little before its START TIME until the next
+# stock starts (plus grace), within MIN..MAX seconds
+WINDOW_BEFORE_SEC = 30
+WINDOW_GRACE_SEC = 60
+WINDOW_MIN_SEC = 180
+WINDOW_MAX_SEC = 900
+
+STOCK_MAX_WORKERS = int(os.environ.get('STOCK_ANALYSIS_WORKERS', 6))
+STOCK_MAX_ATTEMPTS = 3
+
+SINGLE_PARAMS = {"temperature": 0.3}
+STOCK_PARAMS = {"temperature": 0.3, "response_format": {"type": "json_object"}}
+
+# Fetch Step 13's candles for each stock as soon as its analysis is done
+CHART_PREFETCH = os.environ.get('CHART_PREFETCH', 'true').lower() in ('1', 'true', 'yes')
+CHART_PREFETCH_WORKERS = 2
+
+LINE_TIME = re.compile(r"^\[[^\]]+\]\s*([\d:]+)\s*-")
+
+
+class StockStreamParser:
+    """
+    Incremental parser for a streamed {"STOCK": {...}, ...} JSON answer.
+    
+    feed() takes the next text delta and returns the (stock name, entry)
+    pairs whose object closed in it. Text before the first "{" (e.g. a
+    markdown fence) is skipped.
+    """
+    
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.key_start = None
+    
+    def feed(self, text):
+        self.buffer += text
+        done = []
+        while self.pos < len(self.buffer):
+            ch = self.buffer[self.pos]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif self.depth == 0:
+                if ch == "{":
+                    self.depth = 1
+            elif ch == '"':
+                self.in_string = True
+                if self.depth == 1 and self.key_start is None:
+                    self.key_start = self.pos
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 1 and ch == "}" and self.key_start is not None:
+                    try:
+                        item = json.loads("{" + self.buffer[self.key_start:self.pos + 1] + "}")
+                        done.extend((name, entry) for name, entry in item.items() if isinstance(entry, dict))
+                    except json.JSONDecodeError:
+                        pass
+                    self.key_start = None
+            elif ch == "," and self.depth == 1:
+                self.key_start = None
+            self.pos += 1
+        return done
+
+
+class AnalysisWriter:
+    """
+    Appends each completed stock's rows to the output CSV, reports progress
+    and starts Step 13's candle prefetch for it.
+    """
+    
+    def __init__(self, job_folder, output_csv, stocks_df, progress=None):
+        self.job_folder = job_folder
+        self.output_csv = output_csv
+        self.stocks_df = stocks_df
+        self.progress = progress
+        self.total = stocks_df["STOCK NAME"].nunique()
+        self.written = set()
+        self.prefetch = None
+        
+        os.makedirs(os.path.dirname(output_csv), exist_ok=True)
+        if os.path.exists(output_csv):
+            os.remove(output_csv)
         
-        cursor.execute("""
-            SELECT key_value 
-            FROM api_keys 
-            WHERE LOWER(provider) = 'openai'
-            LIMIT 1
-        """)
+        if CHART_PREFETCH:
+            try:
+                self.headers = step13_generate_charts.dhan_headers()
+                self.prefetch = ThreadPoolExecutor(max_workers=CHART_PREFETCH_WORKERS)
+            except Exception as e:
+                print(f"⚠️ Chart prefetch disabled: {str(e)}")
+    
+    def add(self, name, entry):
+        if name in self.written:
+            return
+        rows = self.stocks_df[self.stocks_df["STOCK NAME"] == name].copy()
+        if rows.empty:
+            return
+        self.written.add(name)
         
-        result = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        rows["CHART TYPE"] = entry.get("chart_type", "Daily")
+        rows["ANALYSIS"] = entry.get("analysis", "").replace("\n", " ").replace("|", " ")
+        first = not os.path.exists(self.output_csv)
+        rows.to_csv(self.output_csv, mode="a", header=first, index=False, encoding="utf-8-sig")
         
-        if result:
-            return result[0]
-        else:
-            raise ValueError("OpenAI API key not found in database. Please add it in API Keys settings.")
+        if self.progress:
+            self.progress(f"Analyzed {len(self.written)}/{self.total} stocks (latest: {name})")
+        if self.prefetch:
+            for row in rows.to_dict("records"):
+                self.prefetch.submit(step13_generate_charts.prefetch_candles,
+                                     self.job_folder, row, self.headers)
     
-    except Exception as e:
-        raise Exception(f"Failed to fetch OpenAI API key: {str(e)}")
+    def close(self):
+        """Wait for outstanding candle prefetches"""
+        if self.prefetch:
+            self.prefetch.shutdown(wait=True)
+
+
+def build_prompt(pradip_speaker, convo_text, stock_names):
+    """Single-call prompt covering every stock"""
+    return f"""
+You are a financial market analyst. Extract ONLY {pradip_speaker}'s detailed stock analysis
+from the transcript below. Do NOT include any other speaker's words.
+
+Transcript (Pradip only):
+{convo_text}
+
+Instructions:
+- For each of these stocks: {', '.join(stock_names)}
+{ANALYSIS_RULES}
+- Output ONLY valid JSON mapping each stock to:
+{{
+  "STOCK NAME": {{"chart_type": "...", "analysis": "..."}}
+}}
+"""
+
 
+def build_stock_prompt(pradip_speaker, window_text, stock_name):
+    """Per-stock prompt on the transcript window around the stock"""
+    return f"""
+You are a financial market analyst. Extract ONLY {pradip_speaker}'s detailed analysis of
+{stock_name} from the transcript excerpt below. Do NOT include any other speaker's words
+or other stocks.
 
-def run(job_folder):
+Transcript excerpt:
+{window_text}
+
+Instructions:
+{ANALYSIS_RULES}
+- Output ONLY valid JSON:
+{{"chart_type": "...", "analysis": "..."}}
+"""
+
+
+def parse_json_response(content):
+    """Parse a JSON answer, tolerating markdown code fences"""
+    # Extract JSON from response (handle markdown code blocks)
+    if "```json" in content:
+        content = content.split("```json")[1].split("```")[0].strip()
+    elif "```" in content:
+        content = content.split("```")[1].split("```")[0].strip()
+    return json.loads(content)
+
+
+def load_video_offsets(job_folder):
+    """Video-relative START TIME (seconds) per STOCK NAME from Step 9's output"""
+    mapped_csv = os.path.join(job_folder, "analysis", "mapped_master_file.csv")
+    if not os.path.exists(mapped_csv):
+        return {}
+    
+    offsets = {}
+    for name, start_time in pd.read_csv(mapped_csv)[["STOCK NAME", "START TIME"]].itertuples(index=False):
+        try:
+            seconds = time_to_seconds(str(start_time))
+        except ValueError:
+            continue
+        offsets[name] = min(seconds, offsets.get(name, seconds))
+    return offsets
+
+
+def transcript_windows(transcript_lines, stock_names, offsets):
+    """
+    Transcript excerpt per stock: from WINDOW_BEFORE_SEC before its START
+    TIME until the next stock starts (plus grace), clamped to
+    WINDOW_MIN_SEC..WINDOW_MAX_SEC. Stocks without a known START TIME get
+    the whole transcript.
+    
+    Returns:
+        dict of stock name -> window text
+    """
+    timed = []
+    for line in transcript_lines:
+        match = LINE_TIME.match(line)
+        try:
+            timed.append((time_to_seconds(match.group(1)) if match else None, line))
+        except ValueError:
+            timed.append((None, line))
+    
+    starts = sorted(offsets[name] for name in stock_names if name in offsets)
+    full_text = "\n".join(transcript_lines)
+    
+    windows = {}
+    for name in stock_names:
+        if name not in offsets:
+            windows[name] = full_text
+            continue
+        
+        start = offsets[name]
+        following = [t for t in starts if t > start]
+        end = (following[0] if following else start + WINDOW_MAX_SEC) + WINDOW_GRACE_SEC
+        end = min(max(end, start + WINDOW_MIN_SEC), start + WINDOW_MAX_SEC)
+        
+        lines = [line for t, line in timed if t is not None and start - WINDOW_BEFORE_SEC <= t <= end]
+        windows[name] = "\n".join(lines) if lines else full_text
+    return windows
+
+
+def analyze_stock(pradip_speaker, stock_name, window_text):
+    """
+    One stock's analysis, retried on its own when the call or its JSON fails.
+    
+    Returns:
+        dict with chart_type and analysis
+    """
+    prompt = build_stock_prompt(pradip_speaker, window_text, stock_name)
+    messages = [{"role": "user", "content": prompt}]
+    last_error = None
+    for attempt in range(1, STOCK_MAX_ATTEMPTS + 1):
+        try:
+            content = chat(
+                messages,
+                model="gpt-4o",
+                step=12,
+                cache=attempt == 1,
+                **STOCK_PARAMS
+            )
+            result = parse_json_response(content)
+            if not isinstance(result, dict) or not result.get("analysis"):
+                raise ValueError("no analysis in response")
+            return result
+        except Exception as e:
+            last_error = e
+            if attempt == 1:
+                # Don't replay a rejected answer on the next run
+                discard_cached(messages, model="gpt-4o", **STOCK_PARAMS)
+            print(f"  ⚠️ {stock_name}: attempt {attempt}/{STOCK_MAX_ATTEMPTS} failed ({str(e)})")
+    raise Exception(f"{stock_name}: {str(last_error)}")
+
+
+def load_fused_analysis(job_folder, stocks_df):
+    """
+    Analysis cached by Step 8's fused mode, keyed by this step's STOCK NAME.
+    
+    Step 9 upper-cases names, so entries are matched case-insensitively on
+    the name, then on the symbol.
+    
+    Returns:
+        dict of stock name -> {chart_type, analysis} ({} without a cache)
+    """
+    cache_file = os.path.join(job_folder, FUSED_ANALYSIS_FILE)
+    if not os.path.exists(cache_file):
+        return {}
+    
+    with open(cache_file, "r", encoding="utf-8") as f:
+        cached = json.load(f)
+    
+    by_key = {}
+    for name, entry in cached.items():
+        by_key.setdefault(name.strip().upper(), entry)
+        if entry.get("stock_symbol"):
+            by_key.setdefault(entry["stock_symbol"].strip().upper(), entry)
+    
+    symbols = stocks_df["STOCK SYMBOL"] if "STOCK SYMBOL" in stocks_df else [None] * len(stocks_df)
+    data = {}
+    for name, symbol in zip(stocks_df["STOCK NAME"], symbols):
+        entry = by_key.get(str(name).strip().upper()) or by_key.get(str(symbol).strip().upper())
+        if entry and entry.get("analysis"):
+            data[name] = entry
+    return data
+
+
+def extract_windowed(job_folder, pradip_speaker, transcript_lines, stock_names, on_result=None):
+    """
+    Windowed mode: one concurrent call per stock; on_result(name, entry) is
+    called as each stock completes.
+    
+    Returns:
+        (dict of stock name -> {chart_type, analysis}, list of failed stocks)
+    """
+    offsets = load_video_offsets(job_folder)
+    windows = transcript_windows(transcript_lines, stock_names, offsets)
+    print(f"🪟 Windowed analysis: {len(stock_names)} stocks, "
+          f"{sum(1 for n in stock_names if n in offsets)} with a START TIME window")
+    
+    names = list(dict.fromkeys(stock_names))
+    data, failed = {}, []
+    with ThreadPoolExecutor(max_workers=max(1, min(STOCK_MAX_WORKERS, len(names)))) as executor:
+        # Each task runs in a copy of this context so calls keep the job id
+        futures = {executor.submit(contextvars.copy_context().run,
+                                   analyze_stock, pradip_speaker, name, windows[name]): name
+                   for name in names}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                data[name] = future.result()
+            except Exception as e:
+                print(f"  ❌ {str(e)}")
+                failed.append(name)
+                continue
+            if on_result:
+                on_result(name, data[name])
+    failed.sort(key=names.index)
+    return data, failed
+
+
+def pick_windowed(total_tokens, cached, missing):
+    """Windowed per-stock mode under ANALYSIS_MODE, or when only some stocks are cached"""
+    return ANALYSIS_MODE == 'windowed' or (
+        ANALYSIS_MODE == 'auto' and total_tokens > SINGLE_PASS_MAX_TOKENS) or (
+        bool(cached) and bool(missing))
+
+
+def planned_requests(job_folder):
+    """
+    The first-attempt LLM requests run() will make for this job, for batch
+    mode (see batch_mode). Each is a dict with model, messages and params.
+    """
+    with open(os.path.join(job_folder, "analysis", "detected_speakers.txt"), "r", encoding="utf-8") as f:
+        detected = f.read().strip().splitlines()
+    pradip_speaker = detected[1].split(":")[1].strip()
+    
+    with open(os.path.join(job_folder, "transcripts", "filtered_transcription.txt"), "r", encoding="utf-8") as f:
+        convo_text = f.read()
+    
+    stocks_df = pd.read_csv(os.path.join(job_folder, "analysis", "stocks_with_cmp.csv"))
+    stock_names = stocks_df["STOCK NAME"].tolist()
+    cached = load_fused_analysis(job_folder, stocks_df)
+    missing = [name for name in stock_names if name not in cached]
+    if not missing:
+        return []
+    
+    if not pick_windowed(estimate_tokens(convo_text), cached, missing):
+        prompt = build_prompt(pradip_speaker, convo_text, stock_names)
+        return [{'model': "gpt-4o", 'params': SINGLE_PARAMS,
+                 'messages': [{"role": "user", "content": prompt}]}]
+    
+    windows = transcript_windows(convo_text.strip().splitlines(), missing, load_video_offsets(job_folder))
+    return [{'model': "gpt-4o", 'params': STOCK_PARAMS,
+             'messages': [{"role": "user", "content": build_stock_prompt(pradip_speaker, windows[name], name)}]}
+            for name in dict.fromkeys(missing)]
+
+
+def run(job_folder, progress=None):
     """
     Extract Pradip's stock analysis using GPT-4o
     
     Args:
         job_folder: Path to job directory
-        
+        progress: optional callback(message) for per-stock progress
+    
     Returns:
         dict: Status, message, and output files
     """
     print("\n" + "="*60)
     print("STEP 12: Extract Analysis")
     print(f"{'='*60}\n")
-
+    
     try:
         # Input paths
         speakers_file = os.path.join(job_folder, "analysis", "detected_speakers.txt")
@@ -108,79 +466,73 @@ def run(job_folder):
         stock_names = stocks_df["STOCK NAME"].tolist()
         print(f"✅ Loaded {len(stock_names)} stocks\n")
         
-        # Get OpenAI API key
-        print("🔑 Retrieving OpenAI API key from database...")
-        api_key = get_openai_api_key()
-        client = OpenAI(api_key=api_key)
-        print(f"✅ OpenAI API key found\n")
-        
-        # Build GPT prompt
-        print("🤖 Building GPT-4o prompt...")
-        prompt = f"""
-You are a financial market analyst. Extract ONLY {pradip_speaker}'s detailed stock analysis
-from the transcript below. Do NOT include any other speaker's words.
-
-Transcript (Pradip only):
-{convo_text}
-
-Instructions:
-- For each of these stocks: {', '.join(stock_names)}
-- Write the detailed, elaborative analysis given by Pradip.
-- Start each stock's section with: "For [STOCK NAME], ..."
-- Use ₹ for all amounts, and convert word numbers to digits.
-- If chart type is mentioned, include it in the analysis as "On [Chart Type] charts, ...".
-- If chart type not mentioned, default to "Daily, ...".
-- Only 3 Chart type strictly [Daily/Weekly/Monthly]
-- If analysis was revised later, keep ONLY the FINAL/latest version.
-- Ignore greetings or casual talk.
-- Do not use I or We. Speaker, Pradip name etc, and for each write to minimum 100 words but use simple english not complex english words.
-- Example Analysis must like: For Jamna Auto, the view remains positive even though the momentum has
-slowed down compared to earlier moves from the ₹70–80 range. The stock looks
-stronger when compared to Rico Auto, as it has taken solid support around the
-₹100 mark. A strict stop-loss should be maintained at ₹94–95, and as long as the
-stock sustains above this level, the overall outlook remains intact. The key
-resistance zone is around ₹110–111, and once this level is crossed, the stock has
-the potential to move further towards ₹125–130 levels. Holding is advisable with
-disciplined stop-loss management.
-- Output ONLY valid JSON mapping each stock to:
-{{
-  "STOCK NAME": {{"chart_type": "...", "analysis": "..."}}
-}}
-"""
-        
-        print("✅ Prompt built\n")
+        # Analysis cached by Step 8's fused mode: only missing stocks need GPT-4o
+        cached = load_fused_analysis(job_folder, stocks_df)
+        missing = [name for name in stock_names if name not in cached]
+        if cached:
+            print(f"♻️ Using fused analysis from Step 8 for {len(cached)} stocks, "
+                  f"{len(missing)} still to analyze\n")
         
-        # Call GPT-4o
-        print("🚀 Calling OpenAI GPT-4o API...")
-        print("⏳ This may take 30-60 seconds...\n")
+        writer = AnalysisWriter(job_folder, output_csv, stocks_df, progress)
+        for name, entry in cached.items():
+            writer.add(name, entry)
         
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.3
-        )
+        windowed = pick_windowed(estimate_tokens(convo_text), cached, missing)
+        failed = []
+        data = {}
         
-        content = response.choices[0].message.content.strip()
-        print("✅ Received response from GPT-4o\n")
+        if not missing:
+            windowed = False
+        elif not windowed:
+            # Build GPT prompt
+            print("🤖 Building GPT-4o prompt...")
+            prompt = build_prompt(pradip_speaker, convo_text, stock_names)
+            print("✅ Prompt built\n")
+            
+            # Call GPT-4o
+            print("🚀 Calling OpenAI GPT-4o API...")
+            print("⏳ This may take 30-60 seconds...\n")
+            
+            # Streamed: each stock is written as soon as its object closes
+            parser = StockStreamParser()
+            streamed = {}
+            parts = []
+            messages = [{"role": "user", "content": prompt}]
+            for delta in chat_stream(
+                messages,
+                model="gpt-4o",
+                step=12,
+                **SINGLE_PARAMS
+            ):
+                parts.append(delta)
+                for name, entry in parser.feed(delta):
+                    streamed[name] = entry
+                    writer.add(name, entry)
+            content = "".join(parts).strip()
+            print("✅ Received response from GPT-4o\n")
+            
+            # Parse JSON response
+            print("📝 Parsing analysis data...")
+            try:
+                data = parse_json_response(content)
+            except json.JSONDecodeError as e:
+                # A broken JSON blob no longer fails the step: keep what was
+                # streamed and redo the rest per stock
+                print(f"⚠️ JSON parsing error: {str(e)}")
+                print(f"Response content:\n{content[:500]}...")
+                discard_cached(messages, model="gpt-4o", **SINGLE_PARAMS)
+                print("↪️ Falling back to windowed per-stock analysis\n")
+                data = streamed
+                missing = [name for name in missing if name not in streamed]
+                windowed = bool(missing)
         
-        # Parse JSON response
-        print("📝 Parsing analysis data...")
-        
-        # Extract JSON from response (handle markdown code blocks)
-        if "```json" in content:
-            content = content.split("```json")[1].split("```")[0].strip()
-        elif "```" in content:
-            content = content.split("```")[1].split("```")[0].strip()
-        
-        try:
-            data = json.loads(content)
-        except json.JSONDecodeError as e:
-            print(f"⚠️ JSON parsing error: {str(e)}")
-            print(f"Response content:\n{content[:500]}...")
-            return {
-                'status': 'failed',
-                'message': f'Failed to parse GPT response as JSON: {str(e)}'
-            }
+        if windowed:
+            windowed_data, failed = extract_windowed(
+                job_folder, pradip_speaker, convo_text.strip().splitlines(), missing,
+                on_result=writer.add)
+            data.update(windowed_data)
+        data.update(cached)
+        writer.close()
         
         print(f"✅ Parsed analysis for {len(data)} stocks\n")
         
@@ -208,17 +560,22 @@ disciplined stop-loss management.
         # Save output with UTF-8 BOM for Excel compatibility
         print(f"💾 Saving analysis to: {output_csv}")
         
-        # Ensure analysis directory exists
-        os.makedirs(os.path.dirname(output_csv), exist_ok=True)
-        
+        # Rewrite in stock order, including stocks without analysis
         stocks_df.to_csv(output_csv, index=False, encoding="utf-8-sig")
         
         print(f"✅ Saved {len(stocks_df)} records with analysis")
         print(f"✅ Output: analysis/stocks_with_analysis.csv\n")
         
+        message = f'Extracted analysis for {len(data)} of {len(stock_names)} stocks using GPT-4o'
+        if cached:
+            message += f' ({len(cached)} from fused Step 8 output)'
+        if windowed:
+            message += ' (per-stock windows'
+            message += f', failed: {", ".join(failed)})' if failed else ')'
+        
         return {
             'status': 'success',
-            'message': f'Extracted analysis for {len(data)} of {len(stock_names)} stocks using GPT-4o',
+            'message': message,
             'output_files': ['analysis/stocks_with_analysis.csv']
         }
     
@@ -4,8 +4,13 @@ Step 13: Generate Charts
 Fetches candlestick stock charts from Dhan API and generates premium charts
 with moving averages, RSI, and volume indicators.
 
+Candles are cached per job under analysis/candles/. Step 12 prefetches them
+(prefetch_candles) for each stock as soon as its analysis is complete, so
+this step usually only renders.
+
 Input: 
   - analysis/stocks_with_analysis.csv (from Step 12)
+  - analysis/candles/*.pkl (optional, prefetched by Step 12)
   - Dhan API key from database
 Output: 
   - charts/*.png (chart images)
@@ -14,6 +19,7 @@ Output:
 
 import os
 import time
+import shutil
 import json
 import pandas as pd
 import numpy as np
@@ -28,10 +34,17 @@ import mplfinance as mpf
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 
+from backend.utils.rate_limiter import get_rate_limiter
+
 # Constants
 IST = pytz.timezone("Asia/Kolkata")
 BASE_URL = "https://api.dhan.co/v2"
 
+# Interval between uncached stocks (Dhan chart API rate limit), enforced by
+# the 'dhan_charts' limiter shared with Step 12's candle prefetch
+DHAN_STOCK_INTERVAL_SEC = 1.5
+CANDLES_DIR = os.path.join("analysis", "candles")
+
 
 def get_dhan_api_key():
     """Fetch Dhan API key from database"""
@@ -182,6 +195,125 @@ def get_intraday_1m(security_id: str,
     return zip_candles(data)
 
 
+def chart_request(row):
+    """
+    Dhan request parameters for one stock row.
+
+    Returns:
+        (security_id, exchange_segment, date_obj, (h, m, s))
+    """
+    security_id = str(row["SECURITY ID"]).strip()
+    # Remove decimal points from security ID if present (e.g., "1333.0" -> "1333")
+    if '.' in security_id:
+        security_id = security_id.split('.')[0]
+
+    exchange = str(row["EXCHANGE"]).strip().upper()
+    segment = str(row["SEGMENT"]).strip()
+
+    # --- Determine correct exchange segment dynamically ---
+    if pd.notna(segment) and str(segment).strip().upper() != 'NAN':
+        exchange_segment = str(segment).strip().upper()
+    else:
+        exchange_segment = f"{exchange}_EQ" if exchange in ["NSE", "BSE"] else "NSE_EQ"
+
+    # Parse date and time
+    date_obj = parse_date(str(row["DATE"]).strip())
+    hms = parse_time(str(row["START TIME"]).strip())
+    return security_id, exchange_segment, date_obj, hms
+
+
+def dhan_limiter():
+    """Rate limiter shared by every Dhan chart fetch in the worker"""
+    return get_rate_limiter('dhan_charts', 1 / DHAN_STOCK_INTERVAL_SEC, 1)
+
+
+def clear_candle_cache(job_folder):
+    """Drop the job's cached candles (a restarted Step 13 refetches them)"""
+    shutil.rmtree(os.path.join(job_folder, CANDLES_DIR), ignore_errors=True)
+
+
+def _complete_candles(daily, intraday, before_open):
+    """
+    True if the candles are worth caching: Dhan returns empty arrays while
+    data is not yet published, and those must be refetched later. Intraday
+    is legitimately empty only for a START TIME before the market opens.
+    """
+    return not daily.empty and (before_open or not intraday.empty)
+
+
+def fetch_candles(job_folder, security_id, exchange_segment, date_obj, hms, headers):
+    """
+    Daily history (8 months) and 1-minute intraday candles up to START TIME,
+    from the job's candle cache or the Dhan API (paced by dhan_limiter).
+    Empty responses are not cached.
+
+    Returns:
+        (daily, intraday, cached)
+    """
+    h, m, s = hms
+    end_dt_local = IST.localize(
+        datetime(date_obj.year, date_obj.month, date_obj.day, h, m, s))
+    market_open = IST.localize(
+        datetime(date_obj.year, date_obj.month, date_obj.day, 9, 15, 0))
+    before_open = end_dt_local <= market_open
+
+    stem = f"{security_id}_{exchange_segment}_{date_obj.strftime('%Y%m%d')}_{h:02d}{m:02d}{s:02d}"
+    daily_path = os.path.join(job_folder, CANDLES_DIR, f"{stem}_daily.pkl")
+    intraday_path = os.path.join(job_folder, CANDLES_DIR, f"{stem}_1m.pkl")
+    if os.path.exists(daily_path) and os.path.exists(intraday_path):
+        daily, intraday = pd.read_pickle(daily_path), pd.read_pickle(intraday_path)
+        if _complete_candles(daily, intraday, before_open):
+            return daily, intraday, True
+
+    dhan_limiter().acquire()
+
+    # Historical window: last 8 months
+    start_hist = date_obj - relativedelta(months=8)
+    end_hist_non_inclusive = date_obj + timedelta(days=1)
+
+    # Fetch historical daily data
+    daily = get_daily_history(security_id, start_hist,
+                              end_hist_non_inclusive, headers,
+                              exchange_segment)
+
+    # Fetch intraday data
+    if before_open:
+        intraday = pd.DataFrame(
+            columns=["open", "high", "low", "close", "volume"])
+    else:
+        intraday = get_intraday_1m(security_id, market_open,
+                                   end_dt_local, headers,
+                                   exchange_segment)
+
+    if _complete_candles(daily, intraday, before_open):
+        os.makedirs(os.path.dirname(daily_path), exist_ok=True)
+        daily.to_pickle(daily_path)
+        intraday.to_pickle(intraday_path)
+    return daily, intraday, False
+
+
+def dhan_headers():
+    """Request headers with the Dhan API key from the database"""
+    return {
+        "Content-Type": "application/json",
+        "Accept": "application/json",
+        "access-token": get_dhan_api_key()
+    }
+
+
+def prefetch_candles(job_folder, row, headers):
+    """
+    Fetch and cache one stock's candles ahead of this step (called by Step
+    12 as stocks complete). Shares the Dhan rate limit; errors are left for
+    this step to report.
+    """
+    try:
+        security_id, exchange_segment, date_obj, hms = chart_request(row)
+        fetch_candles(job_folder, security_id, exchange_segment, date_obj, hms, headers)
+    except Exception as e:
+        print(f"  ⚠️ Candle prefetch failed for {row.get('STOCK NAME', '?')}: {str(e)}")
+
+
 def rsi(series: pd.Series, period: int = 14) -> pd.Series:
     """Calculate Wilder's RSI(14) with EWM smoothing"""
     if len(series) < 2:
@@ -578,12 +710,7 @@ def run(job_folder):
 
         # Get Dhan API key
         print("🔑 Retrieving Dhan API key from database...")
-        api_key = get_dhan_api_key()
-        headers = {
-            "Content-Type": "application/json",
-            "Accept": "application/json",
-            "access-token": api_key
-        }
+        headers = dhan_headers()
         print(f"✅ Dhan API key found\n")
 
         # Load stocks
@@ -618,53 +745,21 @@ def run(job_folder):
         # Process each stock
         for idx, row in df.iterrows():
             try:
-                security_id = str(row["SECURITY ID"]).strip()
-                # Remove decimal points from security ID if present (e.g., "1333.0" -> "1333")
-                if '.' in security_id:
-                    security_id = security_id.split('.')[0]
-
+                security_id, exchange_segment, date_obj, (h, m, s) = chart_request(row)
                 short_name = str(row["SHORT NAME"]).strip()
                 exchange = str(row["EXCHANGE"]).strip().upper()
                 chart_type = str(row["CHART TYPE"]).strip().title()
-                segment = str(row["SEGMENT"]).strip()
-
-                # --- Determine correct exchange segment dynamically ---
-                if pd.notna(segment) and str(segment).strip().upper() != 'NAN':
-                    exchange_segment = str(segment).strip().upper()
-                else:
-                    exchange_segment = f"{exchange}_EQ" if exchange in ["NSE", "BSE"] else "NSE_EQ"
 
                 print(
                     f"[{idx+1}/{len(df)}] Processing {short_name} ({chart_type}, {exchange_segment})..."
                 )
 
-                # Parse date and time
-                date_obj = parse_date(str(row["DATE"]).strip())
-                h, m, s = parse_time(str(row["START TIME"]).strip())
-                end_dt_local = IST.localize(
-                    datetime(date_obj.year, date_obj.month, date_obj.day, h, m,
-                             s))
-
-                # Historical window: last 8 months
-                start_hist = date_obj - relativedelta(months=8)
-                end_hist_non_inclusive = date_obj + timedelta(days=1)
-
-                # Fetch historical daily data
-                daily = get_daily_history(security_id, start_hist,
-                                          end_hist_non_inclusive, headers,
-                                          exchange_segment)
-
-                # Fetch intraday data
-                market_open = IST.localize(
-                    datetime(date_obj.year, date_obj.month, date_obj.day, 9,
-                             15, 0))
-                if end_dt_local <= market_open:
-                    intraday = pd.DataFrame(
-                        columns=["open", "high", "low", "close", "volume"])
-                else:
-                    intraday = get_intraday_1m(security_id, market_open,
-                                               end_dt_local, headers,
-                                               exchange_segment)
+                # Candles from Step 12's prefetch, or fetched now
+                daily, intraday, cached = fetch_candles(
+                    job_folder, security_id, exchange_segment, date_obj,
+                    (h, m, s), headers)
+                if cached:
+                    print("  ♻️ Using prefetched candles")
 
                 # Resample to timeframe
                 df_tf = resample_to(daily, chart_type, intraday)
@@ -710,9 +805,6 @@ def run(job_folder):
                 print(f"  ✅ Chart saved: {relative_path}")
                 success_count += 1
 
-                # Rate limiting
-                time.sleep(1.5)
-
             except Exception as e:
                 print(f"  ❌ Error: {str(e)}")
                 out_row = {c: row.get(c, "") for c in required}
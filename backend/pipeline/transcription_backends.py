@@ -0,0 +1,398 @@
+"""
+Transcription Backends for Step 3
+
+Every backend exposes ``transcribe(audio_path)`` and returns an
+AssemblyAI-shaped transcript (``utterances`` with speaker/start/end/text in
+ms, ``audio_duration`` and ``text``), so step 3's save_transcript() writes the
+same transcript.csv / transcript.txt whichever engine produced it.
+
+Engines:
+- assemblyai: hosted AssemblyAI (default)
+- local: faster-whisper (CTranslate2, int8 on CPU) plus a simple local
+  speaker diarizer. Needs the optional ``faster-whisper`` package.
+
+Select the engine with TRANSCRIPTION_ENGINE=assemblyai|local.
+
+Benchmark mode compares the local engine with the AssemblyAI transcript
+already stored in a job folder (wall time and word error rate):
+
+    python -m backend.pipeline.transcription_backends backend/job_files/<job_id>
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import wave
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import assemblyai as aai
+from rapidfuzz.distance import Levenshtein
+
+from backend.pipeline.step03_assemblyai_transcribe import build_transcription_config, save_transcript
+from backend.utils.provider_clients import get_assemblyai_transcriber
+
+TRANSCRIPTION_ENGINE = os.environ.get('TRANSCRIPTION_ENGINE', 'assemblyai').lower()
+
+LOCAL_MODEL_SIZE = os.environ.get('LOCAL_WHISPER_MODEL', 'small')
+LOCAL_COMPUTE_TYPE = os.environ.get('LOCAL_WHISPER_COMPUTE_TYPE', 'int8')
+LOCAL_CPU_THREADS = int(os.environ.get('LOCAL_WHISPER_CPU_THREADS', 0))
+LOCAL_MAX_SPEAKERS = int(os.environ.get('LOCAL_MAX_SPEAKERS', 4))
+
+# Whisper models are expensive to load, keep one per (size, compute type) per process
+_whisper_models = {}
+_whisper_lock = threading.Lock()
+
+
+class AssemblyAIBackend:
+    """Hosted AssemblyAI transcription with speaker labels"""
+
+    name = 'assemblyai'
+    default_mode = None
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+
+    def transcribe(self, audio_path):
+        transcriber = get_assemblyai_transcriber(self.api_key, build_transcription_config())
+        transcript = transcriber.transcribe(audio_path)
+        if transcript.status == aai.TranscriptStatus.error:
+            raise Exception(transcript.error)
+        return transcript
+
+
+class LocalWhisperBackend:
+    """
+    Local CPU transcription with faster-whisper plus SimpleDiarizer.
+
+    Runs the whole file in one call (default_mode 'single'): CTranslate2
+    already spreads a single file over all CPU cores.
+    """
+
+    name = 'local'
+    default_mode = 'single'
+
+    def __init__(self, model_size=LOCAL_MODEL_SIZE, compute_type=LOCAL_COMPUTE_TYPE,
+                 cpu_threads=LOCAL_CPU_THREADS, max_speakers=LOCAL_MAX_SPEAKERS, language=None):
+        self.model_size = model_size
+        self.compute_type = compute_type
+        self.cpu_threads = cpu_threads
+        self.language = language
+        self.diarizer = SimpleDiarizer(max_speakers=max_speakers)
+
+    def _get_model(self):
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError:
+            raise Exception(
+                "Local transcription engine requires faster-whisper. "
+                "Install it with: pip install faster-whisper"
+            )
+
+        key = (self.model_size, self.compute_type, self.cpu_threads)
+        with _whisper_lock:
+            if key not in _whisper_models:
+                print(f"📦 Loading faster-whisper '{self.model_size}' ({self.compute_type}, CPU)...")
+                _whisper_models[key] = WhisperModel(
+                    self.model_size,
+                    device="cpu",
+                    compute_type=self.compute_type,
+                    cpu_threads=self.cpu_threads,
+                )
+            return _whisper_models[key]
+
+    def transcribe(self, audio_path):
+        model = self._get_model()
+
+        segments, info = model.transcribe(
+            audio_path,
+            language=self.language,
+            word_timestamps=True,
+            vad_filter=True,
+        )
+
+        segs = []
+        for seg in segments:
+            text = seg.text.strip()
+            if not text:
+                continue
+            segs.append({
+                'start': int(seg.start * 1000),
+                'end': int(seg.end * 1000),
+                'text': text,
+                'words': [
+                    SimpleNamespace(text=w.word.strip(), start=int(w.start * 1000), end=int(w.end * 1000))
+                    for w in (seg.words or []) if w.word.strip()
+                ],
+            })
+
+        labels = self.diarizer.assign(audio_path, [(s['start'], s['end']) for s in segs])
+        utterances = merge_segments(segs, labels)
+
+        return SimpleNamespace(
+            utterances=utterances,
+            audio_duration=info.duration,
+            text=" ".join(u.text for u in utterances),
+            language=info.language,
+        )
+
+
+class SimpleDiarizer:
+    """
+    Lightweight speaker diarization on CPU.
+
+    Each speech segment is summarised by the mean and spread of its
+    log-energy in mel-spaced frequency bands. The segments are clustered with
+    k-means, and k (2..max_speakers) is chosen by silhouette score. It is meant
+    to separate a studio anchor from a phone-in guest, not to rival a neural
+    diarizer.
+    """
+
+    def __init__(self, max_speakers=4, n_bands=24, n_fft=512, hop=160, seed=0):
+        self.max_speakers = max(1, max_speakers)
+        self.n_bands = n_bands
+        self.n_fft = n_fft
+        self.hop = hop
+        self.seed = seed
+
+    def _band_matrix(self, rate):
+        """Triangular mel filterbank, shape (n_bands, n_fft // 2 + 1)"""
+        def hz_to_mel(hz):
+            return 2595 * np.log10(1 + hz / 700.0)
+
+        def mel_to_hz(mel):
+            return 700 * (10 ** (mel / 2595.0) - 1)
+
+        mels = np.linspace(hz_to_mel(80), hz_to_mel(rate / 2), self.n_bands + 2)
+        bins = np.floor((self.n_fft + 1) * mel_to_hz(mels) / rate).astype(int)
+        fb = np.zeros((self.n_bands, self.n_fft // 2 + 1))
+        for b in range(1, self.n_bands + 1):
+            left, center, right = bins[b - 1], bins[b], bins[b + 1]
+            for k in range(left, center):
+                fb[b - 1, k] = (k - left) / max(1, center - left)
+            for k in range(center, right):
+                fb[b - 1, k] = (right - k) / max(1, right - center)
+        return fb
+
+    def _features(self, samples, fb):
+        if len(samples) < self.n_fft:
+            samples = np.pad(samples, (0, self.n_fft - len(samples)))
+        n_frames = 1 + (len(samples) - self.n_fft) // self.hop
+        idx = np.arange(self.n_fft)[None, :] + self.hop * np.arange(n_frames)[:, None]
+        frames = samples[idx] * np.hanning(self.n_fft)
+        power = np.abs(np.fft.rfft(frames, axis=1)) ** 2
+        log_bands = np.log(power @ fb.T + 1e-8)
+        return np.concatenate([log_bands.mean(axis=0), log_bands.std(axis=0)])
+
+    def _kmeans(self, x, k, iters=50):
+        rng = np.random.default_rng(self.seed)
+        centers = [x[rng.integers(len(x))]]
+        for _ in range(1, k):
+            d = np.min(((x[:, None, :] - np.array(centers)[None]) ** 2).sum(axis=2), axis=1)
+            probs = d / d.sum() if d.sum() > 0 else None
+            centers.append(x[rng.choice(len(x), p=probs)])
+        centers = np.array(centers)
+
+        labels = np.zeros(len(x), dtype=int)
+        for it in range(iters):
+            dist = ((x[:, None, :] - centers[None]) ** 2).sum(axis=2)
+            new_labels = dist.argmin(axis=1)
+            if it > 0 and np.array_equal(new_labels, labels):
+                break
+            labels = new_labels
+            for c in range(k):
+                if np.any(labels == c):
+                    centers[c] = x[labels == c].mean(axis=0)
+        return labels
+
+    def _silhouette(self, x, labels):
+        if len(set(labels)) < 2:
+            return -1.0
+        dist = np.sqrt(((x[:, None, :] - x[None]) ** 2).sum(axis=2))
+        scores = []
+        for i in range(len(x)):
+            same = labels == labels[i]
+            a = dist[i, same].sum() / max(1, same.sum() - 1)
+            b = min(dist[i, labels == c].mean() for c in set(labels) if c != labels[i])
+            scores.append((b - a) / max(a, b, 1e-9))
+        return float(np.mean(scores))
+
+    def assign(self, audio_path, spans_ms):
+        """
+        Args:
+            audio_path: 16-bit PCM mono WAV
+            spans_ms: list of (start_ms, end_ms) speech segments
+
+        Returns:
+            list of speaker letters, one per span, lettered by first appearance
+        """
+        if not spans_ms:
+            return []
+
+        feats = []
+        with wave.open(audio_path, "rb") as wf:
+            rate = wf.getframerate()
+            fb = self._band_matrix(rate)
+            for start, end in spans_ms:
+                wf.setpos(min(wf.getnframes(), int(start * rate / 1000)))
+                raw = wf.readframes(max(1, int((end - start) * rate / 1000)))
+                samples = np.frombuffer(raw, dtype=np.int16).astype(np.float32) / 32768.0
+                feats.append(self._features(samples, fb))
+
+        x = np.array(feats)
+        x = (x - x.mean(axis=0)) / (x.std(axis=0) + 1e-8)
+
+        if len(x) < 3 or self.max_speakers == 1:
+            labels = np.zeros(len(x), dtype=int)
+        else:
+            # Silhouette is O(n^2); score k on a sample for long shows
+            sample = x if len(x) <= 1500 else x[np.linspace(0, len(x) - 1, 1500).astype(int)]
+            # An extra speaker has to earn a clearly better silhouette
+            best_k, best_score = 2, -2.0
+            for k in range(2, min(self.max_speakers, len(x) - 1) + 1):
+                score = self._silhouette(sample, self._kmeans(sample, k))
+                if score > best_score + (0.05 if k > 2 else 0):
+                    best_k, best_score = k, score
+            labels = self._kmeans(x, best_k)
+
+        letters = {}
+        out = []
+        for label in labels:
+            if label not in letters:
+                letters[label] = chr(ord('A') + len(letters))
+            out.append(letters[label])
+        return out
+
+
+def merge_segments(segs, labels):
+    """Join consecutive same-speaker segments into utterances"""
+    utterances = []
+    for seg, speaker in zip(segs, labels):
+        if utterances and utterances[-1].speaker == speaker:
+            last = utterances[-1]
+            last.end = seg['end']
+            last.text = f"{last.text} {seg['text']}"
+            last.words.extend(seg['words'])
+        else:
+            utterances.append(SimpleNamespace(
+                speaker=speaker, start=seg['start'], end=seg['end'],
+                text=seg['text'], words=list(seg['words'])
+            ))
+    for utt in utterances:
+        for w in utt.words:
+            w.speaker = utt.speaker
+    return utterances
+
+
+def get_transcription_backend(engine=None, api_key=None):
+    """Return the configured transcription backend"""
+    engine = (engine or TRANSCRIPTION_ENGINE).lower()
+    if engine == 'assemblyai':
+        return AssemblyAIBackend(api_key)
+    if engine == 'local':
+        return LocalWhisperBackend()
+    raise ValueError(f"Unknown transcription engine: {engine}")
+
+
+def normalize_words(text):
+    """Lowercase word list without punctuation, for word error rate"""
+    return re.sub(r"[^\w\s']", " ", str(text).lower()).split()
+
+
+def word_error_rate(reference, hypothesis):
+    """Word-level edit distance divided by the reference length"""
+    ref = normalize_words(reference)
+    hyp = normalize_words(hypothesis)
+    if not ref:
+        return 0.0 if not hyp else 1.0
+    return Levenshtein.distance(ref, hyp) / len(ref)
+
+
+def get_reference_duration_sec(job_id):
+    """Wall time AssemblyAI took for step 3 of this job, if recorded"""
+    try:
+        from backend.utils.database import get_db_cursor
+        with get_db_cursor() as cursor:
+            cursor.execute("""
+                SELECT started_at, ended_at FROM job_steps
+                WHERE job_id = %s AND step_number = 3 AND status = 'success'
+            """, (job_id,))
+            row = cursor.fetchone()
+        if row and row['started_at'] and row['ended_at']:
+            return (row['ended_at'] - row['started_at']).total_seconds()
+    except Exception as e:
+        print(f"⚠️ Could not read AssemblyAI step timing: {str(e)}")
+    return None
+
+
+def benchmark(job_folder, backend=None):
+    """
+    Run a backend on a job's audio and compare it with the stored
+    AssemblyAI transcript.
+
+    Writes transcripts/transcript_<engine>.csv/.txt and
+    analysis/transcription_benchmark.json; transcript.csv is left untouched.
+
+    Returns:
+        dict with wall times, real-time factor, WER and speaker counts
+    """
+    backend = backend or LocalWhisperBackend()
+    job_id = os.path.basename(os.path.normpath(job_folder))
+    audio_path = os.path.join(job_folder, 'audio', 'audio_16k_mono.wav')
+    reference_csv = os.path.join(job_folder, 'transcripts', 'transcript.csv')
+
+    if not os.path.exists(audio_path):
+        raise FileNotFoundError(f"Audio file not found: {audio_path}")
+    if not os.path.exists(reference_csv):
+        raise FileNotFoundError(f"AssemblyAI transcript not found: {reference_csv}")
+
+    reference_df = pd.read_csv(reference_csv)
+    reference_text = " ".join(reference_df["Transcription"].astype(str))
+
+    print(f"⏱️ Benchmarking {backend.name} transcription on {audio_path}...")
+    t0 = time.perf_counter()
+    transcript = backend.transcribe(audio_path)
+    elapsed = time.perf_counter() - t0
+
+    save_transcript(job_id, transcript, basename=f"transcript_{backend.name}")
+
+    with wave.open(audio_path, "rb") as wf:
+        audio_sec = wf.getnframes() / wf.getframerate()
+
+    result = {
+        'job_id': job_id,
+        'engine': backend.name,
+        'audio_duration_sec': round(audio_sec, 1),
+        'wall_time_sec': round(elapsed, 1),
+        'real_time_factor': round(elapsed / audio_sec, 3) if audio_sec else None,
+        'assemblyai_wall_time_sec': get_reference_duration_sec(job_id),
+        'word_error_rate': round(word_error_rate(reference_text, transcript.text), 4),
+        'reference_words': len(normalize_words(reference_text)),
+        'hypothesis_words': len(normalize_words(transcript.text)),
+        'reference_speakers': int(reference_df["Speaker"].nunique()),
+        'hypothesis_speakers': len({u.speaker for u in transcript.utterances}),
+    }
+
+    output_json = os.path.join(job_folder, 'analysis', 'transcription_benchmark.json')
+    os.makedirs(os.path.dirname(output_json), exist_ok=True)
+    with open(output_json, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2)
+
+    print(f"\n📊 Benchmark ({backend.name} vs AssemblyAI):")
+    for key, value in result.items():
+        print(f"   {key}: {value}")
+
+    return result
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python -m backend.pipeline.transcription_backends <job_folder> [model_size]")
+        sys.exit(1)
+
+    model_size = sys.argv[2] if len(sys.argv) > 2 else LOCAL_MODEL_SIZE
+    benchmark(sys.argv[1], LocalWhisperBackend(model_size=model_size))
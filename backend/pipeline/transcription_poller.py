@@ -0,0 +1,105 @@
+"""
+Transcript Poller for submit/poll transcription (Step 3)
+
+Step 3 submits the audio to AssemblyAI, stores the transcript id in
+job_steps.external_id and releases the pipeline worker. This single daemon
+thread checks every waiting transcript once per interval and, when one is
+ready, resumes that job's pipeline from step 4 in its own thread.
+
+The webhook endpoint (media_rationale.transcription_webhook) resumes jobs
+through the same pipeline_manager.resume_after_transcription() call; the
+atomic claim there makes it safe for both to fire for one transcript.
+"""
+
+import os
+import time
+import threading
+from backend.utils.database import get_db_cursor
+from backend.pipeline.step03_assemblyai_transcribe import fetch_transcription, TranscriptionFailed
+from backend.pipeline.pipeline_manager import get_assemblyai_api_key, resume_after_transcription, fail_transcription
+
+POLL_INTERVAL_SEC = int(os.environ.get('TRANSCRIPT_POLL_INTERVAL_SEC', 15))
+
+_poller_thread = None
+_poller_lock = threading.Lock()
+
+
+def get_waiting_transcriptions():
+    """Return (job_id, transcript_id) for every step 3 waiting on AssemblyAI"""
+    with get_db_cursor() as cursor:
+        cursor.execute("""
+            SELECT job_id, external_id
+            FROM job_steps
+            WHERE step_number = 3 AND status = 'running'
+              AND external_status = 'submitted' AND external_id IS NOT NULL
+            ORDER BY started_at ASC
+        """)
+        return [(row['job_id'], row['external_id']) for row in cursor.fetchall()]
+
+
+def resume_in_background(job_id, transcript_id, transcript=None):
+    """Resume a job's pipeline on its own thread so polling is never blocked"""
+    thread = threading.Thread(
+        target=resume_after_transcription,
+        args=(job_id, transcript_id, transcript)
+    )
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def poll_once():
+    """
+    Check all waiting transcripts once.
+
+    Returns:
+        int: number of jobs resumed
+    """
+    waiting = get_waiting_transcriptions()
+    if not waiting:
+        return 0
+
+    api_key = get_assemblyai_api_key()
+    resumed = 0
+
+    for job_id, transcript_id in waiting:
+        try:
+            transcript = fetch_transcription(transcript_id, api_key)
+        except TranscriptionFailed as e:
+            print(f"❌ Transcript {transcript_id} for job {job_id}: {str(e)}")
+            fail_transcription(job_id, transcript_id, str(e))
+            continue
+        except Exception as e:
+            # Network error, 5xx or timeout: leave the step submitted, retry next poll
+            print(f"⚠️ Transcript {transcript_id} for job {job_id} not fetched, will retry: {str(e)}")
+            continue
+
+        if transcript is not None:
+            print(f"📥 Transcript {transcript_id} ready, resuming job {job_id}")
+            resume_in_background(job_id, transcript_id, transcript)
+            resumed += 1
+
+    return resumed
+
+
+def _poll_forever(interval):
+    while True:
+        try:
+            poll_once()
+        except Exception as e:
+            print(f"Transcript poller error: {str(e)}")
+        time.sleep(interval)
+
+
+def start_transcription_poller(interval=POLL_INTERVAL_SEC):
+    """Start the poller thread once per process"""
+    global _poller_thread
+    with _poller_lock:
+        if _poller_thread is not None and _poller_thread.is_alive():
+            return _poller_thread
+
+        _poller_thread = threading.Thread(target=_poll_forever, args=(interval,))
+        _poller_thread.daemon = True
+        _poller_thread.start()
+        print(f"✓ Transcript poller started (every {interval}s)")
+        return _poller_thread
@@ -173,9 +173,23 @@ def init_database():
             );
         """)
         
+        # External work submitted by a step (e.g. AssemblyAI transcript id)
+        # while the worker is released; external_status tracks the hand-off
+        cursor.execute("""
+            ALTER TABLE job_steps ADD COLUMN IF NOT EXISTS external_id TEXT;
+        """)
+
+        cursor.execute("""
+            ALTER TABLE job_steps ADD COLUMN IF NOT EXISTS external_status VARCHAR(20);
+        """)
+
         cursor.execute("""
             CREATE INDEX IF NOT EXISTS idx_job_steps_job_id ON job_steps(job_id);
         """)
+
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_job_steps_external_id ON job_steps(external_id);
+        """)
         
         cursor.execute("""
             CREATE INDEX IF NOT EXISTS idx_job_steps_status ON job_steps(status);
@@ -208,6 +222,48 @@ def init_database():
             CREATE INDEX IF NOT EXISTS idx_saved_rationale_channel_id ON saved_rationale(channel_id);
         """)
         
+        # Translation Memory table (translations reused across jobs, LRU-evicted)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS translation_memory (
+                key CHAR(64) PRIMARY KEY,
+                source_lang VARCHAR(10) NOT NULL,
+                target_lang VARCHAR(10) NOT NULL,
+                engine VARCHAR(50) NOT NULL,
+                source_text TEXT NOT NULL,
+                translated_text TEXT NOT NULL,
+                hit_count INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_translation_memory_last_used ON translation_memory(last_used_at);
+        """)
+        
+        # LLM Calls table (tokens, latency and cache hits of every LLM call)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS llm_calls (
+                id SERIAL PRIMARY KEY,
+                job_id VARCHAR(50) REFERENCES jobs(id) ON DELETE SET NULL,
+                step_number INTEGER,
+                model VARCHAR(100) NOT NULL,
+                prompt_tokens INTEGER DEFAULT 0,
+                completion_tokens INTEGER DEFAULT 0,
+                latency_ms INTEGER DEFAULT 0,
+                cache_hit BOOLEAN DEFAULT FALSE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_llm_calls_job_id ON llm_calls(job_id);
+        """)
+        
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_llm_calls_created_at ON llm_calls(created_at);
+        """)
+        
         # Activity Logs table (audit trail for all system activities)
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS activity_logs (
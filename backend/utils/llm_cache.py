@@ -0,0 +1,147 @@
+"""
+Disk-backed cache of LLM responses.
+
+Rerunning step 8 or 12 re-sends identical prompts; the gateway answers them
+from here instead of paying for them again. Entries are keyed by a SHA-256
+of the model, messages and request parameters and stored as one JSON file
+each under LLM_CACHE_DIR. Hits refresh the file's modification time, and
+once the directory grows past LLM_CACHE_MAX_MB the least recently used
+entries are deleted.
+
+The cache is an optimization only: I/O errors are logged and the call goes
+to the API.
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+import threading
+
+LLM_CACHE_ENABLED = os.environ.get('LLM_CACHE', 'true').lower() in ('1', 'true', 'yes')
+LLM_CACHE_DIR = os.environ.get('LLM_CACHE_DIR', os.path.join('backend', 'llm_cache'))
+LLM_CACHE_MAX_MB = float(os.environ.get('LLM_CACHE_MAX_MB', 500))
+
+# Eviction trims down to this share of the cap so it does not run on every write
+EVICT_TO_RATIO = 0.9
+
+_size_bytes = None
+_lock = threading.Lock()
+
+
+def cache_key(model, messages, params):
+    """Hash of model + messages + request parameters"""
+    raw = json.dumps({'model': model, 'messages': messages, 'params': params},
+                     sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _path(key):
+    return os.path.join(LLM_CACHE_DIR, key[:2], f"{key}.json")
+
+
+def get(key):
+    """
+    Cached response for key, or None.
+
+    Returns:
+        dict with content, prompt_tokens and completion_tokens
+    """
+    if not LLM_CACHE_ENABLED:
+        return None
+
+    path = _path(key)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        os.utime(path)
+        return entry
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"⚠️ LLM cache read failed: {str(e)}")
+        return None
+
+
+def put(key, content, prompt_tokens=None, completion_tokens=None):
+    """Store a response (atomically) and evict old entries over the size cap"""
+    global _size_bytes
+    if not LLM_CACHE_ENABLED:
+        return
+
+    path = _path(key)
+    entry = {'content': content, 'prompt_tokens': prompt_tokens,
+             'completion_tokens': completion_tokens}
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+        with _lock:
+            if _size_bytes is None:
+                _size_bytes = sum(size for _, size, _ in _entries())
+            else:
+                _size_bytes += os.path.getsize(path)
+            if _size_bytes > LLM_CACHE_MAX_MB * 1024 * 1024:
+                _evict()
+    except Exception as e:
+        print(f"⚠️ LLM cache write failed: {str(e)}")
+
+
+def delete(key):
+    """Drop an entry (e.g. an answer the caller rejected)"""
+    global _size_bytes
+    if not LLM_CACHE_ENABLED:
+        return
+    path = _path(key)
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+        with _lock:
+            if _size_bytes is not None:
+                _size_bytes -= size
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"⚠️ LLM cache delete failed: {str(e)}")
+
+
+def _entries():
+    """(path, size, mtime) of every cache file"""
+    entries = []
+    for root, _, files in os.walk(LLM_CACHE_DIR):
+        for name in files:
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+    return entries
+
+
+def _evict():
+    """Delete least recently used entries until under EVICT_TO_RATIO of the cap"""
+    global _size_bytes
+    entries = sorted(_entries(), key=lambda entry: entry[2])
+    total = sum(size for _, size, _ in entries)
+    target = LLM_CACHE_MAX_MB * 1024 * 1024 * EVICT_TO_RATIO
+
+    removed = 0
+    for path, size, _ in entries:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+
+    _size_bytes = total
+    if removed:
+        print(f"🧹 Evicted {removed} least recently used LLM cache entries")
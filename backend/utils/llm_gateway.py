@@ -0,0 +1,567 @@
+"""
+Shared LLM gateway for the pipeline steps.
+
+Every OpenAI call goes through chat(). The gateway keeps one long-lived
+OpenAI client per worker process (per API key) on a keep-alive HTTP
+connection pool, so steps stop paying connection and TLS setup. It also
+applies a per-call timeout and the shared 'openai' rate limiter, retries
+transient failures with exponential backoff and jitter, and records latency
+and token usage for every call.
+
+Responses are cached on disk by a hash of model, messages and parameters
+(see llm_cache), so rerunning a step answers identical prompts instantly.
+Pass cache=False for calls that must reach the API, e.g. a retry after a
+bad answer (discard_cached() drops the rejected one). Inside cache_bypass()
+(a restarted step) cached answers are not read, but fresh ones are stored.
+
+Calls are bounded by a per-step latency budget (LLM_STEP_BUDGETS_SEC) that
+covers the whole call, retries and backoff included. Once a step/model has
+latency history, a call still unanswered at its p95 gets a hedged duplicate
+request; the first answer wins and the other is cancelled. Hedges are capped at LLM_HEDGE_MAX_RATIO of all calls and only
+sent when the rate limiter has a spare token.
+
+Each call is also written to the llm_calls table with the job set by
+job_context() (the pipeline manager sets it around every step), for the
+per-job/step/channel accounting in /api/v1/llm-usage.
+
+    from backend.utils.llm_gateway import chat
+    content = chat([{"role": "user", "content": prompt}], step=8, temperature=0.3)
+
+chat_stream() is the streaming variant: it yields content deltas as they
+arrive, with the same caching, limits and accounting.
+"""
+
+import os
+import time
+import random
+import hashlib
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+import httpx
+import openai
+from openai import OpenAI
+from backend.utils.database import get_db_cursor
+from backend.utils.rate_limiter import get_rate_limiter
+from backend.utils import llm_cache
+
+DEFAULT_MODEL = os.environ.get('LLM_MODEL', 'gpt-4o')
+LLM_TIMEOUT_SEC = float(os.environ.get('LLM_TIMEOUT_SEC', 180))
+LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', 3))
+LLM_RETRY_BASE_SEC = 1.0
+LLM_RETRY_MAX_SEC = 30.0
+
+# Requests/second shared by every concurrent LLM call in the worker
+LLM_RATE_PER_SEC = float(os.environ.get('LLM_RATE_PER_SEC', 5))
+LLM_RATE_BURST = int(os.environ.get('LLM_RATE_BURST', 10))
+
+# Whole-call latency budget per pipeline step (seconds), shared by all
+# retries; other calls use LLM_TIMEOUT_SEC. Override with LLM_BUDGET_STEP_<n>.
+LLM_STEP_BUDGETS_SEC = {
+    step: float(os.environ.get(f'LLM_BUDGET_STEP_{step}', budget))
+    for step, budget in {6: 60, 8: 240, 12: 240}.items()
+}
+
+# Hedging: duplicate a call still unanswered at its step/model p95
+LLM_HEDGE_ENABLED = os.environ.get('LLM_HEDGE', 'true').lower() in ('1', 'true', 'yes')
+LLM_HEDGE_MAX_RATIO = float(os.environ.get('LLM_HEDGE_MAX_RATIO', 0.1))
+HEDGE_MIN_SAMPLES = 20
+HEDGE_HISTORY_SIZE = 200
+HEDGE_MIN_DELAY_SEC = 2.0
+
+# No retry is started with less than this much of the budget left
+LLM_MIN_ATTEMPT_SEC = 1.0
+
+# Keep-alive pool shared by all calls of a worker
+LLM_MAX_CONNECTIONS = int(os.environ.get('LLM_MAX_CONNECTIONS', 20))
+LLM_KEEPALIVE_EXPIRY_SEC = 300
+
+# Transient errors worth retrying (4xx other than 429 are not)
+RETRYABLE_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+# Job the current pipeline step runs for (copy the context into worker threads)
+_current_job = contextvars.ContextVar('llm_job_id', default=None)
+
+# Set while a restarted step runs, so it gets fresh answers
+_cache_bypass = contextvars.ContextVar('llm_cache_bypass', default=False)
+
+_usage = {'calls': 0, 'failures': 0, 'retries': 0, 'cache_hits': 0, 'hedges': 0,
+          'hedge_wins': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'latency_sec': 0.0}
+_usage_lock = threading.Lock()
+
+# Recent successful request latencies per (step, model), and the p95 read
+# from llm_calls when a worker starts without history
+_latencies = {}
+_seeded_p95 = {}
+_latency_lock = threading.Lock()
+
+
+def get_openai_api_key():
+    """Fetch OpenAI API key from database"""
+    try:
+        with get_db_cursor() as cursor:
+            cursor.execute("""
+                SELECT key_value
+                FROM api_keys
+                WHERE LOWER(provider) = 'openai'
+                LIMIT 1
+            """)
+            result = cursor.fetchone()
+    except Exception as e:
+        raise Exception(f"Failed to fetch OpenAI API key: {str(e)}")
+
+    if not result or not result['key_value']:
+        raise Exception("OpenAI API key not found in database. Please add it in API Keys settings.")
+    return result['key_value']
+
+
+def get_client(api_key=None):
+    """
+    Long-lived OpenAI client for this worker.
+
+    One client (and connection pool) per API key; retries are handled by
+    chat(), so the SDK's own retries are disabled.
+    """
+    api_key = api_key or get_openai_api_key()
+    key = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_CONNECTIONS,
+                    keepalive_expiry=LLM_KEEPALIVE_EXPIRY_SEC
+                ),
+                timeout=LLM_TIMEOUT_SEC
+            )
+            client = OpenAI(api_key=api_key, http_client=http_client, max_retries=0)
+            _clients[key] = client
+        return client
+
+
+def _backoff_delay(attempt):
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(LLM_RETRY_MAX_SEC, LLM_RETRY_BASE_SEC * 2 ** attempt))
+
+
+def _record(latency, usage=None, failed=False, retries=0):
+    with _usage_lock:
+        _usage['calls'] += 1
+        _usage['retries'] += retries
+        _usage['latency_sec'] += latency
+        if failed:
+            _usage['failures'] += 1
+        if usage is not None:
+            _usage['prompt_tokens'] += usage.prompt_tokens or 0
+            _usage['completion_tokens'] += usage.completion_tokens or 0
+
+
+@contextmanager
+def job_context(job_id):
+    """Attribute LLM calls made inside the block to job_id"""
+    token = _current_job.set(job_id)
+    try:
+        yield
+    finally:
+        _current_job.reset(token)
+
+
+@contextmanager
+def cache_bypass(enabled=True):
+    """Inside the block, calls skip cached answers (fresh answers are still stored)"""
+    token = _cache_bypass.set(enabled)
+    try:
+        yield
+    finally:
+        _cache_bypass.reset(token)
+
+
+def discard_cached(messages, model=DEFAULT_MODEL, **params):
+    """Drop the cached answer for a call whose answer the caller rejected"""
+    llm_cache.delete(llm_cache.cache_key(model, messages, params))
+
+
+def _log_call(step, model, latency, prompt_tokens=None, completion_tokens=None, cache_hit=False):
+    """Write one row to llm_calls; accounting never fails the call"""
+    try:
+        with get_db_cursor(commit=True) as cursor:
+            cursor.execute("""
+                INSERT INTO llm_calls (job_id, step_number, model, prompt_tokens,
+                                       completion_tokens, latency_ms, cache_hit)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """, (_current_job.get(), step, model, prompt_tokens or 0,
+                  completion_tokens or 0, int(latency * 1000), cache_hit))
+    except Exception as e:
+        print(f"⚠️ Failed to record LLM call: {str(e)}")
+
+
+def step_budget(step):
+    """Latency budget in seconds for one whole call (all attempts) of a pipeline step"""
+    return LLM_STEP_BUDGETS_SEC.get(step, LLM_TIMEOUT_SEC)
+
+
+def _budget_exceeded(client):
+    """Timeout error for a call whose budget ran out between attempts"""
+    return openai.APITimeoutError(request=httpx.Request("POST", f"{client.base_url}chat/completions"))
+
+
+def _observe_latency(step, model, latency):
+    with _latency_lock:
+        _latencies.setdefault((step, model), deque(maxlen=HEDGE_HISTORY_SIZE)).append(latency)
+
+
+def _historical_p95(step, model):
+    """
+    p95 request latency for step/model: from this worker's recent calls,
+    else from llm_calls (read once per worker). None without enough data.
+    """
+    key = (step, model)
+    with _latency_lock:
+        recent = sorted(_latencies.get(key, ()))
+        seeded = key in _seeded_p95
+    if len(recent) >= HEDGE_MIN_SAMPLES:
+        return recent[int(0.95 * (len(recent) - 1))]
+    if not seeded:
+        p95 = None
+        try:
+            with get_db_cursor() as cursor:
+                cursor.execute("""
+                    SELECT COUNT(*) as samples,
+                           PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY latency_ms) as p95_ms
+                    FROM llm_calls
+                    WHERE step_number IS NOT DISTINCT FROM %s AND model = %s AND NOT cache_hit
+                      AND created_at > CURRENT_TIMESTAMP - INTERVAL '7 days'
+                """, (step, model))
+                row = cursor.fetchone()
+            if row and row['samples'] >= HEDGE_MIN_SAMPLES:
+                p95 = row['p95_ms'] / 1000.0
+        except Exception as e:
+            print(f"⚠️ Could not read LLM latency history: {str(e)}")
+        with _latency_lock:
+            _seeded_p95[key] = p95
+    return _seeded_p95[key]
+
+
+def _allow_hedge(limiter):
+    """Cost guardrail: hedges stay under LLM_HEDGE_MAX_RATIO of calls and never wait for the limiter"""
+    with _usage_lock:
+        if _usage['hedges'] + 1 > LLM_HEDGE_MAX_RATIO * (_usage['calls'] + 1):
+            return False
+    if not limiter.try_acquire():
+        return False
+    with _usage_lock:
+        _usage['hedges'] += 1
+    return True
+
+
+class _Cancelled(Exception):
+    pass
+
+
+def _streamed_completion(client, model, messages, deadline, params, cancelled, handle):
+    """
+    One request read as a stream so it can be abandoned mid-answer: stops
+    (closing the connection) once `cancelled` is set or the deadline passes.
+    The open stream is put in handle['stream'] so the coordinating thread
+    can close it as soon as the other attempt wins.
+
+    Returns:
+        (content, usage)
+    """
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        timeout=max(LLM_MIN_ATTEMPT_SEC, deadline - time.monotonic()),
+        stream=True,
+        stream_options={"include_usage": True},
+        **params
+    )
+    handle['stream'] = stream
+    if cancelled.is_set():
+        stream.close()
+        raise _Cancelled()
+    parts = []
+    usage = None
+    try:
+        for chunk in stream:
+            if cancelled.is_set():
+                raise _Cancelled()
+            if time.monotonic() > deadline:
+                raise openai.APITimeoutError(request=stream.response.request)
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+    finally:
+        stream.close()
+    return "".join(parts), usage
+
+
+def _hedged_completion(client, model, messages, budget, hedge_after, params, limiter, label):
+    """
+    Primary request, plus a duplicate if no answer arrived after hedge_after
+    seconds. The first successful answer wins; the other is cancelled and
+    its stream closed. Both share one deadline of `budget` seconds.
+
+    Each attempt runs on its own daemon thread rather than a shared pool:
+    a loser still waiting for its first byte cannot be interrupted, and
+    must not hold up other calls until its deadline.
+
+    Returns:
+        (content, usage)
+    """
+    deadline = time.monotonic() + budget
+    attempts = {}
+
+    def launch():
+        cancelled = threading.Event()
+        handle = {}
+        future = Future()
+        context = contextvars.copy_context()
+
+        def run():
+            try:
+                future.set_result(context.run(_streamed_completion, client, model, messages,
+                                              deadline, params, cancelled, handle))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, daemon=True).start()
+        attempts[future] = (cancelled, handle)
+
+    launch()
+    done, _ = wait(attempts, timeout=hedge_after)
+    if not done and _allow_hedge(limiter):
+        print(f"🔀 {label}: no answer after {hedge_after:.1f}s (p95), sending hedge request")
+        launch()
+
+    pending = set(attempts)
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                result = future.result()
+            except Exception as e:
+                error = e
+                continue
+            for other in pending:
+                cancelled, handle = attempts[other]
+                cancelled.set()
+                stream = handle.get('stream')
+                if stream is not None:
+                    try:
+                        stream.close()
+                    except Exception:
+                        pass
+            if len(attempts) > 1 and future is not next(iter(attempts)):
+                with _usage_lock:
+                    _usage['hedge_wins'] += 1
+            return result
+    raise error
+
+
+def get_usage_stats():
+    """Totals for all calls made by this worker since start"""
+    with _usage_lock:
+        return dict(_usage)
+
+
+def chat(messages, model=DEFAULT_MODEL, step=None, timeout=None, max_retries=None, cache=True, **params):
+    """
+    Run one chat completion and return the message content.
+
+    Args:
+        messages: chat messages
+        model: model name
+        step: pipeline step number (for logging)
+        timeout: latency budget for the whole call, retries included, in
+            seconds (default: the step's budget, see step_budget)
+        max_retries: retries for transient errors (default LLM_MAX_RETRIES)
+        cache: answer from / store into the response cache (default True;
+            not read inside cache_bypass())
+        **params: passed to chat.completions.create (temperature, max_tokens, ...)
+
+    Returns:
+        str: the first choice's content, stripped
+    """
+    label = f"step {step}" if step is not None else "LLM"
+    key = llm_cache.cache_key(model, messages, params)
+    if cache and not _cache_bypass.get():
+        cached = llm_cache.get(key)
+        if cached is not None:
+            with _usage_lock:
+                _usage['cache_hits'] += 1
+            print(f"📈 {label}: {model} cache hit")
+            _log_call(step, model, 0, cached.get('prompt_tokens'),
+                      cached.get('completion_tokens'), cache_hit=True)
+            return cached['content']
+
+    client = get_client()
+    timeout = timeout or step_budget(step)
+    max_retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+    limiter = get_rate_limiter('openai', LLM_RATE_PER_SEC, LLM_RATE_BURST)
+
+    hedge_after = _historical_p95(step, model) if LLM_HEDGE_ENABLED else None
+    if hedge_after is not None:
+        hedge_after = max(HEDGE_MIN_DELAY_SEC, hedge_after)
+
+    start = time.perf_counter()
+    deadline = time.monotonic() + timeout
+    attempt = 0
+    while True:
+        limiter.acquire()
+        attempt_start = time.perf_counter()
+        remaining = deadline - time.monotonic()
+        try:
+            if remaining <= 0:
+                raise _budget_exceeded(client)
+            if hedge_after is None or hedge_after >= remaining:
+                response = client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    timeout=remaining,
+                    **params
+                )
+                content, usage = response.choices[0].message.content, response.usage
+            else:
+                content, usage = _hedged_completion(
+                    client, model, messages, remaining, hedge_after, params, limiter, label)
+            _observe_latency(step, model, time.perf_counter() - attempt_start)
+            break
+        except RETRYABLE_ERRORS as e:
+            delay = _backoff_delay(attempt)
+            if attempt >= max_retries or time.monotonic() + delay + LLM_MIN_ATTEMPT_SEC > deadline:
+                _record(time.perf_counter() - start, failed=True, retries=attempt)
+                raise
+            attempt += 1
+            print(f"⚠️ {label}: {type(e).__name__}, retry {attempt}/{max_retries} in {delay:.1f}s")
+            time.sleep(delay)
+        except Exception:
+            _record(time.perf_counter() - start, failed=True, retries=attempt)
+            raise
+
+    latency = time.perf_counter() - start
+    _record(latency, usage, retries=attempt)
+    _log_call(step, model, latency,
+              usage.prompt_tokens if usage is not None else None,
+              usage.completion_tokens if usage is not None else None)
+
+    if usage is not None:
+        print(f"📈 {label}: {model} {latency:.1f}s, "
+              f"{usage.prompt_tokens} prompt + {usage.completion_tokens} completion tokens")
+    else:
+        print(f"📈 {label}: {model} {latency:.1f}s")
+
+    content = (content or "").strip()
+    if cache:
+        llm_cache.put(key, content,
+                      usage.prompt_tokens if usage is not None else None,
+                      usage.completion_tokens if usage is not None else None)
+    return content
+
+
+def chat_stream(messages, model=DEFAULT_MODEL, step=None, timeout=None, max_retries=None, cache=True, **params):
+    """
+    Stream one chat completion, yielding content deltas as they arrive.
+
+    Same arguments as chat(). Transient errors are retried only while opening
+    the stream; once content has been yielded an error is raised to the
+    caller. The step's budget bounds the whole call (opening retries and
+    the stream); streams are not
+    hedged, since the caller has already consumed the partial answer. A
+    cache hit yields the whole cached content at once.
+    """
+    label = f"step {step}" if step is not None else "LLM"
+    key = llm_cache.cache_key(model, messages, params)
+    if cache and not _cache_bypass.get():
+        cached = llm_cache.get(key)
+        if cached is not None:
+            with _usage_lock:
+                _usage['cache_hits'] += 1
+            print(f"📈 {label}: {model} cache hit")
+            _log_call(step, model, 0, cached.get('prompt_tokens'),
+                      cached.get('completion_tokens'), cache_hit=True)
+            yield cached['content']
+            return
+
+    client = get_client()
+    timeout = timeout or step_budget(step)
+    max_retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+    limiter = get_rate_limiter('openai', LLM_RATE_PER_SEC, LLM_RATE_BURST)
+
+    start = time.perf_counter()
+    deadline = time.monotonic() + timeout
+    attempt = 0
+    while True:
+        limiter.acquire()
+        remaining = deadline - time.monotonic()
+        try:
+            if remaining <= 0:
+                raise _budget_exceeded(client)
+            stream = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                timeout=remaining,
+                stream=True,
+                stream_options={"include_usage": True},
+                **params
+            )
+            break
+        except RETRYABLE_ERRORS as e:
+            delay = _backoff_delay(attempt)
+            if attempt >= max_retries or time.monotonic() + delay + LLM_MIN_ATTEMPT_SEC > deadline:
+                _record(time.perf_counter() - start, failed=True, retries=attempt)
+                raise
+            attempt += 1
+            print(f"⚠️ {label}: {type(e).__name__}, retry {attempt}/{max_retries} in {delay:.1f}s")
+            time.sleep(delay)
+        except Exception:
+            _record(time.perf_counter() - start, failed=True, retries=attempt)
+            raise
+
+    parts = []
+    usage = None
+    try:
+        for chunk in stream:
+            if time.monotonic() > deadline:
+                raise openai.APITimeoutError(request=stream.response.request)
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+    except Exception:
+        _record(time.perf_counter() - start, failed=True, retries=attempt)
+        raise
+    finally:
+        stream.close()
+
+    latency = time.perf_counter() - start
+    _record(latency, usage, retries=attempt)
+    _log_call(step, model, latency,
+              usage.prompt_tokens if usage is not None else None,
+              usage.completion_tokens if usage is not None else None)
+
+    if usage is not None:
+        print(f"📈 {label}: {model} {latency:.1f}s streamed, "
+              f"{usage.prompt_tokens} prompt + {usage.completion_tokens} completion tokens")
+    else:
+        print(f"📈 {label}: {model} {latency:.1f}s streamed")
+
+    if cache:
+        llm_cache.put(key, "".join(parts).strip(),
+                      usage.prompt_tokens if usage is not None else None,
+                      usage.completion_tokens if usage is not None else None)
@@ -0,0 +1,295 @@
+"""
+Compact, memory-mapped index of the scrip master.
+
+The Dhan scrip master has hundreds of thousands of rows across every
+segment, but Step 9 only needs the EQUITY rows and a handful of columns.
+Parsing the CSV and normalizing its keys took seconds per job, so the
+index is built once when a masterFile is uploaded and stored next to it
+as a folder of .npy arrays (one per column, fixed-width strings) plus a
+meta.json describing the source file.
+
+Step 9 opens the arrays with mmap_mode='r': every worker process maps the
+same read-only pages from the OS page cache instead of parsing its own
+copy. If the index is missing or older than the master file it is rebuilt
+from the CSV on first use.
+
+The index also holds a trigram inverted index over each normalized key
+column (sorted trigrams, posting offsets and row positions), used to prune
+fuzzy-match candidates in Step 9 and to answer symbol searches.
+"""
+
+import os
+import re
+import json
+import shutil
+import threading
+import numpy as np
+import pandas as pd
+from rapidfuzz import fuzz, process
+
+INDEX_SUFFIX = ".idx"
+INDEX_VERSION = 2
+
+# Raw master columns kept in the index; missing ones are stored as ""
+TEXT_COLUMNS = ["SEM_TRADING_SYMBOL", "SEM_CUSTOM_SYMBOL", "SM_SYMBOL_NAME", "SEM_EXM_EXCH_ID"]
+PASSTHROUGH_COLUMNS = ["SEM_SMST_SECURITY_ID", "SEM_INSTRUMENT_NAME", "SEM_SEGMENT"]
+
+# Normalized matching keys: index column -> source column
+NORM_COLUMNS = {
+    "SEM_TRADING_SYMBOL_NORM": "SEM_TRADING_SYMBOL",
+    "SEM_CUSTOM_SYMBOL_NORM": "SEM_CUSTOM_SYMBOL",
+    "SM_SYMBOL_NAME_NORM": "SM_SYMBOL_NAME",
+}
+
+# Candidate rows kept per trigram lookup (those sharing the most trigrams)
+TRIGRAM_CANDIDATES = int(os.environ.get('MASTER_TRIGRAM_CANDIDATES', 200))
+
+_loaded = {}
+_lock = threading.Lock()
+
+
+def normalize_text(s):
+    """Clean text for matching (remove special chars, multiple spaces)."""
+    if not isinstance(s, str):
+        s = str(s)
+    s = re.sub(r"[^A-Z0-9]", "", s.upper())  # Keep only alphanumerics
+    return s.strip()
+
+
+def trigrams(s):
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+def _save_postings(folder, column, values):
+    """Write column's trigram -> row positions postings as three arrays"""
+    postings = {}
+    for pos, value in enumerate(values):
+        for gram in trigrams(value):
+            postings.setdefault(gram, []).append(pos)
+
+    grams = sorted(postings)
+    offsets = np.zeros(len(grams) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(postings[gram]) for gram in grams])
+    rows = np.fromiter((pos for gram in grams for pos in postings[gram]),
+                       dtype=np.int32, count=int(offsets[-1]))
+
+    np.save(os.path.join(folder, f"{column}.grams.npy"), np.asarray(grams, dtype="<U3"))
+    np.save(os.path.join(folder, f"{column}.offsets.npy"), offsets)
+    np.save(os.path.join(folder, f"{column}.rows.npy"), rows)
+    return [f"{column}.grams", f"{column}.offsets", f"{column}.rows"]
+
+
+def index_path(master_file_path):
+    return master_file_path + INDEX_SUFFIX
+
+
+def _source_meta(master_file_path):
+    stat = os.stat(master_file_path)
+    return {'version': INDEX_VERSION, 'source_size': stat.st_size, 'source_mtime': stat.st_mtime}
+
+
+def _read_meta(path):
+    try:
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def is_fresh(master_file_path):
+    """True if the index exists and was built from the current master file"""
+    meta = _read_meta(index_path(master_file_path))
+    if not meta:
+        return False
+    source = _source_meta(master_file_path)
+    return all(meta.get(key) == value for key, value in source.items())
+
+
+def build_index(master_file_path):
+    """
+    Build the index folder for master_file_path (atomically replacing any old one).
+
+    Returns:
+        int: number of EQUITY rows indexed
+    """
+    wanted = set(TEXT_COLUMNS + PASSTHROUGH_COLUMNS)
+    df = pd.read_csv(master_file_path, low_memory=False,
+                     usecols=lambda c: c in wanted,
+                     dtype={"SEM_SMST_SECURITY_ID": str})
+
+    if "SEM_INSTRUMENT_NAME" not in df.columns:
+        raise ValueError("Master file has no SEM_INSTRUMENT_NAME column")
+    df = df[df["SEM_INSTRUMENT_NAME"].astype(str).str.upper() == "EQUITY"].copy()
+
+    columns = {}
+    for col in TEXT_COLUMNS:
+        if col in df.columns:
+            columns[col] = df[col].astype(str).str.strip().str.upper()
+        else:
+            columns[col] = pd.Series("", index=df.index)
+    for col in PASSTHROUGH_COLUMNS:
+        if col in df.columns:
+            columns[col] = df[col].fillna("").astype(str)
+        else:
+            columns[col] = pd.Series("", index=df.index)
+    for col, source in NORM_COLUMNS.items():
+        columns[col] = columns[source].apply(normalize_text)
+
+    # Exchange priority: NSE > BSE > Others
+    exchange = columns["SEM_EXM_EXCH_ID"]
+    priority = np.where(exchange == "NSE", 1, np.where(exchange == "BSE", 2, 3)).astype(np.int64)
+
+    path = index_path(master_file_path)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    for col, values in columns.items():
+        # Fixed-width unicode so the array can be memory-mapped (no pickled objects)
+        np.save(os.path.join(tmp_path, f"{col}.npy"), np.asarray(values.tolist(), dtype=str))
+    np.save(os.path.join(tmp_path, "exchange_priority.npy"), priority)
+
+    postings = []
+    for col in NORM_COLUMNS:
+        postings += _save_postings(tmp_path, col, columns[col].tolist())
+
+    meta = _source_meta(master_file_path)
+    meta['rows'] = len(df)
+    meta['columns'] = list(columns) + ["exchange_priority"]
+    meta['postings'] = postings
+    with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    print(f"✅ Built master index: {len(df)} EQUITY rows → {path}")
+    return len(df)
+
+
+def remove_index(master_file_path):
+    shutil.rmtree(index_path(master_file_path), ignore_errors=True)
+
+
+def load_index(master_file_path):
+    """
+    Memory-map the index of master_file_path, (re)building it if stale.
+
+    Returns:
+        dict of column (or posting array) name -> read-only numpy array
+    """
+    with _lock:
+        if not is_fresh(master_file_path):
+            print("🔧 Master index missing or stale, building it...")
+            build_index(master_file_path)
+            _loaded.pop(master_file_path, None)
+
+        path = index_path(master_file_path)
+        meta = _read_meta(path)
+        cached = _loaded.get(master_file_path)
+        if cached and cached[0] == meta:
+            return cached[1]
+
+        # An empty array cannot be mapped
+        mmap_mode = "r" if meta['rows'] else None
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+                  for name in meta['columns'] + meta['postings']}
+        _loaded[master_file_path] = (meta, arrays)
+        return arrays
+
+
+def load_master_frame(master_file_path):
+    """The indexed EQUITY rows as a DataFrame (the columns Step 9 works with)"""
+    arrays = load_index(master_file_path)
+    columns = list(TEXT_COLUMNS + PASSTHROUGH_COLUMNS) + list(NORM_COLUMNS) + ["exchange_priority"]
+    return pd.DataFrame({col: (arrays[col].tolist() if arrays[col].dtype.kind == "U" else arrays[col])
+                         for col in columns})
+
+
+def trigram_candidates(arrays, column, query, limit=TRIGRAM_CANDIDATES):
+    """
+    Rows of a normalized column sharing trigrams with query.
+
+    Keeps the limit rows sharing the most trigrams (ties to the earlier
+    row), returned in master order.
+
+    Returns:
+        numpy array of row positions, or None if query is shorter than a
+        trigram or shares none with the column
+    """
+    query_grams = sorted(trigrams(query))
+    if not query_grams:
+        return None
+
+    grams = arrays[f"{column}.grams"]
+    offsets = arrays[f"{column}.offsets"]
+    rows = arrays[f"{column}.rows"]
+
+    hits = []
+    for i, gram in zip(np.searchsorted(grams, query_grams), query_grams):
+        if i < len(grams) and grams[i] == gram:
+            hits.append(rows[offsets[i]:offsets[i + 1]])
+    if not hits:
+        return None
+
+    positions, counts = np.unique(np.concatenate(hits), return_counts=True)
+    if len(positions) > limit:
+        keep = np.argsort(-counts, kind="stable")[:limit]
+        positions = np.sort(positions[keep])
+    return positions
+
+
+def _prefix_mask(values, prefix):
+    """values.startswith(prefix) for a fixed-width unicode array, on its raw code points"""
+    width = values.dtype.itemsize // 4
+    if len(prefix) > width or len(values) == 0:
+        return np.zeros(len(values), dtype=bool)
+    codes = np.frombuffer(prefix.encode("utf-32-le"), dtype=np.uint32)
+    chars = values.view(np.uint32).reshape(len(values), width)
+    return (chars[:, :len(prefix)] == codes).all(axis=1)
+
+
+def search(master_file_path, query, limit=20):
+    """
+    Rank master rows for a free-text symbol / company query.
+
+    Candidates come from the trigram index of all three key columns (a
+    prefix scan for queries under three characters). They are ordered by
+    exact key match, then symbol prefix match, then the best WRatio score
+    over the three keys, then exchange priority (NSE first).
+
+    Returns:
+        list of (row position, score)
+    """
+    arrays = load_index(master_file_path)
+    query = normalize_text(query)
+    if not query:
+        return []
+
+    if len(query) < 3:
+        prefix = np.zeros(len(arrays["exchange_priority"]), dtype=bool)
+        for col in ("SEM_TRADING_SYMBOL_NORM", "SEM_CUSTOM_SYMBOL_NORM"):
+            prefix |= _prefix_mask(arrays[col], query)
+        positions = np.flatnonzero(prefix)[:TRIGRAM_CANDIDATES]
+    else:
+        found = [trigram_candidates(arrays, col, query) for col in NORM_COLUMNS]
+        found = [positions for positions in found if positions is not None]
+        if not found:
+            return []
+        positions = np.unique(np.concatenate(found))
+
+    if len(positions) == 0:
+        return []
+
+    keys = {col: arrays[col][positions].tolist() for col in NORM_COLUMNS}
+    scores = np.max([process.cdist([query], keys[col], scorer=fuzz.WRatio)[0]
+                     for col in NORM_COLUMNS], axis=0)
+    priority = arrays["exchange_priority"][positions]
+
+    ranked = []
+    for i, pos in enumerate(positions.tolist()):
+        exact = any(keys[col][i] == query for col in NORM_COLUMNS)
+        prefix = (keys["SEM_TRADING_SYMBOL_NORM"][i].startswith(query)
+                  or keys["SEM_CUSTOM_SYMBOL_NORM"][i].startswith(query))
+        ranked.append((not exact, not prefix, -float(scores[i]), int(priority[i]), pos))
+    ranked.sort()
+    return [(pos, round(-neg_score, 1)) for _, _, neg_score, _, pos in ranked[:limit]]
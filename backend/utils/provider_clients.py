@@ -0,0 +1,73 @@
+"""
+Process-wide registry of credentialed provider clients.
+
+Clients are built from explicit credentials, never from process-global state
+(GOOGLE_APPLICATION_CREDENTIALS, aai.settings.api_key). Jobs running
+concurrently in one worker therefore cannot pick up each other's
+credentials. Each client is cached per process and reused across jobs, so
+construction and auth discovery happen once.
+
+    translate_client = get_translate_client(credentials_path)
+    transcriber = get_assemblyai_transcriber(api_key, config)
+"""
+
+import os
+import hashlib
+import threading
+import assemblyai as aai
+from google.cloud import translate_v2 as translate
+from google.oauth2 import service_account
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _fingerprint(secret):
+    """Cache key component that does not keep the raw secret in the key"""
+    return hashlib.sha256(secret.encode("utf-8")).hexdigest()[:16]
+
+
+def _get_or_create(key, factory):
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = factory()
+            _clients[key] = client
+        return client
+
+
+def get_translate_client(credentials_path):
+    """
+    Google Cloud Translate v2 client for a service-account JSON file.
+
+    The cache key includes the file's modification time, so replacing the
+    credentials file in Settings builds a fresh client.
+    """
+    if not os.path.exists(credentials_path):
+        raise FileNotFoundError(f"Google Cloud credentials file not found at: {credentials_path}")
+
+    key = ('google_translate', os.path.abspath(credentials_path), os.path.getmtime(credentials_path))
+
+    def build():
+        print("🔑 Initializing Google Cloud Translate client...")
+        credentials = service_account.Credentials.from_service_account_file(
+            credentials_path,
+            scopes=["https://www.googleapis.com/auth/cloud-platform"]
+        )
+        return translate.Client(credentials=credentials)
+
+    return _get_or_create(key, build)
+
+
+def get_assemblyai_client(api_key):
+    """AssemblyAI client with its own settings (not the global aai.settings)"""
+    if not api_key:
+        raise ValueError("AssemblyAI API key is required")
+
+    key = ('assemblyai', _fingerprint(api_key))
+    return _get_or_create(key, lambda: aai.Client(settings=aai.Settings(api_key=api_key)))
+
+
+def get_assemblyai_transcriber(api_key, config=None):
+    """Transcriber bound to the cached client for api_key (cheap, not cached)"""
+    return aai.Transcriber(client=get_assemblyai_client(api_key), config=config)
@@ -0,0 +1,91 @@
+"""
+Shared token-bucket rate limiters for outbound API calls.
+
+Limiters are registered by name and shared by every thread in the process,
+so concurrent pipeline jobs (and concurrent batches within one step) draw
+from the same budget for a provider:
+
+    limiter = get_rate_limiter('google_translate', rate=5, capacity=10)
+    limiter.acquire()      # blocks until a token is available
+    client.translate(...)
+"""
+
+import time
+import threading
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+
+    Tokens refill continuously at `rate` per second up to `capacity`;
+    acquire() blocks until enough tokens are available.
+    """
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        """Take tokens if available right now; returns True on success"""
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1, timeout=None):
+        """
+        Block until `tokens` are available and take them.
+
+        Returns:
+            bool: True once acquired, False if timeout (seconds) expired first
+        """
+        if tokens > self.capacity:
+            raise ValueError(f"Cannot acquire {tokens} tokens from a bucket of {self.capacity}")
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate
+
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name, rate, capacity=None):
+    """
+    Return the process-wide limiter for `name`, creating it on first use.
+
+    rate/capacity only apply when the limiter is created; later callers
+    share the existing bucket.
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = TokenBucket(rate, capacity)
+            _limiters[name] = limiter
+        return limiter
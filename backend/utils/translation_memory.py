@@ -0,0 +1,94 @@
+"""
+Translation memory shared across jobs.
+
+Channel jingles, disclaimers and recurring anchor phrases are translated once
+and reused by every later job. Entries are keyed by a SHA-256 of the
+normalized source text, the language pair and the engine version, so a new
+engine version never serves stale translations. The table is kept under
+TM_MAX_ENTRIES rows by evicting the least recently used entries.
+
+The memory is an optimization only: database errors are logged and the
+caller falls back to translating everything.
+"""
+
+import os
+import re
+import hashlib
+import unicodedata
+from backend.utils.database import get_db_cursor
+
+TM_MAX_ENTRIES = int(os.environ.get('TRANSLATION_MEMORY_MAX_ENTRIES', 200000))
+TM_ENABLED = os.environ.get('TRANSLATION_MEMORY', 'true').lower() in ('1', 'true', 'yes')
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """Unicode-normalize, collapse whitespace and casefold source text"""
+    text = unicodedata.normalize("NFKC", text)
+    return _WHITESPACE.sub(" ", text).strip().casefold()
+
+
+def memory_key(text, source_lang, target_lang, engine):
+    """Hash of normalized text + language pair + engine version"""
+    raw = "\x1f".join([engine, source_lang, target_lang, normalize_text(text)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def lookup(keys):
+    """
+    Fetch stored translations and mark them as recently used.
+
+    Returns:
+        dict of key -> translated text for the keys found
+    """
+    keys = list(set(keys))
+    if not keys or not TM_ENABLED:
+        return {}
+
+    try:
+        with get_db_cursor(commit=True) as cursor:
+            cursor.execute("""
+                UPDATE translation_memory
+                SET hit_count = hit_count + 1, last_used_at = CURRENT_TIMESTAMP
+                WHERE key = ANY(%s)
+                RETURNING key, translated_text
+            """, (keys,))
+            return {row['key']: row['translated_text'] for row in cursor.fetchall()}
+    except Exception as e:
+        print(f"⚠️ Translation memory lookup failed: {str(e)}")
+        return {}
+
+
+def store(entries, source_lang, target_lang, engine, max_entries=TM_MAX_ENTRIES):
+    """
+    Save new translations and evict least recently used entries over the cap.
+
+    Args:
+        entries: iterable of (key, source_text, translated_text)
+    """
+    rows = [(key, source_lang, target_lang, engine, src, dst) for key, src, dst in entries]
+    if not rows or not TM_ENABLED:
+        return
+
+    try:
+        with get_db_cursor(commit=True) as cursor:
+            cursor.executemany("""
+                INSERT INTO translation_memory (key, source_lang, target_lang, engine, source_text, translated_text)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ON CONFLICT (key) DO UPDATE
+                SET translated_text = EXCLUDED.translated_text, last_used_at = CURRENT_TIMESTAMP
+            """, rows)
+
+            cursor.execute("""
+                DELETE FROM translation_memory
+                WHERE key IN (
+                    SELECT key FROM translation_memory
+                    ORDER BY last_used_at DESC
+                    OFFSET %s
+                )
+            """, (max_entries,))
+            if cursor.rowcount:
+                print(f"🧹 Evicted {cursor.rowcount} least recently used translation memory entries")
+    except Exception as e:
+        print(f"⚠️ Translation memory update failed: {str(e)}")